@@ -28,6 +28,7 @@ from eolie.database_bookmarks import DatabaseBookmarks
 from eolie.database_adblock import DatabaseAdblock
 from eolie.sqlcursor import SqlCursor
 from eolie.search import Search
+from eolie.uri_completion import UriCompletion
 from eolie.download_manager import DownloadManager
 from eolie.menu_pages import PagesMenu
 from eolie.dbus_helper import DBusHelper
@@ -125,6 +126,8 @@ class Application(Gtk.Application):
         self.adblock.update()
         self.art = Art()
         self.search = Search()
+        self.completion = UriCompletion()
+        self.completion.load()
         self.download_manager = DownloadManager()
 
         shortcut_action = Gio.SimpleAction.new('shortcut',
@@ -257,6 +260,9 @@ class Application(Gtk.Application):
             Save window position and view
         """
         self.download_manager.cancel()
+        # Db is locked while syncing, pending visits are lost
+        if self.sync_worker is None or not self.sync_worker.syncing:
+            self.bookmarks.save_visits()
         self.adblock.stop()
         if self.sync_worker is not None:
             self.sync_worker.stop()
@@ -0,0 +1,91 @@
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from html.parser import HTMLParser
+
+
+class BookmarksHTMLParser(HTMLParser):
+    """
+        Incremental parser for Netscape bookmarks files
+        Feed it with chunks and pop parsed bookmarks
+    """
+
+    def __init__(self):
+        """
+            Init parser
+        """
+        HTMLParser.__init__(self)
+        self.__bookmarks = []
+        # Folder names for opened <dl>
+        self.__folders = []
+        # Last folder name, becomes current folder on next <dl>
+        self.__folder = ""
+        self.__tag = None
+        self.__text = ""
+        self.__href = None
+        self.__tags = None
+
+    def pop_bookmarks(self):
+        """
+            Get bookmarks parsed since last call
+            @return [(title, uri, tags)] as [(str, str, [str])]
+        """
+        bookmarks = self.__bookmarks
+        self.__bookmarks = []
+        return bookmarks
+
+    def handle_starttag(self, tag, attrs):
+        """
+            Handle start tag
+            @param tag as str
+            @param attrs as [(str, str)]
+        """
+        if tag == "dl":
+            self.__folders.append(self.__folder)
+            self.__folder = ""
+        elif tag in ["a", "h3"]:
+            attrs = dict(attrs)
+            self.__tag = tag
+            self.__text = ""
+            self.__href = attrs.get("href")
+            self.__tags = attrs.get("tags")
+
+    def handle_endtag(self, tag):
+        """
+            Handle end tag
+            @param tag as str
+        """
+        if tag == "dl":
+            if self.__folders:
+                self.__folders.pop(-1)
+        elif tag == self.__tag:
+            self.__tag = None
+            title = self.__text.strip()
+            # A link without uri is a folder
+            if tag == "h3" or self.__href is None:
+                self.__folder = title
+                return
+            if self.__tags:
+                tags = [t.strip() for t in self.__tags.split(",")]
+            elif self.__folders:
+                tags = [self.__folders[-1]]
+            else:
+                tags = []
+            self.__bookmarks.append((title, self.__href, tags))
+
+    def handle_data(self, data):
+        """
+            Handle text
+            @param data as str
+        """
+        if self.__tag is not None:
+            self.__text += data
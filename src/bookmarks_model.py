@@ -0,0 +1,546 @@
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GObject, GLib
+
+from threading import Lock
+
+from eolie.localized import get_sort_key
+from eolie.utils import get_canonical_uri
+
+
+class BookmarkItem:
+    """
+        A cached bookmark
+    """
+
+    def __init__(self, title, uri, guid, popularity, deleted):
+        """
+            Init item
+            @param title as str
+            @param uri as str
+            @param guid as str
+            @param popularity as int
+            @param deleted as bool
+        """
+        self.title = title
+        self.uri = uri
+        self.canonical = get_canonical_uri(uri)
+        self.guid = guid
+        self.popularity = popularity
+        self.deleted = deleted
+        self.tag_ids = set()
+
+
+class BookmarksModel(GObject.GObject):
+    """
+        In memory bookmarks, kept coherent by DatabaseBookmarks writes
+        Signals are always emitted in main thread, tags-changed is emitted
+        once per main loop iteration when tags or tags count changed
+    """
+    __gsignals__ = {
+        "bookmark-added": (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+        "bookmark-changed": (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+        "bookmark-removed": (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+        "tags-changed": (GObject.SignalFlags.RUN_FIRST, None, ())
+    }
+
+    def __init__(self):
+        """
+            Init model
+        """
+        GObject.GObject.__init__(self)
+        # Writes may happen in sync/import threads
+        self.__lock = Lock()
+        self.__tags_changed_pending = False
+        self.__reset()
+
+    def load(self, sql):
+        """
+            Load model from db
+            @param sql as sqlite cursor
+        """
+        with self.__lock:
+            self.__reset()
+            result = sql.execute("SELECT rowid, title, uri, guid,\
+                                         popularity, del\
+                                  FROM bookmarks")
+            for (bookmark_id, title, uri, guid, popularity, deleted) in result:
+                item = BookmarkItem(title, uri, guid, popularity, deleted)
+                self.__bookmarks[bookmark_id] = item
+                self.__guids[guid] = bookmark_id
+                if not deleted:
+                    self.__uris[item.canonical] = bookmark_id
+            result = sql.execute("SELECT rowid, title, sort_key FROM tags")
+            for (tag_id, title, sort_key) in result:
+                self.__tags[tag_id] = (title, sort_key)
+                self.__tag_ids[title] = tag_id
+                self.__tag_bookmarks[tag_id] = set()
+            result = sql.execute("SELECT bookmark_id, tag_id\
+                                  FROM bookmarks_tags")
+            for (bookmark_id, tag_id) in result:
+                if bookmark_id in self.__bookmarks and tag_id in self.__tags:
+                    self.__bookmarks[bookmark_id].tag_ids.add(tag_id)
+                    self.__tag_bookmarks[tag_id].add(bookmark_id)
+        self.__emit_tags_changed()
+
+    def add(self, bookmark_id, title, uri, guid, tag_ids):
+        """
+            Add a bookmark
+            @param bookmark_id as int
+            @param title as str
+            @param uri as str
+            @param guid as str
+            @param tag_ids as [int]
+        """
+        with self.__lock:
+            item = BookmarkItem(title, uri, guid, 0, False)
+            self.__bookmarks[bookmark_id] = item
+            self.__guids[guid] = bookmark_id
+            self.__uris[item.canonical] = bookmark_id
+            for tag_id in tag_ids:
+                if tag_id in self.__tag_bookmarks:
+                    item.tag_ids.add(tag_id)
+                    self.__tag_bookmarks[tag_id].add(bookmark_id)
+            tagged = bool(item.tag_ids)
+        self.__emit("bookmark-added", bookmark_id)
+        if tagged:
+            self.__emit_tags_changed()
+
+    def remove(self, bookmark_id):
+        """
+            Remove a bookmark
+            @param bookmark_id as int
+        """
+        with self.__lock:
+            item = self.__bookmarks.pop(bookmark_id, None)
+            if item is None:
+                return
+            if self.__guids.get(item.guid) == bookmark_id:
+                del self.__guids[item.guid]
+            if self.__uris.get(item.canonical) == bookmark_id:
+                del self.__uris[item.canonical]
+            for tag_id in item.tag_ids:
+                self.__tag_bookmarks[tag_id].discard(bookmark_id)
+        if not item.deleted:
+            self.__emit("bookmark-removed", bookmark_id)
+            if item.tag_ids:
+                self.__emit_tags_changed()
+
+    def set_deleted(self, bookmark_id, deleted):
+        """
+            Mark bookmark as deleted
+            @param bookmark_id as int
+            @param deleted as bool
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is None or item.deleted == deleted:
+                return
+            item.deleted = deleted
+            if deleted:
+                if self.__uris.get(item.canonical) == bookmark_id:
+                    del self.__uris[item.canonical]
+            else:
+                self.__uris[item.canonical] = bookmark_id
+            tagged = bool(item.tag_ids)
+        if deleted:
+            self.__emit("bookmark-removed", bookmark_id)
+        else:
+            self.__emit("bookmark-added", bookmark_id)
+        if tagged:
+            self.__emit_tags_changed()
+
+    def set_title(self, bookmark_id, title):
+        """
+            Set bookmark title
+            @param bookmark_id as int
+            @param title as str
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is None:
+                return
+            item.title = title
+        self.__emit("bookmark-changed", bookmark_id)
+
+    def set_uri(self, bookmark_id, uri):
+        """
+            Set bookmark uri
+            @param bookmark_id as int
+            @param uri as str
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is None:
+                return
+            if self.__uris.get(item.canonical) == bookmark_id:
+                del self.__uris[item.canonical]
+            item.uri = uri
+            item.canonical = get_canonical_uri(uri)
+            if not item.deleted:
+                self.__uris[item.canonical] = bookmark_id
+        self.__emit("bookmark-changed", bookmark_id)
+
+    def set_more_popular(self, bookmark_id):
+        """
+            Increment bookmark popularity
+            @param bookmark_id as int
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is not None:
+                item.popularity += 1
+
+    def set_popularity(self, bookmark_id, popularity):
+        """
+            Set bookmark popularity
+            @param bookmark_id as int
+            @param popularity as int
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is not None:
+                item.popularity = popularity
+
+    def add_tag(self, tag_id, title):
+        """
+            Add a tag
+            @param tag_id as int
+            @param title as str
+        """
+        with self.__lock:
+            self.__tags[tag_id] = (title, get_sort_key(title))
+            self.__tag_ids[title] = tag_id
+            self.__tag_bookmarks[tag_id] = set()
+        self.__emit_tags_changed()
+
+    def del_tag(self, tag_id):
+        """
+            Remove a tag
+            @param tag_id as int
+        """
+        with self.__lock:
+            self.__del_tag(tag_id)
+        self.__emit_tags_changed()
+
+    def set_tag_title(self, tag_id, title):
+        """
+            Set tag title
+            @param tag_id as int
+            @param title as str
+        """
+        with self.__lock:
+            if tag_id not in self.__tags:
+                return
+            (old, sort_key) = self.__tags[tag_id]
+            if self.__tag_ids.get(old) == tag_id:
+                del self.__tag_ids[old]
+            self.__tags[tag_id] = (title, get_sort_key(title))
+            self.__tag_ids[title] = tag_id
+        self.__emit_tags_changed()
+
+    def add_tag_to(self, tag_id, bookmark_id):
+        """
+            Add tag to bookmark
+            @param tag_id as int
+            @param bookmark_id as int
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is None or tag_id not in self.__tags:
+                return
+            item.tag_ids.add(tag_id)
+            self.__tag_bookmarks[tag_id].add(bookmark_id)
+        self.__emit("bookmark-changed", bookmark_id)
+        self.__emit_tags_changed()
+
+    def del_tag_from(self, tag_id, bookmark_id):
+        """
+            Remove tag from bookmark
+            @param tag_id as int
+            @param bookmark_id as int
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is None:
+                return
+            item.tag_ids.discard(tag_id)
+            if tag_id in self.__tag_bookmarks:
+                self.__tag_bookmarks[tag_id].discard(bookmark_id)
+        self.__emit("bookmark-changed", bookmark_id)
+        self.__emit_tags_changed()
+
+    def clean_tags(self):
+        """
+            Remove tags without bookmarks (deleted ones do not count)
+        """
+        with self.__lock:
+            orphans = []
+            for (tag_id, bookmark_ids) in self.__tag_bookmarks.items():
+                if all(self.__bookmarks[bookmark_id].deleted
+                       for bookmark_id in bookmark_ids):
+                    orphans.append(tag_id)
+            for tag_id in orphans:
+                self.__del_tag(tag_id)
+        if orphans:
+            self.__emit_tags_changed()
+
+    def exists_guid(self, guid):
+        """
+            True if guid exists
+            @param guid as str
+            @return bool
+        """
+        with self.__lock:
+            return guid in self.__guids
+
+    def get_id(self, uri):
+        """
+            Get id for uri, ignore deleted bookmarks
+            Uris are compared with utils.get_canonical_uri()
+            @param uri as str
+            @return int/None
+        """
+        canonical = get_canonical_uri(uri)
+        with self.__lock:
+            return self.__uris.get(canonical)
+
+    def get_id_by_guid(self, guid):
+        """
+            Get id for guid
+            @param guid as str
+            @return int/None
+        """
+        with self.__lock:
+            return self.__guids.get(guid)
+
+    def get_title(self, bookmark_id):
+        """
+            Get bookmark title
+            @param bookmark_id as int
+            @return str
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            return "" if item is None else item.title
+
+    def get_uri(self, bookmark_id):
+        """
+            Get bookmark uri
+            @param bookmark_id as int
+            @return str
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            return "" if item is None else item.uri
+
+    def get_guid(self, bookmark_id):
+        """
+            Get bookmark guid
+            @param bookmark_id as int
+            @return str/None
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            return None if item is None else item.guid
+
+    def get_tags(self, bookmark_id):
+        """
+            Get tags for bookmark
+            @param bookmark_id as int
+            @return [str]
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            if item is None:
+                return []
+            tags = [self.__tags[tag_id] for tag_id in item.tag_ids]
+        return [title for (title, sort_key) in
+                sorted(tags, key=lambda tag: tag[1])]
+
+    def get_tag_ids(self, bookmark_id):
+        """
+            Get tag ids for bookmark
+            @param bookmark_id as int
+            @return set(int)
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            return set() if item is None else set(item.tag_ids)
+
+    def has_tag(self, bookmark_id, tag):
+        """
+            True if bookmark has tag
+            @param bookmark_id as int
+            @param tag as str
+            @return bool
+        """
+        with self.__lock:
+            item = self.__bookmarks.get(bookmark_id)
+            tag_id = self.__tag_ids.get(tag)
+            return item is not None and tag_id in item.tag_ids
+
+    def get_tag_id(self, title):
+        """
+            Get tag id for title
+            @param title as str
+            @return int/None
+        """
+        with self.__lock:
+            return self.__tag_ids.get(title)
+
+    def get_tag_title(self, tag_id):
+        """
+            Get tag title
+            @param tag_id as int
+            @return str/None
+        """
+        with self.__lock:
+            tag = self.__tags.get(tag_id)
+        return None if tag is None else tag[0]
+
+    def get_all_tags(self):
+        """
+            Get all tags
+            @return [(int, str)]
+        """
+        with self.__lock:
+            tags = list(self.__tags.items())
+        return [(tag_id, title) for (tag_id, (title, sort_key)) in
+                sorted(tags, key=lambda tag: tag[1][1])]
+
+    def get_bookmarks(self, tag_id):
+        """
+            Get bookmarks for tag, most popular first
+            @param tag_id as int
+            @return [(int, str, str)]
+        """
+        with self.__lock:
+            items = self.__get_items(self.__tag_bookmarks.get(tag_id, []))
+        return self.__get_sorted(items)
+
+    def get_bookmarks_for_tags(self, tag_ids):
+        """
+            Get bookmarks having all tags, most popular first
+            @param tag_ids as [int]
+            @return [(int, str, str)]
+        """
+        with self.__lock:
+            sets = [self.__tag_bookmarks.get(tag_id, set())
+                    for tag_id in set(tag_ids)]
+            if not sets:
+                return []
+            # Start from smallest set
+            sets.sort(key=len)
+            bookmark_ids = sets[0].intersection(*sets[1:])
+            items = self.__get_items(bookmark_ids)
+        return self.__get_sorted(items)
+
+    def get_tags_count(self):
+        """
+            Get bookmarks count for tags, deleted bookmarks do not count
+            @return {tag_id: count} as {int: int}
+        """
+        counts = {}
+        with self.__lock:
+            for (tag_id, bookmark_ids) in self.__tag_bookmarks.items():
+                count = 0
+                for bookmark_id in bookmark_ids:
+                    if not self.__bookmarks[bookmark_id].deleted:
+                        count += 1
+                if count > 0:
+                    counts[tag_id] = count
+        return counts
+
+#######################
+# PRIVATE             #
+#######################
+    def __reset(self):
+        """
+            Clear model
+        """
+        # {bookmark_id: BookmarkItem}
+        self.__bookmarks = {}
+        # {uri: bookmark_id}, deleted bookmarks not included
+        self.__uris = {}
+        # {guid: bookmark_id}
+        self.__guids = {}
+        # {tag_id: (title, sort_key)}
+        self.__tags = {}
+        # {title: tag_id}
+        self.__tag_ids = {}
+        # {tag_id: set(bookmark_id)}
+        self.__tag_bookmarks = {}
+
+    def __del_tag(self, tag_id):
+        """
+            Remove tag, lock must be held
+            @param tag_id as int
+        """
+        tag = self.__tags.pop(tag_id, None)
+        if tag is None:
+            return
+        if self.__tag_ids.get(tag[0]) == tag_id:
+            del self.__tag_ids[tag[0]]
+        for bookmark_id in self.__tag_bookmarks.pop(tag_id):
+            self.__bookmarks[bookmark_id].tag_ids.discard(tag_id)
+
+    def __get_items(self, bookmark_ids):
+        """
+            Get bookmarks not deleted and not folders, lock must be held
+            @param bookmark_ids as [int]
+            @return [(int, str, str, int)]
+        """
+        items = []
+        for bookmark_id in bookmark_ids:
+            item = self.__bookmarks[bookmark_id]
+            if not item.deleted and item.guid != item.uri:
+                items.append((bookmark_id, item.title,
+                              item.uri, item.popularity))
+        return items
+
+    def __get_sorted(self, items):
+        """
+            Sort items by popularity
+            @param items as [(int, str, str, int)]
+            @return [(int, str, str)]
+        """
+        items.sort(key=lambda x: x[3], reverse=True)
+        return [(bookmark_id, title, uri)
+                for (bookmark_id, title, uri, popularity) in items]
+
+    def __emit_tags_changed(self):
+        """
+            Emit tags-changed in main thread, once for pending changes
+        """
+        with self.__lock:
+            if self.__tags_changed_pending:
+                return
+            self.__tags_changed_pending = True
+        GLib.idle_add(self.__on_tags_changed)
+
+    def __emit(self, signal, *args):
+        """
+            Emit signal in main thread
+            @param signal as str
+            @param args as []
+        """
+        GLib.idle_add(self.emit, signal, *args)
+
+    def __on_tags_changed(self):
+        """
+            Emit tags-changed
+        """
+        with self.__lock:
+            self.__tags_changed_pending = False
+        self.emit("tags-changed")
@@ -13,6 +13,7 @@
 from gi.repository import Gtk, WebKit2, GLib
 
 from urllib.parse import urlparse
+from threading import Thread
 from time import time
 
 from eolie.stacksidebar import StackSidebar
@@ -253,11 +254,18 @@ class Container(Gtk.Overlay):
 
     def __on_readable(self, webview):
         """
-            Show readable button in titlebar
+            Show readable button in titlebar, index content if wanted
             @param webview as WebView
         """
         if webview == self.current.webview:
             self.__window.toolbar.title.show_readable_button(True)
+        if El().settings.get_value("history-content") and\
+                not webview.private:
+            thread = Thread(target=El().history.set_content,
+                            args=(webview.get_uri(),
+                                  webview.readable_content))
+            thread.daemon = True
+            thread.start()
 
     def __on_view_map(self, webview):
         """
@@ -352,6 +360,7 @@ class Container(Gtk.Overlay):
         if parsed.scheme in ["http", "https"] and\
                 not webview.private:
             mtime = round(time(), 2)
+            El().completion.add(uri)
             # Do not try to add to db if worker is syncing
             # We may lock sqlite and current webview otherwise
             # We use a queue and will commit items when sync is finished
@@ -393,6 +402,11 @@ class Container(Gtk.Overlay):
             @param webview as WebView
             @param event as WebKit2.LoadEvent
         """
+        # A page may change its title many times, count a visit once
+        if event == WebKit2.LoadEvent.COMMITTED and not webview.private:
+            uri = webview.get_uri()
+            if urlparse(uri).scheme in ["http", "https"]:
+                El().bookmarks.add_visit(uri, round(time(), 2))
         if webview != self.current.webview:
             return
         self.__window.toolbar.title.update_load_indicator(webview)
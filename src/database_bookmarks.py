@@ -13,12 +13,25 @@
 from gi.repository import GLib, Gio
 
 import sqlite3
+from time import time
+from pickle import load
 import itertools
+import codecs
+from bisect import bisect_left
+import os
+import shutil
+from tempfile import TemporaryDirectory
+from threading import Lock
 
-from eolie.utils import noaccents, get_random_string
+from eolie.utils import get_random_string, get_normalized
+from eolie.utils import get_position_key, get_position_key_between
+from eolie.utils import get_canonical_uri
 from eolie.define import El, EOLIE_LOCAL_PATH, CONFIG_PATH
-from eolie.localized import LocalizedCollation
+from eolie.localized import get_sort_key, get_collation
 from eolie.sqlcursor import SqlCursor
+from eolie.database_upgrade import DatabaseUpgrade
+from eolie.bookmarks_model import BookmarksModel
+from eolie.bookmarks_html import BookmarksHTMLParser
 
 
 class DatabaseBookmarks:
@@ -27,6 +40,11 @@ class DatabaseBookmarks:
     """
 
     DB_PATH = "%s/bookmarks.db" % EOLIE_LOCAL_PATH
+    __IMPORT_CHUNK_SIZE = 65536
+    # Bookmarks imported per transaction, main thread waits at most for one
+    __IMPORT_ROWS = 1000
+    # Folder is renumbered when a position key gets longer
+    __MAX_POSITION_KEY_SIZE = 32
 
     # SQLite documentation:
     # In SQLite, a column with type INTEGER PRIMARY KEY
@@ -61,6 +79,46 @@ class DatabaseBookmarks:
         """
             Create database tables or manage update if needed
         """
+        self.__upgrades = {
+            1: "ALTER TABLE bookmarks\
+                ADD COLUMN title_normalized TEXT NOT NULL DEFAULT ''",
+            2: self.__upgrade_title_normalized,
+            3: "ALTER TABLE tags\
+                ADD COLUMN sort_key TEXT NOT NULL DEFAULT ''",
+            4: self.__upgrade_sort_key,
+            5: "CREATE INDEX IF NOT EXISTS idx_bookmarks_guid\
+                ON bookmarks(guid)",
+            6: "CREATE INDEX IF NOT EXISTS idx_parents_bookmark_id\
+                ON parents(bookmark_id)",
+            7: "CREATE INDEX IF NOT EXISTS idx_parents_parent_guid\
+                ON parents(parent_guid)",
+            # Fractional position, see utils.get_position_key_between()
+            8: "ALTER TABLE bookmarks\
+                ADD COLUMN position_key TEXT NOT NULL DEFAULT ''",
+            9: self.__upgrade_position_key,
+            10: "CREATE INDEX IF NOT EXISTS idx_bookmarks_tags_tag_id\
+                 ON bookmarks_tags(tag_id, bookmark_id)",
+            11: "CREATE INDEX IF NOT EXISTS idx_bookmarks_tags_bookmark_id\
+                 ON bookmarks_tags(bookmark_id, tag_id)",
+            12: self.__upgrade_tags_count,
+            # Used for lookups, see utils.get_canonical_uri()
+            13: "ALTER TABLE bookmarks\
+                 ADD COLUMN canonical TEXT NOT NULL DEFAULT ''",
+            14: self.__upgrade_canonical,
+            15: "CREATE INDEX IF NOT EXISTS idx_bookmarks_canonical\
+                 ON bookmarks(canonical)",
+            # Last imported state for browsers, see import_chromium()
+            16: "CREATE TABLE IF NOT EXISTS imports (\
+                    source TEXT PRIMARY KEY,\
+                    checksum TEXT NOT NULL,\
+                    mtime INT NOT NULL)",
+            # Server times and changes to upload, see get_changes()
+            17: self.__upgrade_sync_state,
+            # Locale of tags sort keys, see __update_sort_keys()
+            18: "CREATE TABLE IF NOT EXISTS collation (\
+                    locale TEXT NOT NULL)",
+            19: self.__upgrade_duplicates
+        }
         f = Gio.File.new_for_path(self.DB_PATH)
         if not f.query_exists():
             try:
@@ -76,23 +134,37 @@ class DatabaseBookmarks:
                     sql.commit()
             except Exception as e:
                 print("DatabaseBookmarks::__init__(): %s" % e)
+        upgrade = DatabaseUpgrade(self, self.__upgrades)
+        upgrade.do_db_upgrade()
+        self.__update_sort_keys()
+        # Visits are counted in main thread, written by any thread
+        self.__visits = []
+        self.__visits_lock = Lock()
+        self.__model = BookmarksModel()
+        with SqlCursor(self) as sql:
+            self.__model.load(sql)
 
-    def add(self, title, uri, guid, tags, atime=0, commit=True):
+    def add(self, title, uri, guid, tags, atime=0, commit=True,
+            history_guids=None):
         """
             Add a new bookmark
             @param title as str
             @param uri as str
             @param guid as str
             @param tags as [str]
-            @param parent_guid as str
-            @param ctime as int
+            @param atime as int
             @param commit as bool
+            @param history_guids as {str: str}: preloaded with
+                   DatabaseHistory.get_guids_for_uris(), else looked up
             @return bookmark id as int
         """
         # Search if bookmark item exists in history
-        history_id = El().history.get_id(uri)
-        if history_id is not None:
-            guid = El().history.get_guid(history_id)
+        if history_guids is None:
+            history_id = El().history.get_id(uri)
+            if history_id is not None:
+                guid = El().history.get_guid(history_id)
+        else:
+            guid = history_guids.get(uri, guid)
         # Find an uniq guid
         while guid is None:
             guid = get_random_string(12)
@@ -101,21 +173,28 @@ class DatabaseBookmarks:
 
         with SqlCursor(self) as sql:
             result = sql.execute("INSERT INTO bookmarks\
-                                  (title, uri, popularity, guid, atime, mtime)\
-                                  VALUES (?, ?, ?, ?, ?, ?)",
-                                 (title, uri.rstrip('/'), 0, guid, atime, 0))
+                                  (title, title_normalized, uri, canonical,\
+                                   popularity, guid, atime, mtime)\
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (title, get_normalized(title),
+                                  uri.rstrip('/'), get_canonical_uri(uri),
+                                  0, guid, atime, 0))
             bookmarks_id = result.lastrowid
+            tag_ids = []
             for tag in tags:
                 if not tag:
                     continue
                 tag_id = self.get_tag_id(tag)
                 if tag_id is None:
-                    tag_id = self.add_tag(tag)
+                    tag_id = self.add_tag(tag, commit)
                 sql.execute("INSERT INTO bookmarks_tags\
                              (bookmark_id, tag_id) VALUES (?, ?)",
                             (bookmarks_id, tag_id))
+                tag_ids.append(tag_id)
             if commit:
                 sql.commit()
+            self.__model.add(bookmarks_id, title, uri.rstrip('/'), guid,
+                             tag_ids)
             return bookmarks_id
 
     def delete(self, bookmark_id, delete=True, commit=True):
@@ -131,6 +210,7 @@ class DatabaseBookmarks:
                          WHERE rowid=?", (delete, bookmark_id))
             if commit:
                 sql.commit()
+        self.__model.set_deleted(bookmark_id, delete)
 
     def remove(self, bookmark_id, commit=True):
         """
@@ -147,6 +227,26 @@ class DatabaseBookmarks:
                          WHERE bookmark_id=?", (bookmark_id,))
             if commit:
                 sql.commit()
+        self.__model.remove(bookmark_id)
+
+    def remove_all(self, bookmark_ids, commit=True):
+        """
+            Remove bookmarks from db
+            @param bookmark ids as [int]
+            @param commit as bool
+        """
+        rows = [(bookmark_id,) for bookmark_id in bookmark_ids]
+        with SqlCursor(self) as sql:
+            sql.executemany("DELETE FROM bookmarks\
+                             WHERE rowid=?", rows)
+            sql.executemany("DELETE FROM bookmarks_tags\
+                             WHERE bookmark_id=?", rows)
+            sql.executemany("DELETE FROM parents\
+                             WHERE bookmark_id=?", rows)
+            if commit:
+                sql.commit()
+        for bookmark_id in bookmark_ids:
+            self.__model.remove(bookmark_id)
 
     def add_tag(self, tag, commit=False):
         """
@@ -156,10 +256,11 @@ class DatabaseBookmarks:
         """
         with SqlCursor(self) as sql:
             result = sql.execute("INSERT INTO tags\
-                                  (title) VALUES (?)",
-                                 (tag,))
+                                  (title, sort_key) VALUES (?, ?)",
+                                 (tag, get_sort_key(tag)))
             if commit:
                 sql.commit()
+            self.__model.add_tag(result.lastrowid, tag)
             return result.lastrowid
 
     def del_tag(self, tag, commit=False):
@@ -177,6 +278,7 @@ class DatabaseBookmarks:
                          WHERE tag_id=?", (tag_id,))
             if commit:
                 sql.commit()
+            self.__model.del_tag(tag_id)
 
     def rename_tag(self, old, new):
         """
@@ -184,9 +286,13 @@ class DatabaseBookmarks:
             @param old as str
             @param new as str
         """
+        tag_id = self.get_tag_id(old)
         with SqlCursor(self) as sql:
-            sql.execute("UPDATE tags set title=? WHERE title=?", (new, old))
+            sql.execute("UPDATE tags set title=?, sort_key=? WHERE title=?",
+                        (new, get_sort_key(new), old))
             sql.commit()
+        if tag_id is not None:
+            self.__model.set_tag_title(tag_id, new)
 
     def get_tags(self, bookmark_id):
         """
@@ -194,14 +300,7 @@ class DatabaseBookmarks:
             @param bookmark id as int
             @return [str]
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT tags.title\
-                                  FROM tags, bookmarks_tags\
-                                  WHERE bookmarks_tags.bookmark_id=?\
-                                  AND bookmarks_tags.tag_id=tags.rowid\
-                                  ORDER BY title COLLATE LOCALIZED",
-                                 (bookmark_id,))
-            return list(itertools.chain(*result))
+        return self.__model.get_tags(bookmark_id)
 
     def has_tag(self, bookmark_id, tag):
         """
@@ -210,17 +309,7 @@ class DatabaseBookmarks:
             @param tag as str
             @return bool
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT tags.rowid\
-                                  FROM tags, bookmarks_tags\
-                                  WHERE tags.title=?\
-                                  AND bookmarks_tags.bookmark_id=?\
-                                  AND bookmarks_tags.tag_id=tags.rowid",
-                                 (tag, bookmark_id))
-            v = result.fetchone()
-            if v is not None:
-                return True
-            return False
+        return self.__model.has_tag(bookmark_id, tag)
 
     def get_id(self, uri):
         """
@@ -230,15 +319,7 @@ class DatabaseBookmarks:
         """
         if uri is None:
             return None
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT rowid\
-                                  FROM bookmarks\
-                                  WHERE uri=?\
-                                  AND del=0", (uri.rstrip('/'),))
-            v = result.fetchone()
-            if v is not None:
-                return v[0]
-            return None
+        return self.__model.get_id(uri.rstrip('/'))
 
     def get_id_by_guid(self, guid):
         """
@@ -246,39 +327,114 @@ class DatabaseBookmarks:
             @param guid as str
             @return id as int
         """
+        return self.__model.get_id_by_guid(guid)
+
+    def get_changes(self):
+        """
+            Get bookmarks changed since last upload, see change log
+            @return (last change id, bookmark ids, deleted guids)
+                    as (int, [int], [str])
+        """
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT rowid\
-                                  FROM bookmarks\
-                                  WHERE guid=?", (guid,))
+            result = sql.execute("SELECT MAX(id) FROM bookmarks_changes")
+            change_id = result.fetchone()[0] or 0
+            result = sql.execute("SELECT bookmarks.rowid\
+                                  FROM bookmarks_changes, bookmarks\
+                                  WHERE bookmarks.guid=bookmarks_changes.guid\
+                                  AND bookmarks_changes.tombstone=0\
+                                  AND bookmarks_changes.id <= ?\
+                                  AND bookmarks.del=0\
+                                  ORDER BY bookmarks_changes.id",
+                                 (change_id,))
+            bookmark_ids = list(itertools.chain(*result))
+            result = sql.execute("SELECT guid\
+                                  FROM bookmarks_changes\
+                                  WHERE tombstone=1 AND id <= ?\
+                                  ORDER BY id", (change_id,))
+            return (change_id, bookmark_ids, list(itertools.chain(*result)))
+
+    def get_pending_guids(self):
+        """
+            Get guids changed since last upload
+            @return set(str)
+        """
+        with SqlCursor(self) as sql:
+            result = sql.execute("SELECT guid FROM bookmarks_changes")
+            return set(itertools.chain(*result))
+
+    def clear_changes(self, guids, change_id=None, commit=True):
+        """
+            Remove guids from change log, uploaded or applied from remote
+            @param guids as [str]
+            @param change_id as int: keep changes done after this one
+            @param commit as bool
+        """
+        with SqlCursor(self) as sql:
+            if change_id is None:
+                sql.executemany("DELETE FROM bookmarks_changes WHERE guid=?",
+                                [(guid,) for guid in guids])
+            else:
+                sql.executemany("DELETE FROM bookmarks_changes\
+                                 WHERE guid=? AND id <= ?",
+                                [(guid, change_id) for guid in guids])
+            if commit:
+                sql.commit()
+
+    def get_sync_mtime(self, collection):
+        """
+            Get last known server time for collection
+            @param collection as str
+            @return float/None
+        """
+        with SqlCursor(self) as sql:
+            result = sql.execute("SELECT mtime FROM sync_state\
+                                  WHERE collection=?", (collection,))
             v = result.fetchone()
             if v is not None:
                 return v[0]
             return None
 
-    def get_ids_for_mtime(self, mtime):
+    def set_sync_mtime(self, collection, mtime, commit=True):
         """
-            Get ids that need to be synced related to mtime
-            @param mtime as int
-            @return [int]
+            Set last known server time for collection
+            @param collection as str
+            @param mtime as float
+            @param commit as bool
         """
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT rowid\
-                                  FROM bookmarks\
-                                  WHERE mtime > ?\
-                                  AND uri != guid\
-                                  AND del=0", (mtime,))
-            return list(itertools.chain(*result))
+            sql.execute("INSERT OR REPLACE INTO sync_state (collection, mtime)\
+                         VALUES (?, ?)", (collection, mtime))
+            if commit:
+                sql.commit()
 
-    def get_deleted_ids(self):
+    def get_tree(self):
         """
-            Get ids that need to be synced related to mtime
-            @return [int]
+            Get all bookmarks with their parent and all folders children
+            @return (items, children) as
+                    ({guid: (bookmark_id, title, parent_guid, parent_name)},
+                     {parent_guid: [guid]})
         """
+        items = {}
+        children = {}
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT rowid\
+            result = sql.execute("SELECT bookmarks.guid, bookmarks.rowid,\
+                                         bookmarks.title,\
+                                         parents.parent_guid,\
+                                         parents.parent_name\
                                   FROM bookmarks\
-                                  WHERE del=1")
-            return list(itertools.chain(*result))
+                                  LEFT JOIN parents\
+                                  ON parents.bookmark_id=bookmarks.rowid\
+                                  ORDER BY bookmarks.position_key ASC")
+            for (guid, bookmark_id, title, parent_guid, parent_name) in result:
+                if parent_guid is None:
+                    items[guid] = (bookmark_id, title, "unfiled", "")
+                    continue
+                items[guid] = (bookmark_id, title, parent_guid, parent_name)
+                if parent_guid in children.keys():
+                    children[parent_guid].append(guid)
+                else:
+                    children[parent_guid] = [guid]
+        return (items, children)
 
     def get_parent_guid(self, bookmark_id):
         """
@@ -295,6 +451,54 @@ class DatabaseBookmarks:
                 return v[0]
             return "unfiled"
 
+    def get_records(self, bookmark_ids):
+        """
+            Get complete bookmark records for ids
+            @param bookmark_ids as [int]
+            @return [(bookmark_id, guid, uri, title, parent_id, parent_guid,
+                      parent_name, tags)]
+                     as [(int, str, str, str, int, str, str, [str])]
+        """
+        records = []
+        with SqlCursor(self) as sql:
+            # Stay below SQLite max variable number
+            for i in range(0, len(bookmark_ids), 500):
+                chunk = bookmark_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                tags = {}
+                result = sql.execute("SELECT bookmarks_tags.bookmark_id,\
+                                             tags.title\
+                                      FROM bookmarks_tags, tags\
+                                      WHERE bookmarks_tags.bookmark_id\
+                                      IN (%s)\
+                                      AND bookmarks_tags.tag_id=tags.rowid\
+                                      ORDER BY tags.sort_key" % placeholders,
+                                     chunk)
+                for (bookmark_id, tag) in result:
+                    if bookmark_id in tags:
+                        tags[bookmark_id].append(tag)
+                    else:
+                        tags[bookmark_id] = [tag]
+                result = sql.execute("SELECT bookmarks.rowid,\
+                                             bookmarks.guid,\
+                                             bookmarks.uri,\
+                                             bookmarks.title,\
+                                             parent.rowid,\
+                                             COALESCE(parents.parent_guid,\
+                                                      'unfiled'),\
+                                             COALESCE(parents.parent_name, '')\
+                                      FROM bookmarks\
+                                      LEFT JOIN parents\
+                                      ON parents.bookmark_id=bookmarks.rowid\
+                                      LEFT JOIN bookmarks AS parent\
+                                      ON parent.guid=COALESCE(\
+                                            parents.parent_guid, 'unfiled')\
+                                      WHERE bookmarks.rowid IN (%s)" %
+                                     placeholders, chunk)
+                for row in result:
+                    records.append(row + (tags.get(row[0], []),))
+        return records
+
     def get_parent_name(self, bookmark_id):
         """
             Get parent for bookmark
@@ -316,14 +520,7 @@ class DatabaseBookmarks:
             @param bookmark id as int
             @return title as str
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT title\
-                                  FROM bookmarks\
-                                  WHERE rowid=?", (bookmark_id,))
-            v = result.fetchone()
-            if v is not None:
-                return v[0]
-            return ""
+        return self.__model.get_title(bookmark_id)
 
     def get_uri(self, bookmark_id):
         """
@@ -331,14 +528,7 @@ class DatabaseBookmarks:
             @param bookmark id as int
             @return uri as str
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT uri\
-                                  FROM bookmarks\
-                                  WHERE rowid=?", (bookmark_id,))
-            v = result.fetchone()
-            if v is not None:
-                return v[0]
-            return ""
+        return self.__model.get_uri(bookmark_id)
 
     def get_guid(self, bookmark_id):
         """
@@ -346,23 +536,41 @@ class DatabaseBookmarks:
             @param bookmark id as int
             @return guid as str
         """
+        return self.__model.get_guid(bookmark_id)
+
+    def get_sync_items(self):
+        """
+            Get all bookmarks with sync related data
+            @return {guid: (bookmark_id, mtime, parent_guid, parent_name)}
+                    as {str: (int, float, str, str)}
+        """
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT guid\
+            result = sql.execute("SELECT bookmarks.guid, bookmarks.rowid,\
+                                         bookmarks.mtime,\
+                                         parents.parent_guid,\
+                                         parents.parent_name\
                                   FROM bookmarks\
-                                  WHERE rowid=?", (bookmark_id,))
-            v = result.fetchone()
-            if v is not None:
-                return v[0]
-            return None
+                                  LEFT JOIN parents\
+                                  ON parents.bookmark_id=bookmarks.rowid")
+            return dict((row[0], row[1:]) for row in result)
 
-    def get_guids(self):
+    def get_all_bookmarks_tags(self):
         """
-            Get all guids
-            @return guids as [str]
+            Get tags for all bookmarks
+            @return {bookmark_id: {title: tag_id}} as {int: {str: int}}
         """
+        tags = {}
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT guid FROM bookmarks")
-            return list(itertools.chain(*result))
+            result = sql.execute("SELECT bookmarks_tags.bookmark_id,\
+                                         tags.title, tags.rowid\
+                                  FROM bookmarks_tags, tags\
+                                  WHERE bookmarks_tags.tag_id=tags.rowid")
+            for (bookmark_id, title, tag_id) in result:
+                if bookmark_id in tags:
+                    tags[bookmark_id][title] = tag_id
+                else:
+                    tags[bookmark_id] = {title: tag_id}
+        return tags
 
     def get_children(self, guid):
         """
@@ -375,7 +583,7 @@ class DatabaseBookmarks:
                                   FROM bookmarks, parents\
                                   WHERE parents.parent_guid=?\
                                   AND parents.bookmark_id=bookmarks.rowid\
-                                  ORDER BY position ASC", (guid,))
+                                  ORDER BY position_key ASC", (guid,))
             return list(itertools.chain(*result))
 
     def get_mtime(self, bookmark_id):
@@ -397,16 +605,16 @@ class DatabaseBookmarks:
         """
             Get bookmark position
             @param bookmark id as int
-            @return position as int
+            @return position key as str
         """
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT position\
+            result = sql.execute("SELECT position_key\
                                   FROM bookmarks\
                                   WHERE rowid=?", (bookmark_id,))
             v = result.fetchone()
             if v is not None:
                 return v[0]
-            return 0
+            return ""
 
     def get_tag_id(self, title):
         """
@@ -414,14 +622,7 @@ class DatabaseBookmarks:
             @param title as str
             @return tag id as int
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT rowid\
-                                  FROM tags\
-                                  WHERE title=?", (title,))
-            v = result.fetchone()
-            if v is not None:
-                return v[0]
-            return None
+        return self.__model.get_tag_id(title)
 
     def get_tag_title(self, tag_id):
         """
@@ -429,25 +630,14 @@ class DatabaseBookmarks:
             @param tag id as int
             @return title as str
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT tags.title\
-                                  FROM tags\
-                                  WHERE id=?", (tag_id,))
-            v = result.fetchone()
-            if v is not None:
-                return v[0]
-            return None
+        return self.__model.get_tag_title(tag_id)
 
     def get_all_tags(self):
         """
             Get all tags
             @return [rowid, str]
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT rowid, title\
-                                  FROM tags\
-                                  ORDER BY title COLLATE LOCALIZED")
-            return list(result)
+        return self.__model.get_all_tags()
 
     def get_bookmarks(self, tag_id):
         """
@@ -455,18 +645,22 @@ class DatabaseBookmarks:
             @param tag id as int
             @return [(id, title, uri)]
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("\
-                            SELECT bookmarks.rowid,\
-                                   bookmarks.title,\
-                                   bookmarks.uri\
-                            FROM bookmarks, bookmarks_tags\
-                            WHERE bookmarks.rowid=bookmarks_tags.bookmark_id\
-                            AND bookmarks_tags.tag_id=?\
-                            AND bookmarks.guid != bookmarks.uri\
-                            AND bookmarks.del=0\
-                            ORDER BY bookmarks.popularity DESC", (tag_id,))
-            return list(result)
+        return self.__model.get_bookmarks(tag_id)
+
+    def get_tags_count(self):
+        """
+            Get bookmarks count for tags, deleted bookmarks do not count
+            @return {tag_id: count} as {int: int}
+        """
+        return self.__model.get_tags_count()
+
+    def get_bookmarks_for_tags(self, tag_ids):
+        """
+            Get bookmarks having all tags
+            @param tag_ids as [int]
+            @return [(id, title, uri)]
+        """
+        return self.__model.get_bookmarks_for_tags(tag_ids)
 
     def get_populars(self, limit):
         """
@@ -531,10 +725,12 @@ class DatabaseBookmarks:
         """
         with SqlCursor(self) as sql:
             sql.execute("UPDATE bookmarks\
-                         SET title=?\
-                         WHERE rowid=?", (title, bookmark_id,))
+                         SET title=?, title_normalized=?\
+                         WHERE rowid=?", (title, get_normalized(title),
+                                          bookmark_id))
             if commit:
                 sql.commit()
+        self.__model.set_title(bookmark_id, title)
 
     def set_uri(self, bookmark_id, uri, commit=True):
         """
@@ -545,10 +741,13 @@ class DatabaseBookmarks:
         """
         with SqlCursor(self) as sql:
             sql.execute("UPDATE bookmarks\
-                         SET uri=?\
-                         WHERE rowid=?", (uri.rstrip('/'), bookmark_id,))
+                         SET uri=?, canonical=?\
+                         WHERE rowid=?", (uri.rstrip('/'),
+                                          get_canonical_uri(uri),
+                                          bookmark_id,))
             if commit:
                 sql.commit()
+        self.__model.set_uri(bookmark_id, uri.rstrip('/'))
 
     def set_parent(self, bookmark_id, parent_guid, parent_name, commit=True):
         """
@@ -576,16 +775,64 @@ class DatabaseBookmarks:
             if commit:
                 sql.commit()
 
-    def set_access_time(self, uri, atime):
+    def add_visit(self, uri, atime):
         """
-            Set bookmark access time
+            Count a visit for bookmark with uri, if any
+            Visits are written with next history commit, see
+            DatabaseHistory.add()
             @param uri as str
-            @param atime as int
+            @param atime as float
+        """
+        bookmark_id = self.__model.get_id(uri)
+        if bookmark_id is None:
+            return
+        with self.__visits_lock:
+            self.__visits.append((atime, get_canonical_uri(uri)))
+        self.__model.set_more_popular(bookmark_id)
+
+    def write_visits(self, sql, schema="main"):
+        """
+            Write pending visits, caller commits
+            Visits are not pending anymore: if commit fails, caller must
+            give them back with restore_visits()
+            @param sql as sqlite cursor
+            @param schema as str: bookmarks db name for sql
+            @return visits as [(float, str)]
+        """
+        with self.__visits_lock:
+            visits = self.__visits
+            self.__visits = []
+        try:
+            sql.executemany("UPDATE %s.bookmarks\
+                             SET popularity=popularity+1,\
+                                 atime=MAX(atime, ?)\
+                             WHERE canonical=? AND del=0" % schema, visits)
+        except:
+            self.restore_visits(visits)
+            raise
+        return visits
+
+    def restore_visits(self, visits):
+        """
+            Make visits pending again, they were not committed
+            @param visits as [(float, str)]
+        """
+        with self.__visits_lock:
+            self.__visits = visits + self.__visits
+
+    def save_visits(self):
+        """
+            Write pending visits now, on exit no history commit will come
         """
         with SqlCursor(self) as sql:
-            sql.execute("UPDATE bookmarks\
-                         SET atime=? where uri=?", (atime, uri.rstrip('/')))
-            sql.commit()
+            visits = self.write_visits(sql)
+            if not visits:
+                return
+            try:
+                sql.commit()
+            except Exception as e:
+                self.restore_visits(visits)
+                print("DatabaseBookmarks::save_visits():", e)
 
     def set_mtime(self, bookmark_id, mtime, commit=True):
         """
@@ -600,17 +847,61 @@ class DatabaseBookmarks:
             if commit:
                 sql.commit()
 
-    def set_position(self, bookmark_id, position, commit=True):
+    def set_mtimes(self, mtimes, commit=True):
         """
-            Set bookmark position
-            @param bookmark id as int
-            @param mtime as int
+            Set bookmarks sync time
+            @param mtimes as [(float, int)]: (mtime, bookmark id)
             @param commit as bool
         """
         with SqlCursor(self) as sql:
-            sql.execute("UPDATE bookmarks\
-                         SET position=? where rowid=?", (position,
-                                                         bookmark_id))
+            sql.executemany("UPDATE bookmarks\
+                             SET mtime=? where rowid=?", mtimes)
+            if commit:
+                sql.commit()
+
+    def set_children_order(self, guids, commit=True):
+        """
+            Order children as guids
+            Only children not in the longest already ordered subset
+            are updated
+            @param guids as [str]
+            @param commit as bool
+        """
+        with SqlCursor(self) as sql:
+            keys = {}
+            # Stay below SQLite max variable number
+            for i in range(0, len(guids), 500):
+                chunk = guids[i:i + 500]
+                result = sql.execute("SELECT guid, rowid, position_key\
+                                      FROM bookmarks\
+                                      WHERE guid IN (%s)" %
+                                     ",".join("?" * len(chunk)), chunk)
+                for (guid, rowid, key) in result:
+                    keys[guid] = (rowid, key)
+            children = [keys[guid] for guid in guids if guid in keys]
+            kept = self.__get_ordered_subset(
+                                          [key for (rowid, key) in children])
+            # Next kept key for each child
+            after = [""] * len(children)
+            for i in range(len(children) - 2, -1, -1):
+                if i + 1 in kept:
+                    after[i] = children[i + 1][1]
+                else:
+                    after[i] = after[i + 1]
+            updates = []
+            renumber = False
+            before = ""
+            for (i, (rowid, key)) in enumerate(children):
+                if i not in kept:
+                    key = get_position_key_between(before, after[i])
+                    updates.append((key, rowid))
+                    renumber |= len(key) > self.__MAX_POSITION_KEY_SIZE
+                before = key
+            if renumber:
+                updates = [(get_position_key(i), rowid)
+                           for (i, (rowid, key)) in enumerate(children)]
+            sql.executemany("UPDATE bookmarks\
+                             SET position_key=? WHERE rowid=?", updates)
             if commit:
                 sql.commit()
 
@@ -621,23 +912,10 @@ class DatabaseBookmarks:
             @parma title as str
         """
         with SqlCursor(self) as sql:
-            sql.execute("UPDATE tags SET title=? WHERE id=?", (title, tag_id,))
+            sql.execute("UPDATE tags SET title=?, sort_key=? WHERE id=?",
+                        (title, get_sort_key(title), tag_id))
             sql.commit()
-
-    def set_more_popular(self, uri):
-        """
-            Increment bookmark popularity
-            @param uri as str
-        """
-        with SqlCursor(self) as sql:
-            uri = uri.rstrip('/')
-            result = sql.execute("SELECT popularity FROM bookmarks\
-                                  WHERE uri=?", (uri,))
-            v = result.fetchone()
-            if v is not None:
-                sql.execute("UPDATE bookmarks set popularity=?\
-                             WHERE uri=?", (v[0]+1, uri))
-                sql.commit()
+        self.__model.set_tag_title(tag_id, title)
 
     def add_tag_to(self, tag_id, bookmark_id, commit=True):
         """
@@ -652,6 +930,7 @@ class DatabaseBookmarks:
                         (bookmark_id, tag_id))
             if commit:
                 sql.commit()
+        self.__model.add_tag_to(tag_id, bookmark_id)
 
     def del_tag_from(self, tag_id, bookmark_id, commit=True):
         """
@@ -666,6 +945,26 @@ class DatabaseBookmarks:
                         (bookmark_id, tag_id))
             if commit:
                 sql.commit()
+        self.__model.del_tag_from(tag_id, bookmark_id)
+
+    def set_tags_links(self, links, unlinks, commit=True):
+        """
+            Add and remove tags from bookmarks
+            @param links as [(int, int)]: (tag id, bookmark id) to add
+            @param unlinks as [(int, int)]: (tag id, bookmark id) to remove
+            @param commit as bool
+        """
+        with SqlCursor(self) as sql:
+            sql.executemany("DELETE from bookmarks_tags\
+                             WHERE tag_id=? and bookmark_id=?", unlinks)
+            sql.executemany("INSERT INTO bookmarks_tags\
+                             (tag_id, bookmark_id) VALUES (?, ?)", links)
+            if commit:
+                sql.commit()
+        for (tag_id, bookmark_id) in unlinks:
+            self.__model.del_tag_from(tag_id, bookmark_id)
+        for (tag_id, bookmark_id) in links:
+            self.__model.add_tag_to(tag_id, bookmark_id)
 
     def clean_tags(self):
         """
@@ -680,122 +979,164 @@ class DatabaseBookmarks:
                             AND bookmarks.rowid = bookmarks_tags.bookmark_id\
                             AND bookmarks.del!=1)")
             sql.commit()
+        self.__model.clean_tags()
 
-    def import_html(self, path):
+    def import_html(self, path, cancellable=None):
         """
-            Import html bookmarks
+            Import html bookmarks, file is read by chunks
+            Each chunk is committed, chunks already read are kept if cancelled
             @param path as str
+            @param cancellable as Gio.Cancellable
+            @return yield progress as float
+            @thread safe
         """
+        SqlCursor.add(self)
         try:
-            from bs4 import BeautifulSoup
-            SqlCursor.add(self)
-            f = Gio.File.new_for_path(path)
-            if not f.query_exists():
-                return
-            (status, content, tag) = f.load_contents(None)
-            if status:
-                data = content.decode("utf-8")
-                soup = BeautifulSoup(data, "html.parser")
-                parent_name = ""
-                position = 0
-                for dt in soup.findAll("dt"):
-                    h3 = dt.find("h3")
-                    if h3 is not None:
-                        parent_name = h3.contents[0]
-                        continue
-                    else:
-                        a = dt.find("a")
-                        uri = a.get("href")
-                        if a.get("tags") is None:
-                            tags = [parent_name]
-                        else:
-                            tags = [a.get("tags")]
-                        title = a.contents[0]
-                        if uri is None:
-                            parent_name = title
-                            continue
-                        elif not uri.startswith('http') or not title:
+            size = max(1, os.path.getsize(path))
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+            parser = BookmarksHTMLParser()
+            # Uris added by this import, not yet in model
+            uris = set()
+            position = 0
+            with open(path, "rb") as f:
+                while True:
+                    if cancellable is not None and\
+                            cancellable.is_cancelled():
+                        return
+                    data = f.read(self.__IMPORT_CHUNK_SIZE)
+                    parser.feed(decoder.decode(data, not data))
+                    bookmarks = []
+                    for (title, uri, tags) in parser.pop_bookmarks():
+                        if not uri.startswith('http') or not title:
                             continue
                         uri = uri.rstrip('/')
-                        rowid = self.get_id(uri)
-                        if rowid is None:
-                            if not tags:
-                                tags = [parent_name]
-                            # Add bookmark
-                            bookmark_id = self.add(title, uri, None,
-                                                   tags, 0, False)
-                            # Set position
-                            self.set_position(bookmark_id, position, False)
-                            position += 1
-            with SqlCursor(self) as sql:
-                sql.commit()
-            SqlCursor.remove(self)
+                        canonical = get_canonical_uri(uri)
+                        if canonical in uris or self.get_id(uri) is not None:
+                            continue
+                        uris.add(canonical)
+                        bookmarks.append((title, uri, tags, position))
+                        position += 1
+                    self.__import_bookmarks(bookmarks)
+                    with SqlCursor(self) as sql:
+                        sql.commit()
+                    yield f.tell() / size
+                    if not data:
+                        break
+            parser.close()
         except Exception as e:
             print("DatabaseBookmarks::import_html:", e)
+        finally:
+            with SqlCursor(self) as sql:
+                sql.rollback()
+                self.__model.load(sql)
+            SqlCursor.remove(self)
 
-    def import_chromium(self, chrome):
+    def import_chromium(self, chrome, cancellable=None):
         """
             Chromium/Chrome importer
             As Eolie doesn't sync with Chromium, we do not handle parent
             guid and just import parents as tags
+            Nothing is done if file did not change since last import,
+            else only nodes added or moved since last import are read
+            Bookmarks are committed by chunks, kept if cancelled
             @param chrome as bool
+            @param cancellable as Gio.Cancellable
+            @return yield progress as float
+            @thread safe
         """
+        bookmarks = []
+        SqlCursor.add(self)
         try:
-            SqlCursor.add(self)
             import json
             if chrome:
-                path = CONFIG_PATH + "/chrome/Default/Bookmarks"
+                source = "chrome"
             else:
-                path = CONFIG_PATH + "/chromium/Default/Bookmarks"
+                source = "chromium"
+            path = CONFIG_PATH + "/%s/Default/Bookmarks" % source
             f = Gio.File.new_for_path(path)
             if not f.query_exists():
                 return
             (status, content, tag) = f.load_contents(None)
-            if status:
-                data = content.decode("utf-8")
-                j = json.loads(data)
-                parents = []
-                # Setup initial parents
-                for root in j["roots"]:
-                    parents.append(("", j["roots"][root]["children"]))
-                # Walk parents and children
-                while parents:
-                    (parent_name, children) = parents.pop(0)
-                    bookmarks = []
-                    for child in children:
-                        if child["type"] == "folder":
-                            parents.append((child["name"], child["children"]))
-                        elif child["type"] == "url":
-                            bookmarks.append((child["name"],
-                                             child["url"]))
-                    position = 0
-                    for bookmark in bookmarks:
-                        tags = [parent_name]
-                        title = bookmark[0]
-                        uri = bookmark[1]
-                        if not uri.startswith('http') or not title:
-                            continue
-                        uri = uri.rstrip('/')
-                        rowid = self.get_id(uri)
-                        if rowid is None:
-                            # Add bookmark
-                            bookmark_id = self.add(title, uri, None,
-                                                   tags, 0, False)
-                            # Set position
-                            self.set_position(bookmark_id, position, False)
-                            position += 1
+            if not status:
+                return
+            j = json.loads(content.decode("utf-8"))
+            checksum = j.get("checksum", "")
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT checksum, mtime FROM imports\
+                                      WHERE source=?", (source,))
+                v = result.fetchone()
+            (last_checksum, last_mtime) = v if v is not None else ("", 0)
+            if checksum and checksum == last_checksum:
+                return
+            mtime = last_mtime
+            # Uris added by this import, not yet in model
+            uris = set()
+            # (parent name, children, parent modified since last import)
+            parents = [("", j["roots"][root].get("children", []), True)
+                       for root in j["roots"]
+                       if isinstance(j["roots"][root], dict)]
+            # Walk parents and children
+            while parents:
+                (parent_name, children, modified) = parents.pop(-1)
+                position = 0
+                for child in children:
+                    added = int(child.get("date_added", 0))
+                    mtime = max(mtime, added)
+                    if child["type"] == "folder":
+                        changed = int(child.get("date_modified", 0))
+                        mtime = max(mtime, changed)
+                        parents.append((child["name"], child["children"],
+                                        changed > last_mtime))
+                        continue
+                    elif child["type"] != "url":
+                        continue
+                    # Old node in an unchanged folder, already imported
+                    if not modified and added <= last_mtime:
+                        continue
+                    title = child["name"]
+                    uri = child["url"]
+                    if not uri.startswith('http') or not title:
+                        continue
+                    uri = uri.rstrip('/')
+                    canonical = get_canonical_uri(uri)
+                    if canonical in uris or self.get_id(uri) is not None:
+                        continue
+                    uris.add(canonical)
+                    bookmarks.append((title, uri, [parent_name], position))
+                    position += 1
+            for i in range(0, len(bookmarks), self.__IMPORT_ROWS):
+                if cancellable is not None and cancellable.is_cancelled():
+                    return
+                self.__import_bookmarks(bookmarks[i:i + self.__IMPORT_ROWS])
                 with SqlCursor(self) as sql:
                     sql.commit()
-                SqlCursor.remove(self)
+                yield min(1, (i + self.__IMPORT_ROWS) / len(bookmarks))
+            # Only remember a complete import
+            with SqlCursor(self) as sql:
+                sql.execute("INSERT OR REPLACE INTO imports\
+                             (source, checksum, mtime)\
+                             VALUES (?, ?, ?)", (source, checksum, mtime))
+                sql.commit()
         except Exception as e:
             print("DatabaseBookmarks::import_chromium:", e)
+        finally:
+            with SqlCursor(self) as sql:
+                sql.rollback()
+                if bookmarks:
+                    self.__model.load(sql)
+            SqlCursor.remove(self)
 
-    def import_firefox(self):
+    def import_firefox(self, cancellable=None):
         """
             Mozilla Firefox importer
+            Work on a snapshot, so Firefox can be running
+            Bookmarks are committed by chunks, kept if cancelled
+            @param cancellable as Gio.Cancellable
+            @return yield progress as float
+            @thread safe
         """
+        SqlCursor.add(self)
         try:
-            SqlCursor.add(self)
             firefox_path = GLib.get_home_dir() + "/.mozilla/firefox/"
             d = Gio.File.new_for_path(firefox_path)
             infos = d.enumerate_children(
@@ -811,64 +1152,74 @@ class DatabaseBookmarks:
                     if f.query_exists():
                         sqlite_path = f.get_path()
                         break
-            if sqlite_path is not None:
-                c = sqlite3.connect(sqlite_path, 600.0)
-                # Add bookmarks
+            if sqlite_path is None:
+                return
+            with TemporaryDirectory() as tmp:
+                # Firefox locks places.sqlite and keeps recent changes in
+                # WAL file, copy both
+                for suffix in ["", "-wal"]:
+                    if os.path.exists(sqlite_path + suffix):
+                        shutil.copy(sqlite_path + suffix,
+                                    tmp + "/places.sqlite" + suffix)
+                c = sqlite3.connect(tmp + "/places.sqlite", 600.0)
+                rows = []
+                tags = {}
                 bookmarks = self.__get_firefox_bookmarks(c)
-                for (title, uri,  parent_name, bookmark_guid,
-                     parent_guid, position) in bookmarks:
-                    tags = self.__get_tags_for_firefox_bookmark(c,
-                                                                bookmark_guid)
-                    bookmark_guid = self.__clean_guid(bookmark_guid)
-                    parent_guid = self.__clean_guid(parent_guid)
+                for (title, uri, parent_name, bookmark_guid, parent_guid,
+                     position, bookmark_tags) in bookmarks:
                     if not uri.startswith('http') or not title:
                         continue
-                    uri = uri.rstrip('/')
-                    rowid = self.get_id(uri)
-                    if rowid is None:
-                        # If bookmark is not tagged, we use parent name
-                        if not tags:
-                            tags = [parent_name]
-                        # Bookmarks and folder
-                        bookmark_id = self.add(title, uri, bookmark_guid,
-                                               tags, 0, False)
-                        self.set_parent(bookmark_id, parent_guid,
-                                        parent_name, False)
-                        self.set_position(bookmark_id, position, False)
+                    bookmark_guid = self.__clean_guid(bookmark_guid)
+                    rows.append((title, get_normalized(title),
+                                 uri.rstrip('/'), bookmark_guid,
+                                 self.__clean_guid(parent_guid),
+                                 parent_name or "", position))
+                    # If bookmark is not tagged, we use parent name
+                    if bookmark_tags:
+                        bookmark_tags = bookmark_tags.split("\x1f")
+                    else:
+                        bookmark_tags = [parent_name]
+                    for tag in set(bookmark_tags):
+                        if tag:
+                            tags.setdefault(bookmark_guid, []).append(
+                                (bookmark_guid, tag, get_sort_key(tag)))
                 # Add folders, we need to get them
                 # as Firefox needs children order
-                parents = self.__get_firefox_parents(c)
                 for (title, parent_name, bookmark_guid,
-                     parent_guid, position) in parents:
+                     parent_guid, position) in self.__get_firefox_parents(c):
                     bookmark_guid = self.__clean_guid(bookmark_guid)
-                    parent_guid = self.__clean_guid(parent_guid)
-                    if not title or bookmark_guid == "root":
+                    if not title or bookmark_guid == "places":
                         continue
-                    uri = bookmark_guid
-                    rowid = self.get_id(uri)
-                    if rowid is None:
-                        # Bookmarks and folder
-                        bookmark_id = self.add(title, uri, bookmark_guid,
-                                               [], 0, False)
-                        self.set_parent(bookmark_id, parent_guid,
-                                        parent_name, False)
-                        self.set_position(bookmark_id, position, False)
-            with SqlCursor(self) as sql:
-                sql.commit()
-            SqlCursor.remove(self)
+                    rows.append((title, get_normalized(title),
+                                 bookmark_guid, bookmark_guid,
+                                 self.__clean_guid(parent_guid),
+                                 parent_name or "", position))
+                c.close()
+            # Folders are last, children are imported before them
+            for i in range(0, len(rows), self.__IMPORT_ROWS):
+                if cancellable is not None and cancellable.is_cancelled():
+                    break
+                chunk = rows[i:i + self.__IMPORT_ROWS]
+                chunk_tags = [tag for row in chunk
+                              for tag in tags.get(row[3], [])]
+                with SqlCursor(self) as sql:
+                    self.__import_rows(sql, chunk, chunk_tags)
+                    sql.commit()
+                yield min(1, (i + self.__IMPORT_ROWS) / len(rows))
         except Exception as e:
             print("DatabaseBookmarks::import_firefox:", e)
+        finally:
+            with SqlCursor(self) as sql:
+                sql.rollback()
+                self.__model.load(sql)
+            SqlCursor.remove(self)
 
     def exists_guid(self, guid):
         """
             Check if guid exists in db
             @return bool
         """
-        with SqlCursor(self) as sql:
-            result = sql.execute("SELECT guid FROM bookmarks\
-                                  WHERE guid=?", (guid,))
-            v = result.fetchone()
-            return v is not None
+        return self.__model.exists_guid(guid)
 
     def search(self, search, limit):
         """
@@ -877,24 +1228,30 @@ class DatabaseBookmarks:
             @param limit as int
         """
         with SqlCursor(self) as sql:
-            filter = '%' + search + '%'
+            filter = '%' + get_normalized(search) + '%'
             result = sql.execute("SELECT title, uri\
                                   FROM bookmarks\
-                                  WHERE title LIKE ?\
+                                  WHERE title_normalized LIKE ?\
                                    OR uri LIKE ?\
                                   ORDER BY popularity DESC, atime DESC\
                                   LIMIT ?",
                                  (filter, filter, limit))
             return list(result)
 
+    @property
+    def model(self):
+        """
+            Get in memory bookmarks model
+            @return BookmarksModel
+        """
+        return self.__model
+
     def get_cursor(self):
         """
             Return a new sqlite cursor
         """
         try:
             c = sqlite3.connect(self.DB_PATH, 600.0)
-            c.create_collation('LOCALIZED', LocalizedCollation())
-            c.create_function("noaccents", 1, noaccents)
             return c
         except:
             exit(-1)
@@ -912,46 +1269,461 @@ class DatabaseBookmarks:
 #######################
 # PRIVATE             #
 #######################
+    def __import_bookmarks(self, bookmarks):
+        """
+            Insert bookmarks without committing, model is not updated
+            @param bookmarks as [(title, uri, tags, position)]
+                   as [(str, str, [str], int)]
+        """
+        if not bookmarks:
+            return
+        # Reuse history guids like add()
+        uris = [bookmark[1] for bookmark in bookmarks]
+        history_guids = El().history.get_guids_for_uris(uris)
+        guids = []
+        used = set()
+        rows = []
+        for (title, uri, tags, position) in bookmarks:
+            guid = history_guids.get(uri)
+            while guid is None or guid in used or self.exists_guid(guid):
+                guid = get_random_string(12)
+            used.add(guid)
+            guids.append(guid)
+            rows.append((title, get_normalized(title), uri,
+                         get_canonical_uri(uri), 0, guid, 0, 0,
+                         position, get_position_key(position)))
+        with SqlCursor(self) as sql:
+            sql.executemany("INSERT INTO bookmarks\
+                             (title, title_normalized, uri, canonical,\
+                              popularity, guid, atime, mtime, position,\
+                              position_key)\
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            bookmark_ids = {}
+            for i in range(0, len(guids), 500):
+                chunk = guids[i:i + 500]
+                result = sql.execute("SELECT guid, rowid FROM bookmarks\
+                                      WHERE guid IN (%s)" %
+                                     ",".join("?" * len(chunk)), chunk)
+                bookmark_ids.update(result)
+            links = []
+            for (guid, (title, uri, tags, position)) in zip(guids, bookmarks):
+                for tag in set(tags):
+                    if not tag:
+                        continue
+                    tag_id = self.get_tag_id(tag)
+                    if tag_id is None:
+                        tag_id = self.add_tag(tag)
+                    links.append((bookmark_ids[guid], tag_id))
+            sql.executemany("INSERT INTO bookmarks_tags\
+                             (bookmark_id, tag_id) VALUES (?, ?)", links)
+
+    def __get_ordered_subset(self, keys):
+        """
+            Get longest strictly increasing subsequence of keys
+            @param keys as [str]
+            @return indexes as set(int)
+        """
+        # tails[i] is index of smallest tail for a subsequence of size i+1
+        # tail_keys[i] is keys[tails[i]], kept sorted for bisect
+        tails = []
+        tail_keys = []
+        previous = [None] * len(keys)
+        for (i, key) in enumerate(keys):
+            position = bisect_left(tail_keys, key)
+            if position > 0:
+                previous[i] = tails[position - 1]
+            if position == len(tails):
+                tails.append(i)
+                tail_keys.append(key)
+            else:
+                tails[position] = i
+                tail_keys[position] = key
+        indexes = set()
+        i = tails[-1] if tails else None
+        while i is not None:
+            indexes.add(i)
+            i = previous[i]
+        return indexes
+
+    def __upgrade_position_key(self, sql):
+        """
+            Compute position keys from integer positions
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT bookmarks.rowid,\
+                                     COALESCE(parents.parent_guid, 'unfiled')\
+                              FROM bookmarks\
+                              LEFT JOIN parents\
+                              ON parents.bookmark_id=bookmarks.rowid\
+                              ORDER BY 2, bookmarks.position, bookmarks.rowid")
+        updates = []
+        current = None
+        for (rowid, parent_guid) in list(result):
+            if parent_guid != current:
+                current = parent_guid
+                position = 0
+            updates.append((get_position_key(position), rowid))
+            position += 1
+        sql.executemany("UPDATE bookmarks SET position_key=? WHERE rowid=?",
+                        updates)
+
+    def __upgrade_tags_count(self, sql):
+        """
+            Add bookmarks count for tags, kept up to date by triggers
+            @param sql as sqlite cursor
+        """
+        sql.execute("CREATE TABLE tags_count (\
+                        tag_id INTEGER PRIMARY KEY,\
+                        count INT NOT NULL)")
+        sql.execute("CREATE TRIGGER tags_count_link\
+                     AFTER INSERT ON bookmarks_tags\
+                     WHEN EXISTS (SELECT 1 FROM bookmarks\
+                                  WHERE rowid=NEW.bookmark_id AND del=0)\
+                     BEGIN\
+                        INSERT OR IGNORE INTO tags_count (tag_id, count)\
+                        VALUES (NEW.tag_id, 0);\
+                        UPDATE tags_count SET count=count+1\
+                        WHERE tag_id=NEW.tag_id;\
+                     END")
+        sql.execute("CREATE TRIGGER tags_count_unlink\
+                     AFTER DELETE ON bookmarks_tags\
+                     WHEN EXISTS (SELECT 1 FROM bookmarks\
+                                  WHERE rowid=OLD.bookmark_id AND del=0)\
+                     BEGIN\
+                        UPDATE tags_count SET count=count-1\
+                        WHERE tag_id=OLD.tag_id;\
+                     END")
+        # remove() deletes bookmark before its tags
+        sql.execute("CREATE TRIGGER tags_count_remove\
+                     AFTER DELETE ON bookmarks\
+                     WHEN OLD.del=0\
+                     BEGIN\
+                        UPDATE tags_count SET count=count-1\
+                        WHERE tag_id IN (SELECT tag_id FROM bookmarks_tags\
+                                         WHERE bookmark_id=OLD.rowid);\
+                     END")
+        sql.execute("CREATE TRIGGER tags_count_delete\
+                     AFTER UPDATE OF del ON bookmarks\
+                     WHEN OLD.del!=NEW.del\
+                     BEGIN\
+                        INSERT OR IGNORE INTO tags_count (tag_id, count)\
+                        SELECT tag_id, 0 FROM bookmarks_tags\
+                        WHERE bookmark_id=NEW.rowid;\
+                        UPDATE tags_count\
+                        SET count=count+(CASE WHEN NEW.del=0\
+                                         THEN 1 ELSE -1 END)\
+                        WHERE tag_id IN (SELECT tag_id FROM bookmarks_tags\
+                                         WHERE bookmark_id=NEW.rowid);\
+                     END")
+        sql.execute("CREATE TRIGGER tags_count_tag\
+                     AFTER DELETE ON tags\
+                     BEGIN\
+                        DELETE FROM tags_count WHERE tag_id=OLD.rowid;\
+                     END")
+        sql.execute("INSERT INTO tags_count (tag_id, count)\
+                     SELECT bookmarks_tags.tag_id, COUNT(*)\
+                     FROM bookmarks_tags, bookmarks\
+                     WHERE bookmarks.rowid=bookmarks_tags.bookmark_id\
+                     AND bookmarks.del=0\
+                     GROUP BY bookmarks_tags.tag_id")
+
+    def __upgrade_sync_state(self, sql):
+        """
+            Add sync state and change log, change log is kept up to date
+            by triggers. Import state from mozilla_sync.bin
+            @param sql as sqlite cursor
+        """
+        sql.execute("CREATE TABLE sync_state (\
+                        collection TEXT PRIMARY KEY,\
+                        mtime REAL NOT NULL)")
+        # AUTOINCREMENT: a guid changed again always gets a greater id
+        sql.execute("CREATE TABLE bookmarks_changes (\
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,\
+                        guid TEXT NOT NULL UNIQUE,\
+                        tombstone INT NOT NULL)")
+        sql.execute("CREATE TRIGGER bookmarks_changes_add\
+                     AFTER INSERT ON bookmarks\
+                     BEGIN\
+                        INSERT OR REPLACE INTO bookmarks_changes\
+                        (guid, tombstone) VALUES (NEW.guid, NEW.del);\
+                     END")
+        sql.execute("CREATE TRIGGER bookmarks_changes_update\
+                     AFTER UPDATE OF title, uri, del, position_key\
+                     ON bookmarks\
+                     BEGIN\
+                        INSERT OR REPLACE INTO bookmarks_changes\
+                        (guid, tombstone) VALUES (NEW.guid, NEW.del);\
+                     END")
+        # Tombstones are kept until uploaded
+        sql.execute("CREATE TRIGGER bookmarks_changes_remove\
+                     AFTER DELETE ON bookmarks\
+                     BEGIN\
+                        DELETE FROM bookmarks_changes\
+                        WHERE guid=OLD.guid AND tombstone=0;\
+                     END")
+        for (name, action, row) in [("link", "INSERT", "NEW"),
+                                    ("unlink", "DELETE", "OLD")]:
+            sql.execute("CREATE TRIGGER bookmarks_changes_%s\
+                         AFTER %s ON bookmarks_tags\
+                         BEGIN\
+                            INSERT OR REPLACE INTO bookmarks_changes\
+                            (guid, tombstone)\
+                            SELECT guid, del FROM bookmarks\
+                            WHERE rowid=%s.bookmark_id;\
+                         END" % (name, action, row))
+        for (name, action) in [("parent", "INSERT"), ("move", "UPDATE")]:
+            sql.execute("CREATE TRIGGER bookmarks_changes_%s\
+                         AFTER %s ON parents\
+                         BEGIN\
+                            INSERT OR REPLACE INTO bookmarks_changes\
+                            (guid, tombstone)\
+                            SELECT guid, del FROM bookmarks\
+                            WHERE rowid=NEW.bookmark_id;\
+                         END" % (name, action))
+        sql.execute("CREATE TRIGGER bookmarks_changes_tag\
+                     AFTER UPDATE OF title ON tags\
+                     BEGIN\
+                        INSERT OR REPLACE INTO bookmarks_changes\
+                        (guid, tombstone)\
+                        SELECT bookmarks.guid, bookmarks.del\
+                        FROM bookmarks_tags, bookmarks\
+                        WHERE bookmarks_tags.tag_id=NEW.rowid\
+                        AND bookmarks.rowid=bookmarks_tags.bookmark_id;\
+                     END")
+        try:
+            mtimes = load(open(EOLIE_LOCAL_PATH + "/mozilla_sync.bin", "rb"))
+        except:
+            mtimes = {}
+        for key in ["bookmarks", "bookmarks-pull"]:
+            if key in mtimes.keys():
+                sql.execute("INSERT INTO sync_state (collection, mtime)\
+                             VALUES (?, ?)", (key, mtimes[key]))
+        # Bookmarks not uploaded yet
+        sql.execute("INSERT OR REPLACE INTO bookmarks_changes\
+                     (guid, tombstone)\
+                     SELECT guid, del FROM bookmarks\
+                     WHERE del=1 OR (mtime > ? AND uri != guid)\
+                     ORDER BY mtime", (mtimes.get("bookmarks", 0.1),))
+
+    def __upgrade_canonical(self, sql):
+        """
+            Compute canonical uris for existing bookmarks
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT rowid, uri FROM bookmarks")
+        sql.executemany("UPDATE bookmarks SET canonical=? WHERE rowid=?",
+                        [(get_canonical_uri(uri), rowid)
+                         for (rowid, uri) in list(result)])
+
+    def __upgrade_duplicates(self, sql):
+        """
+            Merge bookmarks with same canonical uri in same folder into most
+            popular one: tags are merged, popularity is summed
+            Merged bookmarks are only removed locally, no tombstone is
+            uploaded as other sync clients may keep them as distinct items
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT bookmarks.canonical,\
+                                     COALESCE(parents.parent_guid, 'unfiled')\
+                              FROM bookmarks\
+                              LEFT JOIN parents\
+                              ON parents.bookmark_id=bookmarks.rowid\
+                              WHERE bookmarks.del=0\
+                              AND bookmarks.guid != bookmarks.uri\
+                              GROUP BY 1, 2\
+                              HAVING COUNT(*) > 1")
+        for (canonical, parent_guid) in list(result):
+            result = sql.execute("SELECT bookmarks.rowid,\
+                                         bookmarks.popularity,\
+                                         bookmarks.atime\
+                                  FROM bookmarks\
+                                  LEFT JOIN parents\
+                                  ON parents.bookmark_id=bookmarks.rowid\
+                                  WHERE bookmarks.canonical=?\
+                                  AND COALESCE(parents.parent_guid,\
+                                               'unfiled')=?\
+                                  AND bookmarks.del=0\
+                                  AND bookmarks.guid != bookmarks.uri\
+                                  ORDER BY bookmarks.popularity DESC,\
+                                           bookmarks.rowid",
+                                 (canonical, parent_guid))
+            rows = list(result)
+            bookmark_id = rows[0][0]
+            others = [row[0] for row in rows[1:]]
+            result = sql.execute("SELECT DISTINCT tag_id\
+                                  FROM bookmarks_tags\
+                                  WHERE bookmark_id IN (%s)\
+                                  AND tag_id NOT IN (\
+                                    SELECT tag_id FROM bookmarks_tags\
+                                    WHERE bookmark_id=?)" %
+                                 ",".join("?" * len(others)),
+                                 others + [bookmark_id])
+            sql.executemany("INSERT INTO bookmarks_tags\
+                             (bookmark_id, tag_id) VALUES (?, ?)",
+                            [(bookmark_id, tag_id)
+                             for tag_id in itertools.chain(*result)])
+            sql.execute("UPDATE bookmarks SET popularity=?, atime=?\
+                         WHERE rowid=?",
+                        (sum([row[1] for row in rows]),
+                         max([row[2] for row in rows]), bookmark_id))
+            # Same order as remove(), see tags_count triggers
+            for table in ["bookmarks", "bookmarks_tags", "parents"]:
+                column = "rowid" if table == "bookmarks" else "bookmark_id"
+                sql.executemany("DELETE FROM %s WHERE %s=?" %
+                                (table, column),
+                                [(other,) for other in others])
+
+    def __upgrade_title_normalized(self, sql):
+        """
+            Compute normalized titles for existing bookmarks
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT rowid, title FROM bookmarks")
+        sql.executemany("UPDATE bookmarks SET title_normalized=?\
+                         WHERE rowid=?",
+                        [(get_normalized(title), rowid)
+                         for (rowid, title) in list(result)])
+
+    def __update_sort_keys(self):
+        """
+            Compute tags sort keys again if collation changed since they
+            were stored, keys from different locales do not compare
+        """
+        try:
+            collation = get_collation()
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT locale FROM collation")
+                v = result.fetchone()
+                if v is not None and v[0] == collation:
+                    return
+                self.__upgrade_sort_key(sql)
+                sql.execute("DELETE FROM collation")
+                sql.execute("INSERT INTO collation (locale) VALUES (?)",
+                            (collation,))
+                sql.commit()
+        except Exception as e:
+            print("DatabaseBookmarks::__update_sort_keys():", e)
+
+    def __upgrade_sort_key(self, sql):
+        """
+            Compute sort keys for existing tags
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT rowid, title FROM tags")
+        sql.executemany("UPDATE tags SET sort_key=? WHERE rowid=?",
+                        [(get_sort_key(title), rowid)
+                         for (rowid, title) in list(result)])
+
+    def __import_rows(self, sql, rows, tags):
+        """
+            Bulk import bookmarks through temporary tables
+            Bookmarks with an existing canonical uri or guid are ignored
+            @param sql as sqlite cursor
+            @param rows as [(title, title_normalized, uri, guid, parent_guid,
+                             parent_name, position)]
+            @param tags as [(guid, title, sort_key)]
+        """
+        sql.execute("CREATE TEMP TABLE import_bookmarks (\
+                        title TEXT NOT NULL,\
+                        title_normalized TEXT NOT NULL,\
+                        uri TEXT NOT NULL,\
+                        guid TEXT NOT NULL,\
+                        parent_guid TEXT NOT NULL,\
+                        parent_name TEXT NOT NULL,\
+                        position INT NOT NULL,\
+                        position_key TEXT NOT NULL,\
+                        canonical TEXT NOT NULL)")
+        sql.execute("CREATE TEMP TABLE import_tags (\
+                        guid TEXT NOT NULL,\
+                        title TEXT NOT NULL,\
+                        sort_key TEXT NOT NULL)")
+        try:
+            sql.executemany("INSERT INTO import_bookmarks\
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [row + (get_position_key(row[-1]),
+                                    get_canonical_uri(row[2]))
+                             for row in rows])
+            sql.executemany("INSERT INTO import_tags\
+                             VALUES (?, ?, ?)", tags)
+            # Keep first row for each uri/guid not already in db
+            sql.execute("DELETE FROM import_bookmarks\
+                         WHERE rowid NOT IN (\
+                            SELECT MIN(rowid) FROM import_bookmarks\
+                            GROUP BY canonical)\
+                         OR rowid NOT IN (\
+                            SELECT MIN(rowid) FROM import_bookmarks\
+                            GROUP BY guid)\
+                         OR canonical IN (SELECT canonical FROM bookmarks\
+                                          WHERE del=0)\
+                         OR guid IN (SELECT guid FROM bookmarks)")
+            sql.execute("INSERT INTO bookmarks\
+                         (title, title_normalized, uri, canonical,\
+                          popularity, guid, atime, mtime, position,\
+                          position_key)\
+                         SELECT title, title_normalized, uri, canonical, 0,\
+                                guid, 0, 0, position, position_key\
+                         FROM import_bookmarks")
+            sql.execute("INSERT INTO parents\
+                         (bookmark_id, parent_guid, parent_name)\
+                         SELECT bookmarks.rowid,\
+                                import_bookmarks.parent_guid,\
+                                import_bookmarks.parent_name\
+                         FROM import_bookmarks, bookmarks\
+                         WHERE bookmarks.guid=import_bookmarks.guid")
+            sql.execute("INSERT INTO tags (title, sort_key)\
+                         SELECT title, MIN(sort_key) FROM import_tags\
+                         WHERE guid IN (SELECT guid FROM import_bookmarks)\
+                         AND title NOT IN (SELECT title FROM tags)\
+                         GROUP BY title")
+            sql.execute("INSERT INTO bookmarks_tags (bookmark_id, tag_id)\
+                         SELECT bookmarks.rowid,\
+                                (SELECT MIN(rowid) FROM tags\
+                                 WHERE tags.title=import_tags.title)\
+                         FROM import_tags, import_bookmarks, bookmarks\
+                         WHERE import_bookmarks.guid=import_tags.guid\
+                         AND bookmarks.guid=import_tags.guid")
+        finally:
+            sql.execute("DROP TABLE temp.import_bookmarks")
+            sql.execute("DROP TABLE temp.import_tags")
+
     def __get_firefox_bookmarks(self, c):
         """
-            Return firefox bookmarks
+            Return firefox bookmarks, tags are joined with \\x1f
             @param c as Sqlite cursor
-            @return (title, url, parent title, guid, parent guid, position)
-             as (str, str, str, str, str, int)
+            @return (title, url, parent title, guid, parent guid, position,
+                     tags)
+             as (str, str, str, str, str, int, str)
         """
         result = c.execute("SELECT bookmarks.title,\
                                    moz_places.url,\
                                    parent.title,\
                                    bookmarks.guid,\
                                    parent.guid,\
-                                   bookmarks.position\
-                            FROM moz_bookmarks AS bookmarks,\
-                                 moz_bookmarks AS parent,\
-                                 moz_places\
-                            WHERE bookmarks.fk=moz_places.id\
-                            AND parent.id=bookmarks.parent\
-                            AND bookmarks.type=1")
+                                   bookmarks.position,\
+                                   tags.titles\
+                            FROM moz_bookmarks AS bookmarks\
+                            JOIN moz_bookmarks AS parent\
+                            ON parent.id=bookmarks.parent\
+                            JOIN moz_places\
+                            ON moz_places.id=bookmarks.fk\
+                            LEFT JOIN (\
+                                SELECT tag.fk AS fk,\
+                                       group_concat(folder.title,\
+                                                    char(31)) AS titles\
+                                FROM moz_bookmarks AS tag\
+                                JOIN moz_bookmarks AS folder\
+                                ON folder.id=tag.parent\
+                                JOIN moz_bookmarks AS root\
+                                ON root.id=folder.parent\
+                                WHERE root.guid='tags________'\
+                                GROUP BY tag.fk) AS tags\
+                            ON tags.fk=bookmarks.fk\
+                            WHERE bookmarks.type=1\
+                            AND parent.parent NOT IN (\
+                                SELECT id FROM moz_bookmarks\
+                                WHERE guid='tags________')")
         return list(result)
 
-    def __get_tags_for_firefox_bookmark(self, c, guid):
-        """
-            Return firefox bookmarks
-            @param c as Sqlite cursor
-            @param guid as str
-            @return (title, url, parent title, guid, parent guid, position)
-             as (str, str, str, str, str, int)
-        """
-        result = c.execute("SELECT parent.title\
-                            FROM moz_bookmarks AS bookmarks,\
-                                 moz_bookmarks AS tag,\
-                                 moz_bookmarks AS parent\
-                            WHERE bookmarks.fk=tag.fk\
-                            AND tag.fk=bookmarks.fk\
-                            AND tag.title is null\
-                            AND parent.id=tag.parent\
-                            AND bookmarks.guid=?", (guid,))
-        return list(itertools.chain(*result))
-
     def __get_firefox_parents(self, c):
         """
             Return firefox parents
@@ -967,7 +1739,9 @@ class DatabaseBookmarks:
                             FROM moz_bookmarks AS bookmarks,\
                                  moz_bookmarks AS parent\
                             WHERE parent.id=bookmarks.parent\
-                            AND bookmarks.type=2")
+                            AND bookmarks.type=2\
+                            AND bookmarks.guid!='tags________'\
+                            AND parent.guid!='tags________'")
         return list(result)
 
     def __clean_guid(self, guid):
@@ -14,11 +14,15 @@ from gi.repository import GLib, Gio
 
 import sqlite3
 import itertools
+from pickle import load
+import zlib
+import re
 
-from eolie.utils import noaccents, get_random_string
+from eolie.utils import get_random_string, get_normalized, get_text_from_html
+from eolie.utils import get_canonical_uri
 from eolie.define import El
-from eolie.localized import LocalizedCollation
 from eolie.sqlcursor import SqlCursor
+from eolie.database_upgrade import DatabaseUpgrade
 
 
 class DatabaseHistory:
@@ -48,11 +52,43 @@ class DatabaseHistory:
                                                 history_id INT NOT NULL,
                                                 atime REAL NOT NULL
                                                )'''
+    # Max indexed content size per page (chars)
+    __CONTENT_MAX_SIZE = 100000
 
     def __init__(self):
         """
             Create database tables or manage update if needed
         """
+        self.__upgrades = {
+            1: "CREATE INDEX IF NOT EXISTS idx_history_atime\
+                ON history_atime(atime, history_id)",
+            2: "CREATE INDEX IF NOT EXISTS idx_history_atime_id\
+                ON history_atime(history_id)",
+            3: "ALTER TABLE history\
+                ADD COLUMN title_normalized TEXT NOT NULL DEFAULT ''",
+            4: self.__upgrade_title_normalized,
+            # Compressed readable content, only used for snippets
+            5: "CREATE TABLE IF NOT EXISTS history_content (\
+                    history_id INTEGER PRIMARY KEY,\
+                    content BLOB NOT NULL)",
+            # Contentless full text index, text lives in history_content
+            6: "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts\
+                USING fts5(text, content='')",
+            # Used for lookups, see utils.get_canonical_uri()
+            7: "ALTER TABLE history\
+                ADD COLUMN canonical TEXT NOT NULL DEFAULT ''",
+            8: self.__upgrade_canonical,
+            9: "CREATE INDEX IF NOT EXISTS idx_history_canonical\
+                ON history(canonical)",
+            # Server times and changes to upload, see get_changes()
+            10: self.__upgrade_sync_state,
+            # Visits already uploaded, see get_records()
+            11: "ALTER TABLE history_atime\
+                 ADD COLUMN synced INT NOT NULL DEFAULT 0",
+            # Previous versions uploaded all visits at each push
+            12: "UPDATE history_atime SET synced=1",
+            13: self.__upgrade_duplicates
+        }
         f = Gio.File.new_for_path(self.DB_PATH)
         if not f.query_exists():
             try:
@@ -66,6 +102,8 @@ class DatabaseHistory:
                     sql.commit()
             except Exception as e:
                 print("DatabaseHistory::__init__(): %s" % e)
+        upgrade = DatabaseUpgrade(self, self.__upgrades)
+        upgrade.do_db_upgrade()
 
     def add(self, title, uri, mtime, guid=None, atimes=[], commit=True):
         """
@@ -99,20 +137,28 @@ class DatabaseHistory:
             if self.exists_guid(guid):
                 guid = None
         with SqlCursor(self) as sql:
+            # Bookmarks visits share history commit
+            attached = commit and self.__attach_bookmarks(sql)
             result = sql.execute("SELECT rowid, popularity FROM history\
                                   WHERE guid=?", (guid,))
             v = result.fetchone()
             if v is not None:
                 history_id = v[0]
                 sql.execute("UPDATE history\
-                             SET uri=?, mtime=?, title=?, popularity=?\
-                             WHERE rowid=?", (uri, mtime, title,
+                             SET uri=?, canonical=?, mtime=?, title=?,\
+                                 title_normalized=?, popularity=?\
+                             WHERE rowid=?", (uri, get_canonical_uri(uri),
+                                              mtime, title,
+                                              get_normalized(title),
                                               v[1]+1, history_id))
             else:
                 result = sql.execute("INSERT INTO history\
-                                      (title, uri, mtime, popularity, guid)\
-                                      VALUES (?, ?, ?, ?, ?)",
-                                     (title, uri, mtime, 0, guid))
+                                      (title, title_normalized, uri,\
+                                       canonical, mtime, popularity, guid)\
+                                      VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (title, get_normalized(title), uri,
+                                      get_canonical_uri(uri), mtime, 0,
+                                      guid))
                 history_id = result.lastrowid
             # Only add new atimes to db
             if not atimes:
@@ -124,7 +170,15 @@ class DatabaseHistory:
                                  (history_id, atime)\
                                  VALUES (?, ?)", (history_id, atime))
             if commit:
-                sql.commit()
+                visits = []
+                if attached:
+                    visits = El().bookmarks.write_visits(sql, "bookmarks_db")
+                try:
+                    sql.commit()
+                except:
+                    # Counted again with next commit
+                    El().bookmarks.restore_visits(visits)
+                    raise
             return history_id
 
     def remove(self, history_id):
@@ -135,25 +189,53 @@ class DatabaseHistory:
         with SqlCursor(self) as sql:
             sql.execute("DELETE from history\
                          WHERE rowid=?", (history_id,))
+            self.__remove_content(sql, [history_id])
             sql.commit()
 
-    def clear(self, atime=0):
-        """
-            Clear history from atime (current day)
-            @param atime as int
-            @return modified history ids as [int]
+    def clear(self, start, end, cancellable=None, chunk_size=500):
+        """
+            Clear history visits between start and end
+            Work by chunks and commit between them, so db is never locked
+            for long. Entries without visits are removed.
+            @param start as int
+            @param end as int
+            @param cancellable as Gio.Cancellable
+            @param chunk_size as int
+            @return yield (removed guids, modified history ids, progress)
+                    as ([str], [int], float)
         """
-        one_day = 86400
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT DISTINCT history.rowid\
-                                  FROM history, history_atime\
-                                  WHERE history_atime.history_id=history.rowid\
-                                  AND atime <= ?", (atime + one_day,))
-            items = list(itertools.chain(*result))
-            sql.execute("DELETE FROM history_atime\
-                         WHERE atime <= ?", (atime + one_day,))
-            sql.commit()
-            return items
+            result = sql.execute("SELECT DISTINCT history_id\
+                                  FROM history_atime\
+                                  WHERE atime >= ? AND atime <= ?",
+                                 (start, end))
+            history_ids = list(itertools.chain(*result))
+            count = len(history_ids)
+            for i in range(0, count, chunk_size):
+                if cancellable is not None and cancellable.is_cancelled():
+                    break
+                chunk = history_ids[i:i + chunk_size]
+                sql.executemany("DELETE FROM history_atime\
+                                 WHERE history_id=?\
+                                 AND atime >= ? AND atime <= ?",
+                                [(history_id, start, end)
+                                 for history_id in chunk])
+                result = sql.execute("SELECT rowid, guid FROM history\
+                                      WHERE rowid IN (%s)\
+                                      AND NOT EXISTS (\
+                                        SELECT rowid FROM history_atime AS ha\
+                                        WHERE ha.history_id=history.rowid)" %
+                                     ",".join("?" * len(chunk)), chunk)
+                removed = dict(result)
+                sql.executemany("DELETE FROM history\
+                                 WHERE rowid=?",
+                                [(history_id,) for history_id in removed])
+                self.__remove_content(sql, list(removed.keys()))
+                sql.commit()
+                modified = [history_id for history_id in chunk
+                            if history_id not in removed]
+                yield (list(removed.values()), modified,
+                       (i + len(chunk)) / count)
 
     def get_empties(self):
         """
@@ -167,20 +249,40 @@ class DatabaseHistory:
                                     WHERE ha.history_id=history.rowid)")
             return list(itertools.chain(*result))
 
-    def get(self, atime):
+    def get(self, atime, limit=-1, offset=None):
         """
             Get history for atime (current day)
+            Keyset pagination: pass last returned (atime, history id)
+            as offset to get next page
             @param atime as int
-            @return (str, str, int)
+            @param limit as int
+            @param offset as (int, int)
+            @return [(int, str, str, int)]
         """
         one_day = 86400
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT history.rowid, title, uri, atime\
-                                  FROM history, history_atime\
-                                  WHERE history.rowid=history_atime.history_id\
-                                  AND atime >= ? AND atime <= ?\
-                                  ORDER BY atime DESC",
-                                 (atime, atime + one_day))
+            if offset is None:
+                result = sql.execute("SELECT history.rowid, title, uri, atime\
+                                      FROM history_atime, history\
+                                      WHERE history.rowid=\
+                                        history_atime.history_id\
+                                      AND atime >= ? AND atime <= ?\
+                                      ORDER BY atime DESC, history_id DESC\
+                                      LIMIT ?",
+                                     (atime, atime + one_day, limit))
+            else:
+                (last_atime, last_id) = offset
+                result = sql.execute("SELECT history.rowid, title, uri, atime\
+                                      FROM history_atime, history\
+                                      WHERE history.rowid=\
+                                        history_atime.history_id\
+                                      AND atime >= ? AND atime <= ?\
+                                      AND (atime < ? OR\
+                                           (atime = ? AND history_id < ?))\
+                                      ORDER BY atime DESC, history_id DESC\
+                                      LIMIT ?",
+                                     (atime, last_atime, last_atime,
+                                      last_atime, last_id, limit))
             return list(result)
 
     def get_id(self, uri):
@@ -190,11 +292,10 @@ class DatabaseHistory:
             @return history_id as int
         """
         with SqlCursor(self) as sql:
-            uri = uri.rstrip('/')
             result = sql.execute("SELECT rowid\
                                   FROM history\
-                                  WHERE uri=?",
-                                 (uri,))
+                                  WHERE canonical=?",
+                                 (get_canonical_uri(uri),))
             v = result.fetchone()
             if v is not None:
                 return v[0]
@@ -245,6 +346,30 @@ class DatabaseHistory:
                 return v[0]
             return None
 
+    def get_guids_for_uris(self, uris):
+        """
+            Get guids for uris, matching on canonical uri
+            @param uris as [str]
+            @return {uri: guid} as {str: str}
+        """
+        canonicals = {}
+        for uri in uris:
+            canonicals.setdefault(get_canonical_uri(uri), []).append(uri)
+        keys = list(canonicals.keys())
+        guids = {}
+        with SqlCursor(self) as sql:
+            # Stay below SQLite max variable number
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                result = sql.execute("SELECT canonical, guid\
+                                      FROM history\
+                                      WHERE canonical IN (%s)" %
+                                     ",".join("?" * len(chunk)), chunk)
+                for (canonical, guid) in result:
+                    for uri in canonicals[canonical]:
+                        guids[uri] = guid
+        return guids
+
     def get_mtime(self, history_id):
         """
             Get history mtime
@@ -272,6 +397,61 @@ class DatabaseHistory:
                                   WHERE history_id=?", (history_id,))
             return list(itertools.chain(*result))
 
+    def get_records(self, history_ids, max_visits=20):
+        """
+            Get history records for ids, with visits not uploaded yet,
+            most recent first. If all visits are uploaded, only last one
+            is returned. No visits means entry has been cleared.
+            @param history_ids as [int]
+            @param max_visits as int
+            @return [(history_id, guid, uri, title, atimes)]
+                     as [(int, str, str, str, [int])]
+        """
+        records = []
+        with SqlCursor(self) as sql:
+            # Stay below SQLite max variable number
+            for i in range(0, len(history_ids), 500):
+                chunk = history_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                atimes = {}
+                new_atimes = {}
+                result = sql.execute("SELECT history_id, atime, synced\
+                                      FROM history_atime\
+                                      WHERE history_id IN (%s)\
+                                      ORDER BY atime DESC" %
+                                     placeholders, chunk)
+                for (history_id, atime, synced) in result:
+                    if history_id not in atimes:
+                        atimes[history_id] = [atime]
+                        new_atimes[history_id] = []
+                    if not synced and\
+                            len(new_atimes[history_id]) < max_visits:
+                        new_atimes[history_id].append(atime)
+                for (history_id, visits) in new_atimes.items():
+                    if visits:
+                        atimes[history_id] = visits
+                result = sql.execute("SELECT rowid, guid, uri, title\
+                                      FROM history\
+                                      WHERE rowid IN (%s)" % placeholders,
+                                     chunk)
+                for (history_id, guid, uri, title) in result:
+                    records.append((history_id, guid, uri, title,
+                                    atimes.get(history_id, [])))
+        return records
+
+    def set_visits_synced(self, visits, commit=True):
+        """
+            Mark visits as uploaded, older visits are never uploaded
+            @param visits as [(int, int)]: (history id, last uploaded atime)
+            @param commit as bool
+        """
+        with SqlCursor(self) as sql:
+            sql.executemany("UPDATE history_atime SET synced=1\
+                             WHERE history_id=? AND atime <= ?\
+                             AND synced=0", visits)
+            if commit:
+                sql.commit()
+
     def get_id_by_guid(self, guid):
         """
             Get id for guid
@@ -287,17 +467,81 @@ class DatabaseHistory:
                 return v[0]
             return None
 
-    def get_ids_for_mtime(self, mtime):
+    def get_changes(self):
         """
-            Get ids that need to be synced related to mtime
-            @param mtime as int
-            @return [int]
+            Get history changed since last upload, see change log
+            @return (last change id, history ids, removed guids)
+                    as (int, [int], [str])
         """
         with SqlCursor(self) as sql:
-            result = sql.execute("SELECT rowid\
-                                  FROM history\
-                                  WHERE mtime > ?", (mtime,))
-            return list(itertools.chain(*result))
+            result = sql.execute("SELECT MAX(id) FROM history_changes")
+            change_id = result.fetchone()[0] or 0
+            result = sql.execute("SELECT history.rowid\
+                                  FROM history_changes, history\
+                                  WHERE history.guid=history_changes.guid\
+                                  AND history_changes.tombstone=0\
+                                  AND history_changes.id <= ?\
+                                  ORDER BY history_changes.id", (change_id,))
+            history_ids = list(itertools.chain(*result))
+            result = sql.execute("SELECT guid\
+                                  FROM history_changes\
+                                  WHERE tombstone=1 AND id <= ?\
+                                  ORDER BY id", (change_id,))
+            return (change_id, history_ids, list(itertools.chain(*result)))
+
+    def get_pending_guids(self):
+        """
+            Get guids changed since last upload
+            @return set(str)
+        """
+        with SqlCursor(self) as sql:
+            result = sql.execute("SELECT guid FROM history_changes")
+            return set(itertools.chain(*result))
+
+    def clear_changes(self, guids, change_id=None, commit=True):
+        """
+            Remove guids from change log, uploaded or applied from remote
+            @param guids as [str]
+            @param change_id as int: keep changes done after this one
+            @param commit as bool
+        """
+        with SqlCursor(self) as sql:
+            if change_id is None:
+                sql.executemany("DELETE FROM history_changes WHERE guid=?",
+                                [(guid,) for guid in guids])
+            else:
+                sql.executemany("DELETE FROM history_changes\
+                                 WHERE guid=? AND id <= ?",
+                                [(guid, change_id) for guid in guids])
+            if commit:
+                sql.commit()
+
+    def get_sync_mtime(self, collection):
+        """
+            Get last known server time for collection
+            @param collection as str
+            @return float/None
+        """
+        with SqlCursor(self) as sql:
+            result = sql.execute("SELECT mtime FROM sync_state\
+                                  WHERE collection=?", (collection,))
+            v = result.fetchone()
+            if v is not None:
+                return v[0]
+            return None
+
+    def set_sync_mtime(self, collection, mtime, commit=True):
+        """
+            Set last known server time for collection
+            @param collection as str
+            @param mtime as float
+            @param commit as bool
+        """
+        with SqlCursor(self) as sql:
+            sql.execute("INSERT OR REPLACE INTO sync_state (collection, mtime)\
+                         VALUES (?, ?)", (collection, mtime))
+            if commit:
+                sql.commit()
 
     def set_title(self, history_id, title, commit=True):
         """
@@ -308,8 +552,9 @@ class DatabaseHistory:
         """
         with SqlCursor(self) as sql:
             sql.execute("UPDATE history\
-                         SET title=?\
-                         WHERE rowid=?", (title, history_id,))
+                         SET title=?, title_normalized=?\
+                         WHERE rowid=?", (title, get_normalized(title),
+                                          history_id))
             if commit:
                 sql.commit()
 
@@ -350,16 +595,82 @@ class DatabaseHistory:
             @return (str, str)
         """
         with SqlCursor(self) as sql:
-            filter = '%' + search + '%'
+            filter = '%' + get_normalized(search) + '%'
             result = sql.execute("SELECT title, uri\
                                   FROM history\
-                                  WHERE title LIKE ?\
+                                  WHERE title_normalized LIKE ?\
                                    OR uri LIKE ?\
                                   ORDER BY popularity DESC,\
                                   mtime DESC LIMIT ?",
                                  (filter, filter, limit))
             return list(result)
 
+    def set_content(self, uri, html):
+        """
+            Index readable content for uri
+            @param uri as str
+            @param html as str
+            @thread safe
+        """
+        try:
+            history_id = self.get_id(uri)
+            if history_id is None:
+                return
+            text = get_text_from_html(html)[:self.__CONTENT_MAX_SIZE]
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT content FROM history_content\
+                                      WHERE history_id=?", (history_id,))
+                v = result.fetchone()
+                if v is not None:
+                    previous = zlib.decompress(v[0]).decode("utf-8")
+                    if previous == text:
+                        return
+                    # Contentless index needs previous values to delete
+                    sql.execute("INSERT INTO history_fts\
+                                 (history_fts, rowid, text)\
+                                 VALUES ('delete', ?, ?)",
+                                (history_id, previous))
+                sql.execute("INSERT OR REPLACE INTO history_content\
+                             (history_id, content) VALUES (?, ?)",
+                            (history_id, zlib.compress(text.encode("utf-8"))))
+                sql.execute("INSERT INTO history_fts (rowid, text)\
+                             VALUES (?, ?)", (history_id, text))
+                sql.commit()
+        except Exception as e:
+            print("DatabaseHistory::set_content():", e)
+
+    def search_content(self, search, limit):
+        """
+            Search string in indexed content
+            @param search as str
+            @param limit as int
+            @return [(str, str, str)] as (title, uri, snippet markup)
+        """
+        words = search.split()
+        if not words:
+            return []
+        # Quote words, last one is a prefix as user is typing
+        match = " ".join(['"%s"' % word.replace('"', '""')
+                          for word in words]) + "*"
+        try:
+            with SqlCursor(self) as sql:
+                result = sql.execute("SELECT history.title,\
+                                             history.uri,\
+                                             history_content.content\
+                                      FROM history_fts, history,\
+                                           history_content\
+                                      WHERE history_fts MATCH ?\
+                                      AND history.rowid=history_fts.rowid\
+                                      AND history_content.history_id=\
+                                        history_fts.rowid\
+                                      ORDER BY rank LIMIT ?",
+                                     (match, limit))
+                return [(title, uri, self.__get_snippet(content, words))
+                        for (title, uri, content) in list(result)]
+        except Exception as e:
+            print("DatabaseHistory::search_content():", e)
+            return []
+
     def exists_guid(self, guid):
         """
             Check if guid exists in db
@@ -377,8 +688,6 @@ class DatabaseHistory:
         """
         try:
             c = sqlite3.connect(self.DB_PATH, 600.0)
-            c.create_collation('LOCALIZED', LocalizedCollation())
-            c.create_function("noaccents", 1, noaccents)
             return c
         except:
             exit(-1)
@@ -396,3 +705,172 @@ class DatabaseHistory:
 #######################
 # PRIVATE             #
 #######################
+    def __attach_bookmarks(self, sql):
+        """
+            Attach bookmarks db to connection, so both can be written in
+            one transaction
+            @param sql as sqlite cursor
+            @return True if attached
+        """
+        names = [row[1] for row in sql.execute("PRAGMA database_list")]
+        if "bookmarks_db" in names:
+            return True
+        # Not possible in a transaction, visits wait for next commit
+        if sql.in_transaction:
+            return False
+        sql.execute("ATTACH DATABASE ? AS bookmarks_db",
+                    (El().bookmarks.DB_PATH,))
+        return True
+
+    def __remove_content(self, sql, history_ids):
+        """
+            Remove indexed content for history ids
+            @param sql as sqlite cursor
+            @param history_ids as [int]
+        """
+        try:
+            for history_id in history_ids:
+                result = sql.execute("SELECT content FROM history_content\
+                                      WHERE history_id=?", (history_id,))
+                v = result.fetchone()
+                if v is None:
+                    continue
+                sql.execute("INSERT INTO history_fts\
+                             (history_fts, rowid, text)\
+                             VALUES ('delete', ?, ?)",
+                            (history_id,
+                             zlib.decompress(v[0]).decode("utf-8")))
+                sql.execute("DELETE FROM history_content\
+                             WHERE history_id=?", (history_id,))
+        except Exception as e:
+            print("DatabaseHistory::__remove_content():", e)
+
+    def __get_snippet(self, content, words, size=80):
+        """
+            Get a snippet of content around first matching word
+            @param content as bytes (compressed)
+            @param words as [str]
+            @param size as int
+            @return str (markup)
+        """
+        text = zlib.decompress(content).decode("utf-8")
+        regex = re.compile("|".join([re.escape(word) for word in words]),
+                           re.IGNORECASE)
+        match = regex.search(text)
+        if match is None:
+            return GLib.markup_escape_text(text[:size])
+        start = max(0, match.start() - size // 2)
+        snippet = text[start:start + size]
+        markup = ""
+        position = 0
+        for match in regex.finditer(snippet):
+            markup += GLib.markup_escape_text(
+                                          snippet[position:match.start()])
+            markup += "<b>%s</b>" % GLib.markup_escape_text(match.group(0))
+            position = match.end()
+        markup += GLib.markup_escape_text(snippet[position:])
+        return markup
+
+    def __upgrade_sync_state(self, sql):
+        """
+            Add sync state and change log, change log is kept up to date
+            by triggers. Import state from mozilla_sync.bin
+            @param sql as sqlite cursor
+        """
+        sql.execute("CREATE TABLE sync_state (\
+                        collection TEXT PRIMARY KEY,\
+                        mtime REAL NOT NULL)")
+        # AUTOINCREMENT: a guid changed again always gets a greater id
+        sql.execute("CREATE TABLE history_changes (\
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,\
+                        guid TEXT NOT NULL UNIQUE,\
+                        tombstone INT NOT NULL)")
+        for (name, action, row) in [("visit", "INSERT", "NEW"),
+                                    ("unvisit", "DELETE", "OLD"),
+                                    ("merge", "UPDATE OF history_id", "NEW")]:
+            sql.execute("CREATE TRIGGER history_changes_%s\
+                         AFTER %s ON history_atime\
+                         BEGIN\
+                            INSERT OR REPLACE INTO history_changes\
+                            (guid, tombstone)\
+                            SELECT guid, 0 FROM history\
+                            WHERE rowid=%s.history_id;\
+                         END" % (name, action, row))
+        sql.execute("CREATE TRIGGER history_changes_title\
+                     AFTER UPDATE OF title ON history\
+                     BEGIN\
+                        INSERT OR REPLACE INTO history_changes\
+                        (guid, tombstone) VALUES (NEW.guid, 0);\
+                     END")
+        sql.execute("CREATE TRIGGER history_changes_remove\
+                     AFTER DELETE ON history\
+                     BEGIN\
+                        INSERT OR REPLACE INTO history_changes\
+                        (guid, tombstone) VALUES (OLD.guid, 1);\
+                     END")
+        try:
+            mtimes = load(open(self.__LOCAL_PATH + "/mozilla_sync.bin", "rb"))
+        except:
+            mtimes = {}
+        for key in ["history", "history-pull"]:
+            if key in mtimes.keys():
+                sql.execute("INSERT INTO sync_state (collection, mtime)\
+                             VALUES (?, ?)", (key, mtimes[key]))
+
+    def __upgrade_canonical(self, sql):
+        """
+            Compute canonical uris for existing entries
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT rowid, uri FROM history")
+        sql.executemany("UPDATE history SET canonical=? WHERE rowid=?",
+                        [(get_canonical_uri(uri), rowid)
+                         for (rowid, uri) in list(result)])
+
+    def __upgrade_duplicates(self, sql):
+        """
+            Merge entries with same canonical uri into most popular one:
+            visits are moved, popularity is summed
+            Merged entries are only removed locally, other sync clients
+            may still know them
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT canonical FROM history\
+                              GROUP BY canonical\
+                              HAVING COUNT(*) > 1")
+        for canonical in list(itertools.chain(*result)):
+            result = sql.execute("SELECT rowid, popularity\
+                                  FROM history\
+                                  WHERE canonical=?\
+                                  ORDER BY popularity DESC, rowid",
+                                 (canonical,))
+            rows = list(result)
+            history_id = rows[0][0]
+            others = [row[0] for row in rows[1:]]
+            sql.executemany("UPDATE history_atime SET history_id=?\
+                             WHERE history_id=?",
+                            [(history_id, other) for other in others])
+            # Same visit may be known for both entries
+            sql.execute("DELETE FROM history_atime\
+                         WHERE history_id=?\
+                         AND rowid NOT IN (\
+                            SELECT MIN(rowid) FROM history_atime\
+                            WHERE history_id=? GROUP BY atime)",
+                        (history_id, history_id))
+            sql.execute("UPDATE history SET popularity=?\
+                         WHERE rowid=?",
+                        (sum([row[1] for row in rows]), history_id))
+            sql.executemany("DELETE FROM history WHERE rowid=?",
+                            [(other,) for other in others])
+            self.__remove_content(sql, others)
+
+    def __upgrade_title_normalized(self, sql):
+        """
+            Compute normalized titles for existing entries
+            @param sql as sqlite cursor
+        """
+        result = sql.execute("SELECT rowid, title FROM history")
+        sql.executemany("UPDATE history SET title_normalized=?\
+                         WHERE rowid=?",
+                        [(get_normalized(title), rowid)
+                         for (rowid, title) in list(result)])
@@ -0,0 +1,76 @@
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from eolie.sqlcursor import SqlCursor
+
+
+class DatabaseUpgrade:
+    """
+        Manage database schema upgrades
+    """
+
+    def __init__(self, db, upgrades):
+        """
+            Init object
+            @param db as DatabaseHistory/DatabaseBookmarks
+            @param upgrades as {int: str/function}
+        """
+        self.__db = db
+        # Key is database version, value is sql request or a function
+        # taking current sql cursor as argument
+        self.__upgrades = upgrades
+
+    def do_db_upgrade(self):
+        """
+            Upgrade database based on version
+            Each upgrade is applied in its own transaction, stop at first
+            failure so next run starts again from failed upgrade
+        """
+        version = self.version
+        if version >= self.count:
+            return
+        with SqlCursor(self.__db) as sql:
+            for i in range(version + 1, self.count + 1):
+                try:
+                    # Python sqlite3 does not open a transaction for DDL
+                    sql.execute("BEGIN")
+                    if isinstance(self.__upgrades[i], str):
+                        sql.execute(self.__upgrades[i])
+                    else:
+                        self.__upgrades[i](sql)
+                    sql.execute("PRAGMA user_version=%s" % i)
+                    sql.commit()
+                except Exception as e:
+                    print("DatabaseUpgrade::do_db_upgrade(): %s: %s" % (i, e))
+                    sql.rollback()
+                    break
+
+    @property
+    def count(self):
+        """
+            Available upgrades count
+            @return int
+        """
+        return len(self.__upgrades)
+
+    @property
+    def version(self):
+        """
+            Current database version
+            @return int
+        """
+        with SqlCursor(self.__db) as sql:
+            result = sql.execute("PRAGMA user_version")
+            v = result.fetchone()
+            if v is not None:
+                return v[0]
+            return 0
@@ -10,9 +10,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import Gtk
+from gi.repository import Gtk, Gio, GLib
 
 from gettext import gettext as _
+from threading import Thread
 
 from eolie.define import El
 
@@ -40,13 +41,11 @@ class ImportBookmarksDialog:
         self.__dialog = builder.get_object("dialog")
         self.__dialog.set_transient_for(parent)
         self.__listbox = builder.get_object("listbox")
-        items = ["Firefox", "Chromium", "Chrome"]
-        try:
-            from bs4 import BeautifulSoup
-            BeautifulSoup
-            items.append(_("Others"))
-        except Exception as e:
-            print("ImportBookmarksDialog::__init__():", e)
+        self.__progress = builder.get_object("progress")
+        self.__import_button = builder.get_object("import_button")
+        self.__cancellable = Gio.Cancellable.new()
+        self.__importing = False
+        items = ["Firefox", "Chromium", "Chrome", _("Others")]
         for item in items:
             label = Gtk.Label.new(item)
             label.show()
@@ -56,10 +55,9 @@ class ImportBookmarksDialog:
 
     def run(self):
         """
-            Run dialog
+            Show dialog, destroyed on response or when import is finished
         """
-        self.__dialog.run()
-        self.__dialog.destroy()
+        self.__dialog.show()
 
 #######################
 # PROTECTED           #
@@ -71,14 +69,19 @@ class ImportBookmarksDialog:
             @param response_id as int
         """
         if response_id == Gtk.ResponseType.DELETE_EVENT:
+            self.__cancellable.cancel()
+            self.__dialog.destroy()
             return
         index = self.__listbox.get_selected_row().get_index()
         if index == self.__Choice.FIREFOX:
-            El().bookmarks.import_firefox()
+            self.__start_import(El().bookmarks.import_firefox,
+                                self.__cancellable)
         elif index == self.__Choice.CHROME:
-            El().bookmarks.import_chromium(True)
+            self.__start_import(El().bookmarks.import_chromium, True,
+                                self.__cancellable)
         elif index == self.__Choice.CHROMIUM:
-            El().bookmarks.import_chromium(False)
+            self.__start_import(El().bookmarks.import_chromium, False,
+                                self.__cancellable)
         else:
             dialog = Gtk.FileChooserDialog(
                                    _("Import HTML bookmarks"), self.__parent,
@@ -89,6 +92,8 @@ class ImportBookmarksDialog:
             dialog.run()
             dialog.destroy()
         self.__parent.toolbar.title.hide_popover()
+        if not self.__importing:
+            self.__dialog.destroy()
 
 #######################
 # PRIVATE             #
@@ -100,5 +105,31 @@ class ImportBookmarksDialog:
             @param response_id as int
         """
         if response_id == Gtk.ResponseType.OK:
-            path = dialog.get_filename()
-            El().bookmarks.import_html(path)
+            self.__start_import(El().bookmarks.import_html,
+                                dialog.get_filename(), self.__cancellable)
+
+    def __start_import(self, method, *args):
+        """
+            Run import method in a thread, show progress
+            @param method as function yielding progress
+            @param args as method args
+        """
+        self.__importing = True
+        self.__listbox.set_sensitive(False)
+        self.__import_button.set_sensitive(False)
+        self.__progress.show()
+        thread = Thread(target=self.__import, args=(method,) + args)
+        thread.daemon = True
+        thread.start()
+
+    def __import(self, method, *args):
+        """
+            Import bookmarks and update progress
+            @param method as function yielding progress
+            @param args as method args
+            @thread safe
+        """
+        for progress in method(*args):
+            GLib.idle_add(self.__progress.set_fraction, progress)
+        if not self.__cancellable.is_cancelled():
+            GLib.idle_add(self.__dialog.destroy)
@@ -0,0 +1,421 @@
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+import json
+import os
+import itertools
+from html import escape
+from tempfile import mkstemp
+from urllib.request import pathname2url
+
+from eolie.database_bookmarks import DatabaseBookmarks
+from eolie.database_history import DatabaseHistory
+
+
+class Exporter:
+    """
+        Export bookmarks and history to Netscape HTML, JSON or Firefox
+        bookmarks backup (places JSON)
+        Rows are streamed from db, so memory usage does not depend on
+        profile size. Application does not need to be running.
+    """
+    # Firefox roots: (sync guid, places guid, root name)
+    __PLACES_ROOTS = [("menu", "menu________", "bookmarksMenuFolder"),
+                      ("toolbar", "toolbar_____", "toolbarFolder"),
+                      ("unfiled", "unfiled_____", "unfiledBookmarksFolder"),
+                      ("mobile", "mobile______", "mobileFolder")]
+
+    def __init__(self, history=False, places=False):
+        """
+            Init exporter
+            @param history as bool: export history too
+            @param places as bool: export a Firefox bookmarks backup,
+                   Firefox restores bookmarks only so history is ignored
+        """
+        self.__history = history and not places
+        self.__places = places
+        self.__status = False
+        self.__count = 0
+        self.__total = 0
+
+    def export(self, path, cancellable=None):
+        """
+            Export to path, JSON if path ends with .json, HTML otherwise
+            Firefox bookmarks backup is always JSON
+            Data is written to a temporary file renamed on success
+            @param path as str
+            @param cancellable as Gio.Cancellable
+            @return yield progress as float
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        (fd, tmp_path) = mkstemp(dir=directory, suffix=".tmp")
+        bookmarks = None
+        history = None
+        cancelled = False
+        self.__status = False
+        try:
+            bookmarks = self.__connect(DatabaseBookmarks.DB_PATH)
+            if self.__history:
+                history = self.__connect(DatabaseHistory.DB_PATH)
+            self.__count = 0
+            self.__total = self.__get_total(bookmarks, history)
+            with open(fd, "w", encoding="utf-8") as f:
+                if self.__places:
+                    writer = self.__write_places(f, bookmarks)
+                elif path.endswith(".json"):
+                    writer = self.__write_json(f, bookmarks, history)
+                else:
+                    writer = self.__write_html(f, bookmarks, history)
+                for progress in writer:
+                    if cancellable is not None and\
+                            cancellable.is_cancelled():
+                        cancelled = True
+                        break
+                    yield progress
+            if not cancelled:
+                os.replace(tmp_path, path)
+                self.__status = True
+        except Exception as e:
+            print("Exporter::export():", e)
+        finally:
+            for connection in [bookmarks, history]:
+                if connection is not None:
+                    connection.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @property
+    def status(self):
+        """
+            True if last export succeeded
+            @return bool
+        """
+        return self.__status
+
+#######################
+# PRIVATE             #
+#######################
+    def __connect(self, path):
+        """
+            Open db read only
+            @param path as str
+            @return sqlite3.Connection
+        """
+        return sqlite3.connect("file:%s?mode=ro" % pathname2url(path),
+                               600.0, uri=True)
+
+    def __get_total(self, bookmarks, history):
+        """
+            Get row count to export
+            @param bookmarks as sqlite3.Connection
+            @param history as sqlite3.Connection/None
+            @return int
+        """
+        total = bookmarks.execute("SELECT COUNT(*) FROM bookmarks\
+                                   WHERE del=0").fetchone()[0]
+        if history is not None:
+            total += history.execute("SELECT COUNT(*)\
+                                      FROM history").fetchone()[0]
+        return max(1, total)
+
+    def __get_bookmarks(self, bookmarks, where="", args=()):
+        """
+            Get bookmarks with tags and parent
+            @param bookmarks as sqlite3.Connection
+            @param where as str: extra sql filter
+            @param args as tuple: filter arguments
+            @return iterator over (guid, title, uri, atime, mtime,
+                                   popularity, parent_guid, parent_name,
+                                   position, tags)
+        """
+        return bookmarks.execute("\
+                    SELECT bookmarks.guid, bookmarks.title, bookmarks.uri,\
+                           bookmarks.atime, bookmarks.mtime,\
+                           bookmarks.popularity,\
+                           COALESCE(parents.parent_guid, 'unfiled'),\
+                           COALESCE(parents.parent_name, ''),\
+                           bookmarks.position,\
+                           (SELECT group_concat(tags.title, ',')\
+                            FROM bookmarks_tags, tags\
+                            WHERE bookmarks_tags.bookmark_id=bookmarks.rowid\
+                            AND tags.rowid=bookmarks_tags.tag_id)\
+                    FROM bookmarks\
+                    LEFT JOIN parents\
+                    ON parents.bookmark_id=bookmarks.rowid\
+                    WHERE bookmarks.del=0 %s\
+                    ORDER BY bookmarks.position_key" % where, args)
+
+    def __get_history(self, history):
+        """
+            Get history with visits
+            @param history as sqlite3.Connection
+            @return iterator over (guid, title, uri, mtime, popularity,
+                                   atimes as str)
+        """
+        return history.execute("SELECT history.guid, history.title,\
+                                       history.uri, history.mtime,\
+                                       history.popularity,\
+                                       group_concat(history_atime.atime)\
+                                FROM history\
+                                LEFT JOIN history_atime\
+                                ON history_atime.history_id=history.rowid\
+                                GROUP BY history.rowid")
+
+    def __progress(self):
+        """
+            Count a written row
+            @return progress as float
+        """
+        self.__count += 1
+        return self.__count / self.__total
+
+    def __write_json(self, f, bookmarks, history):
+        """
+            Write JSON, one record per line
+            @param f as file
+            @param bookmarks as sqlite3.Connection
+            @param history as sqlite3.Connection/None
+            @return yield progress as float
+        """
+        f.write('{"bookmarks": [')
+        separator = "\n"
+        for (guid, title, uri, atime, mtime, popularity, parent_guid,
+             parent_name, position, tags) in self.__get_bookmarks(bookmarks):
+            record = {"guid": guid, "title": title, "uri": uri,
+                      "atime": atime, "mtime": mtime,
+                      "popularity": popularity, "parent_guid": parent_guid,
+                      "parent_name": parent_name, "position": position,
+                      "tags": tags.split(",") if tags else []}
+            f.write(separator + json.dumps(record))
+            separator = ",\n"
+            yield self.__progress()
+        f.write("\n]")
+        if history is not None:
+            f.write(', "history": [')
+            separator = "\n"
+            for (guid, title, uri, mtime, popularity,
+                 atimes) in self.__get_history(history):
+                visits = [float(atime) for atime in atimes.split(",")]\
+                    if atimes else []
+                record = {"guid": guid, "title": title, "uri": uri,
+                          "mtime": mtime, "popularity": popularity,
+                          "visits": sorted(visits)}
+                f.write(separator + json.dumps(record))
+                separator = ",\n"
+                yield self.__progress()
+            f.write("\n]")
+        f.write("}\n")
+
+    def __write_html(self, f, bookmarks, history):
+        """
+            Write Netscape bookmarks file
+            Folders come from parents, tags from TAGS attribute
+            @param f as file
+            @param bookmarks as sqlite3.Connection
+            @param history as sqlite3.Connection/None
+            @return yield progress as float
+        """
+        f.write("<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+                "<META HTTP-EQUIV=\"Content-Type\""
+                " CONTENT=\"text/html; charset=UTF-8\">\n"
+                "<TITLE>Bookmarks</TITLE>\n"
+                "<H1>Bookmarks</H1>\n"
+                "<DL><p>\n")
+        # Folders are bookmarks with guid as uri
+        folders = set(guid for (guid,) in bookmarks.execute(
+                                            "SELECT guid FROM bookmarks\
+                                             WHERE guid=uri AND del=0"))
+        visited = set()
+        for progress in self.__write_html_folder(f, bookmarks, folders,
+                                                 visited, "places", 1):
+            yield progress
+        # Bookmarks without a known folder are written at top level
+        known = ["places"] + list(folders)
+        orphans = self.__get_bookmarks(
+                    bookmarks,
+                    "AND bookmarks.guid!=bookmarks.uri\
+                     AND COALESCE(parents.parent_guid, 'unfiled')\
+                     NOT IN (%s)" % ",".join("?" * len(known)),
+                    tuple(known))
+        for row in orphans:
+            self.__write_html_bookmark(f, row, 1)
+            yield self.__progress()
+        if history is not None:
+            f.write("    <DT><H3>History</H3>\n    <DL><p>\n")
+            for (guid, title, uri, mtime, popularity,
+                 atimes) in self.__get_history(history):
+                atime = max([float(atime) for atime in atimes.split(",")])\
+                    if atimes else mtime
+                f.write('        <DT><A HREF="%s" LAST_VISIT="%d">%s</A>\n' %
+                        (escape(uri), atime, escape(title)))
+                yield self.__progress()
+            f.write("    </DL><p>\n")
+        f.write("</DL>\n")
+
+    def __write_html_folder(self, f, bookmarks, folders, visited, guid,
+                            depth):
+        """
+            Write folder children
+            @param f as file
+            @param bookmarks as sqlite3.Connection
+            @param folders as set(str)
+            @param visited as set(str): written folders, protect from cycles
+            @param guid as str
+            @param depth as int
+            @return yield progress as float
+        """
+        visited.add(guid)
+        indent = "    " * depth
+        children = self.__get_bookmarks(
+                    bookmarks,
+                    "AND COALESCE(parents.parent_guid, 'unfiled')=?", (guid,))
+        for row in children:
+            child_guid = row[0]
+            if child_guid in folders:
+                if child_guid in visited:
+                    continue
+                f.write('%s<DT><H3>%s</H3>\n%s<DL><p>\n' %
+                        (indent, escape(row[1]), indent))
+                for progress in self.__write_html_folder(f, bookmarks,
+                                                         folders, visited,
+                                                         child_guid,
+                                                         depth + 1):
+                    yield progress
+                f.write("%s</DL><p>\n" % indent)
+            else:
+                self.__write_html_bookmark(f, row, depth)
+            yield self.__progress()
+
+    def __write_places(self, f, bookmarks):
+        """
+            Write Firefox bookmarks backup, restorable from Firefox library
+            Bookmarks without a known folder are written in unfiled
+            @param f as file
+            @param bookmarks as sqlite3.Connection
+            @return yield progress as float
+        """
+        folders = set(guid for (guid,) in bookmarks.execute(
+                                            "SELECT guid FROM bookmarks\
+                                             WHERE guid=uri AND del=0"))
+        # Roots are written once, whatever db contains
+        visited = set(["places"] + [root for (root, places_guid, name)
+                                    in self.__PLACES_ROOTS])
+        f.write(self.__get_places_container("root________", "", 0, 0,
+                                            "placesRoot"))
+        for (index, (root, places_guid, name)) in enumerate(
+                                                        self.__PLACES_ROOTS):
+            if index:
+                f.write(",\n")
+            f.write(self.__get_places_container(places_guid, root, index, 0,
+                                                name))
+            children = self.__get_bookmarks(
+                    bookmarks,
+                    "AND COALESCE(parents.parent_guid, 'unfiled')=?", (root,))
+            if root == "unfiled":
+                known = ["places"] + list(visited | folders)
+                children = itertools.chain(
+                    children,
+                    # Firefox only allows roots in places
+                    self.__get_bookmarks(
+                        bookmarks,
+                        "AND parents.parent_guid='places'"),
+                    self.__get_bookmarks(
+                        bookmarks,
+                        "AND COALESCE(parents.parent_guid, 'unfiled')\
+                         NOT IN (%s)" % ",".join("?" * len(known)),
+                        tuple(known)))
+            for progress in self.__write_places_children(f, bookmarks,
+                                                         folders, visited,
+                                                         children):
+                yield progress
+            f.write("]}")
+        f.write("]}\n")
+
+    def __write_places_children(self, f, bookmarks, folders, visited, rows):
+        """
+            Write folder children
+            @param f as file
+            @param bookmarks as sqlite3.Connection
+            @param folders as set(str)
+            @param visited as set(str): written folders, protect from cycles
+            @param rows as iterator, see __get_bookmarks()
+            @return yield progress as float
+        """
+        index = 0
+        for row in rows:
+            (guid, title, uri, atime, mtime, popularity, parent_guid,
+             parent_name, position, tags) = row
+            if guid in visited:
+                yield self.__progress()
+                continue
+            if index:
+                f.write(",\n")
+            if guid in folders:
+                visited.add(guid)
+                f.write(self.__get_places_container(guid, title, index,
+                                                    mtime))
+                children = self.__get_bookmarks(
+                    bookmarks,
+                    "AND COALESCE(parents.parent_guid, 'unfiled')=?", (guid,))
+                for progress in self.__write_places_children(f, bookmarks,
+                                                             folders,
+                                                             visited,
+                                                             children):
+                    yield progress
+                f.write("]}")
+            else:
+                record = {"guid": guid, "title": title, "index": index,
+                          "dateAdded": int(mtime * 1000000),
+                          "lastModified": int(mtime * 1000000),
+                          "typeCode": 1, "type": "text/x-moz-place",
+                          "uri": uri}
+                if tags:
+                    record["tags"] = tags
+                f.write(json.dumps(record))
+            index += 1
+            yield self.__progress()
+
+    def __get_places_container(self, guid, title, index, mtime, root=None):
+        """
+            Get places folder opening, children and "]}" must follow
+            @param guid as str
+            @param title as str
+            @param index as int
+            @param mtime as float
+            @param root as str/None
+            @return str
+        """
+        record = {"guid": guid, "title": title, "index": index,
+                  "dateAdded": int(mtime * 1000000),
+                  "lastModified": int(mtime * 1000000),
+                  "typeCode": 2, "type": "text/x-moz-place-container"}
+        if root is not None:
+            record["root"] = root
+        return json.dumps(record)[:-1] + ', "children": [\n'
+
+    def __write_html_bookmark(self, f, row, depth):
+        """
+            Write a bookmark
+            @param f as file
+            @param row as tuple, see __get_bookmarks()
+            @param depth as int
+        """
+        (guid, title, uri, atime, mtime, popularity, parent_guid,
+         parent_name, position, tags) = row
+        attrs = 'HREF="%s"' % escape(uri)
+        if atime:
+            attrs += ' LAST_VISIT="%d"' % atime
+        if tags:
+            attrs += ' TAGS="%s"' % escape(tags)
+        f.write('%s<DT><A %s>%s</A>\n' % ("    " * depth, attrs,
+                                          escape(title)))
@@ -10,17 +10,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from locale import strcoll
+from locale import strxfrm, setlocale, LC_COLLATE
 
 
-class LocalizedCollation(object):
+def get_sort_key(string):
     """
-        COLLATE LOCALIZED missing from default sqlite installation
-        Android only
+        Get a localized sort key for string
+        Keys compare like strcoll() with plain binary comparison, so
+        they can be stored in db and used by ORDER BY at native speed
+        @param string as str
+        @return str
     """
+    return strxfrm(string)
 
-    def __init__(self):
-        pass
 
-    def __call__(self, v1, v2):
-        return strcoll(v1, v2)
+def get_collation():
+    """
+        Get locale used by get_sort_key(), stored keys must be computed
+        again when it changes
+        @return str
+    """
+    return setlocale(LC_COLLATE)
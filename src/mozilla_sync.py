@@ -13,18 +13,16 @@
 
 from gi.repository import Gio, Secret, GObject, GLib
 
-from pickle import dump, load
 from hashlib import sha256
 from binascii import hexlify
 import json
 import six
-import hmac
 import base64
-import math
+import itertools
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from time import time
-from Crypto.Cipher import AES
-from Crypto import Random
 from requests_hawk import HawkAuth
 from fxa.core import Client as FxAClient, Session as FxASession
 from fxa.crypto import quick_stretch_password
@@ -33,10 +31,32 @@ from threading import Thread
 from eolie.define import El
 from eolie.utils import debug
 from eolie.sqlcursor import SqlCursor
+from eolie.sync_crypto import KeyBundle, encrypt_payload, decrypt_payload,\
+    decrypt_pages, shutdown_workers
 
 
-TOKENSERVER_URL = "https://token.services.mozilla.com/"
-FXA_SERVER_URL = "https://api.accounts.firefox.com"
+# Endpoints can be overridden, for example to use a self hosted server
+# or the local stand-in from sync_server.py
+TOKENSERVER_URL = GLib.getenv("EOLIE_TOKENSERVER_URL") or\
+    "https://token.services.mozilla.com/"
+FXA_SERVER_URL = GLib.getenv("EOLIE_FXA_SERVER_URL") or\
+    "https://api.accounts.firefox.com"
+
+
+def get_http_session():
+    """
+        Get an HTTP session keeping connections alive, retrying on
+        network errors and server overload with a backoff
+        @return requests.Session
+    """
+    session = requests.Session()
+    # POST is not retried, server may have applied it
+    retry = Retry(total=3, backoff_factor=0.5,
+                  status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
 class SyncWorker(GObject.GObject):
@@ -46,6 +66,9 @@ class SyncWorker(GObject.GObject):
     __gsignals__ = {
         'sync-finish': (GObject.SignalFlags.RUN_FIRST, None, ()),
     }
+    # Queued history is uploaded after this delay (s) or at this size
+    __HISTORY_QUEUE_DELAY = 30
+    __HISTORY_QUEUE_SIZE = 100
 
     def __init__(self):
         """
@@ -55,10 +78,22 @@ class SyncWorker(GObject.GObject):
         self.__stop = True
         self.__username = ""
         self.__password = ""
-        self.__mtimes = {"bookmarks": 0.1, "history": 0.1}
         self.__status = False
         self.__client = MozillaSync()
         self.__session = None
+        self.__bulk_keys = None
+        # History ids and guids waiting for upload, only used for
+        # flushing, changes are in history change log
+        self.__history_queue = set()
+        self.__history_timeout_id = None
+        self.__pushing = False
+        # Imported by databases upgrades, see sync_state tables
+        try:
+            f = Gio.File.new_for_path(El().LOCAL_PATH + "/mozilla_sync.bin")
+            if f.query_exists():
+                f.delete(None)
+        except Exception as e:
+            print("SyncWorker::__init__():", e)
 
     def sync(self, first_sync=False):
         """
@@ -77,25 +112,20 @@ class SyncWorker(GObject.GObject):
 
     def push_history(self, history_ids):
         """
-            Push history ids
+            Queue history ids for upload
+            Thread safe, queue is only updated in main loop
             @param history_ids as [int]
         """
-        if Gio.NetworkMonitor.get_default().get_network_available():
-            thread = Thread(target=self.__push_history,
-                            args=(history_ids,))
-            thread.daemon = True
-            thread.start()
+        GLib.idle_add(self.__queue_history, set(history_ids))
 
-    def remove_from_history(self, guid):
+    def remove_from_history(self, guids):
         """
-            Remove history id from remote history
+            Queue history guids for removal from remote history
             A first call to sync() is needed to populate secrets
-            @param guid as str
+            Thread safe, queue is only updated in main loop
+            @param guids as [str]
         """
-        if Gio.NetworkMonitor.get_default().get_network_available():
-            thread = Thread(target=self.__remove_from_history, args=(guid,))
-            thread.daemon = True
-            thread.start()
+        GLib.idle_add(self.__queue_history, set(guids))
 
     def delete_secret(self):
         """
@@ -103,6 +133,8 @@ class SyncWorker(GObject.GObject):
         """
         self.__username = ""
         self.__password = ""
+        self.__session = None
+        self.__bulk_keys = None
         Secret.Service.get(Secret.ServiceFlags.NONE, None,
                            self.__on_get_secret, False, True)
 
@@ -111,14 +143,7 @@ class SyncWorker(GObject.GObject):
             Stop update
         """
         self.__stop = True
-
-    @property
-    def mtimes(self):
-        """
-            Sync engine modification times
-            @return {}
-        """
-        return self.__mtimes
+        shutdown_workers()
 
     @property
     def syncing(self):
@@ -149,9 +174,11 @@ class SyncWorker(GObject.GObject):
 #######################
     def __get_session_bulk_keys(self):
         """
-            Get session decrypt keys
+            Get session decrypt keys, cached until sync token expires
             @return keys as (b"", b"")
         """
+        if self.__bulk_keys is not None and not self.__client.expired:
+            return self.__bulk_keys
         if self.__session is None:
             self.__session = FxASession(self.__client.client,
                                         self.__username,
@@ -169,61 +196,109 @@ class SyncWorker(GObject.GObject):
             bulk_keys = self.__client.connect(bid_assertion, key)
         except Exception as e:
             self.__status = False
+            self.__bulk_keys = None
             raise e
+        self.__bulk_keys = bulk_keys
         return bulk_keys
 
-    def __push_history(self, history_ids):
+    def __queue_history(self, items):
+        """
+            Add items to history queue
+            Flush history queue if full, else wait for more changes
+            @param items as set(int/str)
+        """
+        self.__history_queue |= items
+        if len(self.__history_queue) >= self.__HISTORY_QUEUE_SIZE:
+            self.__flush_history()
+        elif self.__history_timeout_id is None:
+            self.__history_timeout_id = GLib.timeout_add_seconds(
+                                                self.__HISTORY_QUEUE_DELAY,
+                                                self.__on_history_timeout)
+
+    def __flush_history(self):
+        """
+            Upload history change log in a thread
+            Queue is kept in change log if upload is not possible
+        """
+        if self.__history_timeout_id is not None:
+            GLib.source_remove(self.__history_timeout_id)
+            self.__history_timeout_id = None
+        # Only one upload at a time, sync snapshot may miss last changes
+        if self.syncing or self.__pushing:
+            self.__history_timeout_id = GLib.timeout_add_seconds(
+                                                self.__HISTORY_QUEUE_DELAY,
+                                                self.__on_history_timeout)
+        elif Gio.NetworkMonitor.get_default().get_network_available():
+            self.__history_queue = set()
+            self.__pushing = True
+            thread = Thread(target=self.__push_history)
+            thread.daemon = True
+            thread.start()
+
+    def __push_history(self):
         """
-            Push history ids if atime is available, else, ask to remove
-            @param history ids as [int]
+            Push history change log
         """
-        if not self.__username or not self.__password:
-            return
         try:
-            bulk_keys = self.__get_session_bulk_keys()
-            for history_id in history_ids:
-                record = {}
-                atimes = El().history.get_atimes(history_id)
-                guid = El().history.get_guid(history_id)
-                if atimes:
-                    record["histUri"] = El().history.get_uri(history_id)
-                    record["id"] = guid
-                    record["title"] = El().history.get_title(history_id)
-                    record["visits"] = []
-                    for atime in atimes:
-                        record["visits"].append({"date": atime*1000000,
-                                                 "type": 1})
-                    debug("pushing %s" % record)
-                    self.__client.add_history(record, bulk_keys)
-                else:
-                    record["id"] = guid
-                    record["type"] = "item"
-                    record["deleted"] = True
-                    debug("deleting %s" % record)
-                    self.__client.add_history(record, bulk_keys)
-                self.__mtimes = self.__client.client.info_collections()
-                dump(self.__mtimes,
-                     open(El().LOCAL_PATH + "/mozilla_sync.bin", "wb"))
+            if self.__username and self.__password:
+                bulk_keys = self.__get_session_bulk_keys()
+                self.__push_history_changes(bulk_keys)
         except Exception as e:
             print("SyncWorker::__push_history():", e)
+        GLib.idle_add(self.__on_history_pushed)
 
-    def __remove_from_history(self, guid):
-        """
-            Remove from history
-            @param guid as str
+    def __upload_history(self, bulk_keys, history_ids, guids, change_id):
         """
-        if not self.__username or not self.__password:
-            return
-        try:
-            bulk_keys = self.__get_session_bulk_keys()
+            Upload history and remove it from change log, in one commit
+            Entries without atime are removed from remote
+            @param bulk_keys as KeyBundle
+            @param history_ids as [int]
+            @param guids as [str]: removed entries
+            @param change_id as int: last change uploaded
+        """
+        records = []
+        visits = {}
+        # Only new visits, remote clients merge them
+        for (history_id, guid, uri, title, atimes) in\
+                El().history.get_records(history_ids):
+            record = {}
+            if atimes:
+                visits[guid] = (history_id, max(atimes))
+                record["histUri"] = uri
+                record["id"] = guid
+                record["title"] = title
+                record["visits"] = []
+                for atime in atimes:
+                    record["visits"].append({"date": atime*1000000,
+                                             "type": 1})
+                debug("pushing %s" % record)
+            else:
+                record["id"] = guid
+                record["type"] = "item"
+                record["deleted"] = True
+                debug("deleting %s" % record)
+            records.append(record)
+        for guid in guids:
             record = {}
             record["id"] = guid
             record["type"] = "item"
             record["deleted"] = True
             debug("deleting %s" % record)
-            self.__client.add_history(record, bulk_keys)
-        except Exception as e:
-            print("SyncWorker::__remove_from_history():", e)
+            records.append(record)
+        if not records:
+            return
+        (modified, failed) = self.__client.add_history(records, bulk_keys)
+        # Failed records stay in change log, pushed again on next sync
+        El().history.clear_changes([record["id"] for record in records
+                                    if record["id"] not in failed],
+                                   change_id, False)
+        El().history.set_visits_synced([visit for (guid, visit)
+                                        in visits.items()
+                                        if guid not in failed], False)
+        if modified is not None:
+            El().history.set_sync_mtime("history", modified, False)
+        with SqlCursor(El().history) as sql:
+            sql.commit()
 
     def __sync(self, first_sync):
         """
@@ -234,11 +309,6 @@ class SyncWorker(GObject.GObject):
         if not self.__username or not self.__password:
             self.__stop = True
             return
-        try:
-            self.__mtimes = load(open(El().LOCAL_PATH + "/mozilla_sync.bin",
-                                 "rb"))
-        except:
-            self.__mtimes = {"bookmarks": 0.1, "history": 0.1}
         try:
             bulk_keys = self.__get_session_bulk_keys()
             new_mtimes = self.__client.client.info_collections()
@@ -249,20 +319,26 @@ class SyncWorker(GObject.GObject):
             ######################
             # History Management #
             ######################
+            history_mtime = El().history.get_sync_mtime("history")
             debug("local history: %s, remote history: %s" % (
-                                                 self.__mtimes["history"],
+                                                 history_mtime,
                                                  new_mtimes["history"]))
             # Only pull if something new available
-            if self.__mtimes["history"] != new_mtimes["history"]:
-                self.__pull_history(bulk_keys)
+            if history_mtime != new_mtimes["history"]:
+                if self.__pull_history(bulk_keys):
+                    El().history.set_sync_mtime("history-pull",
+                                                new_mtimes["history"])
+            # Push history not uploaded yet, may be from a previous session
+            self.__push_history_changes(bulk_keys)
 
             if self.__stop:
                 return
             ########################
             # Bookmarks Management #
             ########################
+            bookmarks_mtime = El().bookmarks.get_sync_mtime("bookmarks")
             debug("local bookmarks: %s, remote bookmarks: %s" % (
-                                                 self.__mtimes["bookmarks"],
+                                                 bookmarks_mtime,
                                                  new_mtimes["bookmarks"]))
             # Push new bookmarks
             self.__push_bookmarks(bulk_keys)
@@ -271,124 +347,236 @@ class SyncWorker(GObject.GObject):
                 return
 
             # Only pull if something new available
-            if self.__mtimes["bookmarks"] != new_mtimes["bookmarks"]:
-                self.__pull_bookmarks(bulk_keys, first_sync)
+            if bookmarks_mtime != new_mtimes["bookmarks"]:
+                self.__pull_bookmarks(bulk_keys, first_sync,
+                                      new_mtimes["bookmarks"])
             # Update last sync mtime
-            self.__mtimes = self.__client.client.info_collections()
-            dump(self.__mtimes,
-                 open(El().LOCAL_PATH + "/mozilla_sync.bin", "wb"))
+            new_mtimes = self.__client.client.info_collections()
+            El().history.set_sync_mtime("history", new_mtimes["history"])
+            El().bookmarks.set_sync_mtime("bookmarks",
+                                          new_mtimes["bookmarks"])
             debug("Stop syncing")
         except Exception as e:
             print("SyncWorker::__sync():", e)
+            # Token may have been revoked, get a new one next time
+            self.__bulk_keys = None
         self.__stop = True
         GLib.idle_add(self.emit, "sync-finish")
 
+    def __push_history_changes(self, bulk_keys):
+        """
+            Push history from change log
+            @param bulk keys as KeyBundle
+        """
+        debug("push history")
+        SqlCursor.add(El().history)
+        try:
+            (change_id, history_ids, guids) = El().history.get_changes()
+            self.__upload_history(bulk_keys, history_ids, guids, change_id)
+        except:
+            with SqlCursor(El().history) as sql:
+                sql.rollback()
+            raise
+        finally:
+            SqlCursor.remove(El().history)
+
     def __push_bookmarks(self, bulk_keys):
         """
-            Push to bookmarks
+            Push to bookmarks from change log
             @param bulk keys as KeyBundle
-            @param start time as float
             @raise StopIteration
         """
         debug("push bookmarks")
-        parents = []
-        for bookmark_id in El().bookmarks.get_ids_for_mtime(
-                                                   self.__mtimes["bookmarks"]):
-            parent_guid = El().bookmarks.get_parent_guid(bookmark_id)
-            # No parent, move it to unfiled
-            if parent_guid is None:
-                parent_guid = "unfiled"
-            parent_id = El().bookmarks.get_id_by_guid(parent_guid)
-            if parent_id not in parents:
-                parents.append(parent_id)
-            record = {}
-            record["bmkUri"] = El().bookmarks.get_uri(bookmark_id)
-            record["id"] = El().bookmarks.get_guid(bookmark_id)
-            record["title"] = El().bookmarks.get_title(bookmark_id)
-            record["tags"] = El().bookmarks.get_tags(bookmark_id)
-            record["parentid"] = parent_guid
-            record["type"] = "bookmark"
-            debug("pushing %s" % record)
-            self.__client.add_bookmark(record, bulk_keys)
-        # Del old bookmarks
-        for bookmark_id in El().bookmarks.get_deleted_ids():
-            parent_guid = El().bookmarks.get_parent_guid(bookmark_id)
-            parent_id = El().bookmarks.get_id_by_guid(parent_guid)
-            if parent_id not in parents:
-                parents.append(parent_id)
-            record = {}
-            record["id"] = El().bookmarks.get_guid(bookmark_id)
-            record["type"] = "item"
-            record["deleted"] = True
-            debug("deleting %s" % record)
-            self.__client.add_bookmark(record, bulk_keys)
-            El().bookmarks.remove(bookmark_id)
-        # Push parents in this order, parents near root are handle later
-        # Otherwise, order will be broken by new children updates
-        while parents:
-            parent_id = parents.pop(0)
-            parent_guid = El().bookmarks.get_guid(parent_id)
-            parent_name = El().bookmarks.get_title(parent_id)
-            children = El().bookmarks.get_children(parent_guid)
-            # So search if children in parents
-            found = False
-            for child_guid in children:
-                child_id = El().bookmarks.get_id_by_guid(child_guid)
-                if child_id in parents:
-                    found = True
-                    break
-            # Handle children first
-            if found:
-                parents.append(parent_id)
-                debug("later: %s" % parent_name)
-                continue
-            record = {}
-            record["id"] = parent_guid
-            record["type"] = "folder"
-            # A parent with parent as unfiled needs to be moved to places
-            # Firefox internal
-            grand_parent_guid = El().bookmarks.get_parent_guid(parent_id)
-            if grand_parent_guid == "unfiled":
-                grand_parent_guid = "places"
-            record["parentid"] = grand_parent_guid
-            record["parentName"] = El().bookmarks.get_parent_name(parent_id)
-            record["title"] = parent_name
-            record["children"] = children
-            debug("pushing parent %s" % record)
-            self.__client.add_bookmark(record, bulk_keys)
-        El().bookmarks.clean_tags()
-
-    def __pull_bookmarks(self, bulk_keys, first_sync):
-        """
-            Pull from bookmarks
+        SqlCursor.add(El().bookmarks)
+        try:
+            records = []
+            parents = set()
+            (change_id, bookmark_ids, guids) = El().bookmarks.get_changes()
+            # No parent, parent guid is unfiled
+            for (bookmark_id, guid, uri, title, parent_id, parent_guid,
+                 parent_name, tags) in El().bookmarks.get_records(
+                    bookmark_ids):
+                parents.add(parent_guid)
+                # Folder changed, push it with other parents
+                if uri == guid:
+                    parents.add(guid)
+                    continue
+                record = {}
+                record["bmkUri"] = uri
+                record["id"] = guid
+                record["title"] = title
+                record["tags"] = tags
+                record["parentid"] = parent_guid
+                record["type"] = "bookmark"
+                debug("pushing %s" % record)
+                records.append(record)
+            # Del old bookmarks, they may already be removed from db
+            deleted_ids = []
+            for guid in guids:
+                bookmark_id = El().bookmarks.get_id_by_guid(guid)
+                if bookmark_id is not None:
+                    deleted_ids.append((bookmark_id, guid))
+            for (bookmark_id, guid, uri, title, parent_id, parent_guid,
+                 parent_name, tags) in El().bookmarks.get_records(
+                    [bookmark_id for (bookmark_id, guid) in deleted_ids]):
+                parents.add(parent_guid)
+            for guid in guids:
+                record = {}
+                record["id"] = guid
+                record["type"] = "item"
+                record["deleted"] = True
+                debug("deleting %s" % record)
+                records.append(record)
+            (items, children) = El().bookmarks.get_tree()
+            for parent_guid in self.__get_folders_order(parents, items,
+                                                        children):
+                (parent_id, parent_name, grand_parent_guid,
+                 grand_parent_name) = items[parent_guid]
+                record = {}
+                record["id"] = parent_guid
+                record["type"] = "folder"
+                # A parent with parent as unfiled needs to be moved to places
+                # Firefox internal
+                if grand_parent_guid == "unfiled":
+                    grand_parent_guid = "places"
+                record["parentid"] = grand_parent_guid
+                record["parentName"] = grand_parent_name
+                record["title"] = parent_name
+                record["children"] = children.get(parent_guid, [])
+                debug("pushing parent %s" % record)
+                records.append(record)
+            # Parents are after children, batch keeps order
+            (modified, failed) = self.__client.add_bookmarks(records,
+                                                             bulk_keys)
+            # Uploaded, remove from change log with deleted bookmarks at once
+            # Failed records stay in change log, pushed again on next sync
+            for (bookmark_id, guid) in deleted_ids:
+                if guid not in failed:
+                    El().bookmarks.remove(bookmark_id, False)
+            El().bookmarks.clear_changes([record["id"] for record in records
+                                          if record["id"] not in failed],
+                                         change_id, False)
+            El().bookmarks.clean_tags()  # Will commit
+        except:
+            with SqlCursor(El().bookmarks) as sql:
+                sql.rollback()
+            raise
+        finally:
+            SqlCursor.remove(El().bookmarks)
+
+    def __get_folders_order(self, folders, items, children):
+        """
+            Sort folders to push, children before parents
+            Otherwise, order will be broken by new children updates
+            A folder in a cycle is moved to unfiled
+            @param folders as set(str)
+            @param items as {guid: (int, str, str, str)}, see get_tree()
+            @param children as {str: [str]}, see get_tree()
+            @return [str]
+        """
+        # Depth from root, walked once for each folder
+        depths = {}
+        folders = [guid for guid in folders if guid in items.keys()]
+        for guid in folders:
+            path = []
+            current = guid
+            while current in items.keys() and current not in depths.keys()\
+                    and current not in ["places", "unfiled"]:
+                if current in path:
+                    debug("moving to unfiled, cycle: %s" % path)
+                    (bookmark_id, title, parent_guid,
+                     parent_name) = items[current]
+                    El().bookmarks.set_parent(bookmark_id, "unfiled", "",
+                                              False)
+                    items[current] = (bookmark_id, title, "unfiled", "")
+                    children[parent_guid].remove(current)
+                    children.setdefault("unfiled", []).append(current)
+                    # Walk again, cycle is broken
+                    (path, current) = ([], guid)
+                    continue
+                path.append(current)
+                current = items[current][2]
+            depth = depths.get(current, 0)
+            for node in reversed(path):
+                depth += 1
+                depths[node] = depth
+        return sorted(folders, key=lambda guid: depths.get(guid, 0),
+                      reverse=True)
+
+    def __pull_bookmarks(self, bulk_keys, first_sync, mtime):
+        """
+            Pull from bookmarks, applied in one commit
+            All pages are downloaded before writing, db is not locked
+            while waiting for network
             @param bulk_keys as KeyBundle
             @param first_sync as bool
+            @param mtime as float: remote bookmarks time
             @raise StopIteration
         """
         debug("pull bookmarks")
+        # Only get records changed since last pull
+        newer = None if first_sync else\
+            El().bookmarks.get_sync_mtime("bookmarks-pull")
+        records = list(itertools.chain.from_iterable(
+                                self.__client.get_bookmarks(bulk_keys, newer)))
+        if self.__stop:
+            return
         SqlCursor.add(El().bookmarks)
-        records = self.__client.get_bookmarks(bulk_keys)
-        # We get all guids here and remove them while sync
-        # At the end, we have deleted records
-        # On fist sync, keep all
-        if first_sync:
-            to_delete = []
-        else:
-            to_delete = El().bookmarks.get_guids()
+        try:
+            self.__apply_bookmarks(records, first_sync, newer, mtime)
+        except:
+            with SqlCursor(El().bookmarks) as sql:
+                sql.rollback()
+            raise
+        finally:
+            SqlCursor.remove(El().bookmarks)
+
+    def __apply_bookmarks(self, records, first_sync, newer, mtime):
+        """
+            Apply pulled bookmarks and commit
+            Records are reconciled with bookmarks loaded in memory
+            @param records as [{}]
+            @param first_sync as bool
+            @param newer as float/None: last pull time
+            @param mtime as float: remote bookmarks time
+        """
+        # Local changes not uploaded yet win
+        pending = El().bookmarks.get_pending_guids()
+        items = El().bookmarks.get_sync_items()
+        bookmarks_tags = El().bookmarks.get_all_bookmarks_tags()
+        tag_ids = dict((title, tag_id) for (tag_id, title) in
+                       El().bookmarks.get_all_tags())
+        # Reuse history guids for new bookmarks, like add(), in one query
+        history_guids = El().history.get_guids_for_uris(
+                                [record["payload"]["bmkUri"]
+                                 for record in records
+                                 if "bmkUri" in record["payload"] and
+                                 record["payload"]["id"] not in items])
+        seen = set()
+        applied = set()
+        deleted = set()
+        (links, unlinks, mtimes) = ([], [], [])
         for record in records:
             bookmark = record["payload"]
+            guid = bookmark["id"]
+            seen.add(guid)
+            if guid in pending:
+                continue
+            applied.add(guid)
+            item = items.get(guid)
+            # Deleted on remote, only sent by incremental pulls
+            if bookmark.get("deleted", False):
+                if item is not None:
+                    deleted.add(guid)
+                continue
             if "type" not in bookmark.keys() or\
                     bookmark["type"] not in ["folder", "bookmark"]:
                 continue
-            bookmark_id = El().bookmarks.get_id_by_guid(bookmark["id"])
-            # This bookmark exists, remove from to delete
-            if bookmark["id"] in to_delete:
-                to_delete.remove(bookmark["id"])
             # Nothing to apply, continue
-            if El().bookmarks.get_mtime(bookmark_id) >= record["modified"]:
+            if item is not None and item[1] >= record["modified"]:
                 continue
             debug("pulling %s" % record)
-            if bookmark_id is None:
+            if item is None:
                 if "bmkUri" in bookmark.keys():
                     # Use parent name if no bookmarks tags
                     if "tags" not in bookmark.keys() or\
@@ -400,17 +588,28 @@ class SyncWorker(GObject.GObject):
                             bookmark["tags"] = []
                     bookmark_id = El().bookmarks.add(bookmark["title"],
                                                      bookmark["bmkUri"],
-                                                     bookmark["id"],
+                                                     guid,
                                                      bookmark["tags"],
-                                                     False)
+                                                     0,
+                                                     False,
+                                                     history_guids)
+                    # add() may have created tags
+                    tags = set([tag for tag in bookmark["tags"] if tag])
+                    for tag in tags - set(tag_ids.keys()):
+                        tag_ids[tag] = El().bookmarks.get_tag_id(tag)
+                    bookmarks_tags[bookmark_id] = dict(
+                                    (tag, tag_ids[tag]) for tag in tags)
                 else:
-                    bookmark["tags"] = []
                     bookmark_id = El().bookmarks.add(bookmark["title"],
-                                                     bookmark["id"],
-                                                     bookmark["id"],
-                                                     bookmark["tags"],
-                                                     False)
+                                                     guid,
+                                                     guid,
+                                                     [],
+                                                     0,
+                                                     False,
+                                                     {})
+                item = (bookmark_id, 0, None, None)
             else:
+                bookmark_id = item[0]
                 El().bookmarks.set_title(bookmark_id,
                                          bookmark["title"],
                                          False)
@@ -419,59 +618,95 @@ class SyncWorker(GObject.GObject):
                                            bookmark["bmkUri"],
                                            False)
                 elif "children" in bookmark.keys():
-                    position = 0
-                    for child in bookmark["children"]:
-                        bid = El().bookmarks.get_id_by_guid(child)
-                        El().bookmarks.set_position(bid,
-                                                    position,
-                                                    False)
-                        position += 1
-                # Remove previous tags
-                current_tags = El().bookmarks.get_tags(bookmark_id)
-                for tag in El().bookmarks.get_tags(bookmark_id):
-                    if "tags" in bookmark.keys() and\
-                            tag not in bookmark["tags"]:
-                        tag_id = El().bookmarks.get_tag_id(tag)
-                        current_tags.remove(tag)
-                        El().bookmarks.del_tag_from(tag_id,
-                                                    bookmark_id,
-                                                    False)
+                    El().bookmarks.set_children_order(bookmark["children"],
+                                                      False)
+                    applied |= set(bookmark["children"])
                 if "tags" in bookmark.keys():
-                    for tag in bookmark["tags"]:
-                        # Tag already associated
-                        if tag in current_tags:
-                            continue
-                        tag_id = El().bookmarks.get_tag_id(tag)
-                        if tag_id is None:
-                            tag_id = El().bookmarks.add_tag(tag, False)
-                        El().bookmarks.add_tag_to(tag_id, bookmark_id, False)
-            El().bookmarks.set_mtime(bookmark_id,
-                                     record["modified"],
-                                     False)
-            if "parentName" in bookmark.keys():
+                    current = bookmarks_tags.get(bookmark_id, {})
+                    tags = set([tag for tag in bookmark["tags"] if tag])
+                    for tag in set(current.keys()) - tags:
+                        unlinks.append((current[tag], bookmark_id))
+                    for tag in tags - set(current.keys()):
+                        if tag not in tag_ids.keys():
+                            tag_ids[tag] = El().bookmarks.add_tag(tag, False)
+                        links.append((tag_ids[tag], bookmark_id))
+                    bookmarks_tags[bookmark_id] = dict(
+                                    (tag, tag_ids[tag]) for tag in tags)
+            mtimes.append((record["modified"], bookmark_id))
+            parent = item[2:]
+            if "parentName" in bookmark.keys() and\
+                    parent != (bookmark["parentid"], bookmark["parentName"]):
                 El().bookmarks.set_parent(bookmark_id,
                                           bookmark["parentid"],
                                           bookmark["parentName"],
                                           False)
-        for guid in to_delete:
+                parent = (bookmark["parentid"], bookmark["parentName"])
+            # Same record may be sent twice
+            items[guid] = (bookmark_id, record["modified"]) + parent
+        # On a full pull, bookmarks not sent were deleted on remote
+        # On fist sync, keep all
+        if not first_sync and newer is None:
+            deleted |= set(items.keys()) - seen
+        deleted -= pending
+        for guid in deleted:
             debug("deleting: %s" % guid)
-            bookmark_id = El().bookmarks.get_id_by_guid(guid)
-            if bookmark_id is not None:
-                El().bookmarks.remove(bookmark_id, False)
+        El().bookmarks.set_tags_links(links, unlinks, False)
+        El().bookmarks.set_mtimes(mtimes, False)
+        El().bookmarks.remove_all([items[guid][0] for guid in deleted],
+                                  False)
+        # Applied records are not local changes, commit with sync state
+        El().bookmarks.clear_changes(applied - pending, None, False)
+        El().bookmarks.set_sync_mtime("bookmarks-pull", mtime, False)
         El().bookmarks.clean_tags()  # Will commit
-        SqlCursor.remove(El().bookmarks)
 
     def __pull_history(self, bulk_keys):
         """
             Pull from history
             @param bulk_keys as KeyBundle
+            @return True if all records were pulled
             @raise StopIteration
         """
         debug("pull history")
         SqlCursor.add(El().history)
-        records = self.__client.get_history(bulk_keys)
+        try:
+            # Local changes not uploaded yet win
+            pending = El().history.get_pending_guids()
+            # Only get records changed since last pull, page by page
+            newer = El().history.get_sync_mtime("history-pull")
+            for records in self.__client.get_history(bulk_keys, newer):
+                applied = self.__pull_history_records(records, pending)
+                El().history.clear_changes(applied, None, False)
+                # Records are sorted by time, resume from this page if stopped
+                # Same time may continue on next page
+                if records:
+                    El().history.set_sync_mtime("history-pull",
+                                                records[-1]["modified"] - 0.01,
+                                                False)
+                with SqlCursor(El().history) as sql:
+                    sql.commit()
+                if self.__stop:
+                    break
+        except:
+            with SqlCursor(El().history) as sql:
+                sql.rollback()
+            raise
+        finally:
+            SqlCursor.remove(El().history)
+        return not self.__stop
+
+    def __pull_history_records(self, records, pending):
+        """
+            Apply pulled history records, without committing
+            @param records as [{}]
+            @param pending as set(str): guids to ignore
+            @return applied guids as [str]
+        """
+        applied = []
+        visits = []
         for record in records:
             history = record["payload"]
+            if history["id"] in pending:
+                continue
             keys = history.keys()
             # Ignore pages without a title
             if "title" not in keys or not history["title"]:
@@ -498,9 +733,25 @@ class SyncWorker(GObject.GObject):
                                           history["id"],
                                           atimes,
                                           False)
-        with SqlCursor(El().history) as sql:
-            sql.commit()
-        SqlCursor.remove(El().history)
+            applied.append(history["id"])
+            # Without visits, modification time is used as visit
+            visits.append((history_id, max(atimes or [record["modified"]])))
+        # Remote visits do not need to be uploaded
+        El().history.set_visits_synced(visits, False)
+        return applied
+
+    def __on_history_timeout(self):
+        """
+            Flush history queue
+        """
+        self.__history_timeout_id = None
+        self.__flush_history()
+
+    def __on_history_pushed(self):
+        """
+            Allow next history upload
+        """
+        self.__pushing = False
 
     def __on_get_secret(self, source, result, first_sync, delete):
         """
@@ -571,8 +822,13 @@ class SyncWorker(GObject.GObject):
                                          first_sync)
             else:
                 # Sync not configured, just remove pending deleted bookmarks
-                for bookmark_id in El().get_deleted_ids():
-                    El().bookmarks.remove(bookmark_id)
+                (change_id, bookmark_ids, guids) =\
+                    El().bookmarks.get_changes()
+                for guid in guids:
+                    bookmark_id = El().bookmarks.get_id_by_guid(guid)
+                    if bookmark_id is not None:
+                        El().bookmarks.remove(bookmark_id, False)
+                El().bookmarks.clear_changes(guids, change_id)
         except Exception as e:
             print("SyncWorker::__on_secret_search()", e)
 
@@ -581,11 +837,21 @@ class MozillaSync(object):
     """
         Sync client
     """
-    def __init__(self):
+    # Records fetched per request when pulling
+    __PAGE_SIZE = 1000
+
+    def __init__(self, fxa_server_url=FXA_SERVER_URL,
+                 tokenserver_url=TOKENSERVER_URL):
         """
             Init client
+            @param fxa_server_url as str
+            @param tokenserver_url as str
         """
-        self.__client = FxAClient()
+        self.__tokenserver_url = tokenserver_url
+        self.__client = FxAClient(server_url=fxa_server_url)
+        self.__limits = None
+        self.__expires = 0
+        self.__http = get_http_session()
 
     def login(self, login, password):
         """
@@ -607,16 +873,20 @@ class MozillaSync(object):
         state = None
         if key is not None:
             state = hexlify(sha256(key).digest()[0:16])
-        self.__client = SyncClient(bid_assertion, state)
+        self.__client = SyncClient(bid_assertion, state,
+                                   tokenserver_url=self.__tokenserver_url,
+                                   session=self.__http)
+        self.__limits = None
+        # Renew a minute before token expiration
+        self.__expires = time() + self.__client.duration - 60
         sync_keys = KeyBundle.fromMasterKey(
                                         key,
                                         "identity.mozilla.com/picl/v1/oldsync")
 
         # Fetch the sync bundle keys out of storage.
         # They're encrypted with the account-level key.
-        keys = self.__decrypt_payload(self.__client.get_record("crypto",
-                                                               "keys"),
-                                      sync_keys)
+        keys = decrypt_payload(self.__client.get_record("crypto", "keys"),
+                               sync_keys)
 
         # There's some provision for using separate
         # key bundles for separate collections
@@ -632,54 +902,57 @@ class MozillaSync(object):
                               base64.b64decode(keys["default"][1]))
         return bulk_keys
 
-    def get_bookmarks(self, bulk_keys):
+    def get_bookmarks(self, bulk_keys, newer=None):
         """
-            Return bookmarks payload
+            Return bookmarks payload, page by page
             @param bulk keys as KeyBundle
-            @return [{}]
+            @param newer as float: only records modified after
+            @return yield [{}]
         """
-        bookmarks = []
-        for record in self.__client.get_records('bookmarks'):
-            record["payload"] = self.__decrypt_payload(record, bulk_keys)
-            bookmarks.append(record)
-        return bookmarks
+        pages = self.__client.get_records_pages('bookmarks', newer,
+                                                self.__PAGE_SIZE)
+        for records in decrypt_pages(pages, bulk_keys):
+            yield records
 
-    def get_history(self, bulk_keys):
+    def get_history(self, bulk_keys, newer=None):
         """
-            Return history payload
+            Return history payload, page by page
             @param bulk keys as KeyBundle
-            @return [{}]
-        """
-        history = []
-        for record in self.__client.get_records('history'):
-            record["payload"] = self.__decrypt_payload(record, bulk_keys)
-            history.append(record)
-        return history
-
-    def add_bookmark(self, bookmark, bulk_keys):
-        payload = self.__encrypt_payload(bookmark, bulk_keys)
-        record = {}
-        record["modified"] = round(time(), 2)
-        record["payload"] = payload
-        record["id"] = bookmark["id"]
-        self.__client.put_record("bookmarks", record)
+            @param newer as float: only records modified after
+            @return yield [{}]
+        """
+        pages = self.__client.get_records_pages('history', newer,
+                                                self.__PAGE_SIZE)
+        for records in decrypt_pages(pages, bulk_keys):
+            yield records
+
+    def add_bookmarks(self, bookmarks, bulk_keys):
+        """
+            Upload bookmarks
+            @param bookmarks as [{}]
+            @param bulk keys as KeyBundle
+            @return (collection modified time as float/None,
+                     failed ids as set(str))
+        """
+        return self.__add_records("bookmarks", bookmarks, bulk_keys)
 
     def add_history(self, history, bulk_keys):
-        payload = self.__encrypt_payload(history, bulk_keys)
-        record = {}
-        record["modified"] = round(time(), 2)
-        record["payload"] = payload
-        record["id"] = history["id"]
-        self.__client.put_record("history", record)
+        """
+            Upload history
+            @param history as [{}]
+            @param bulk keys as KeyBundle
+            @return (collection modified time as float/None,
+                     failed ids as set(str))
+        """
+        return self.__add_records("history", history, bulk_keys)
 
-    def get_browserid_assertion(self, session,
-                                tokenserver_url=TOKENSERVER_URL):
+    def get_browserid_assertion(self, session):
         """
             Get browser id assertion and state
             @param session as fxaSession
             @return (bid_assertion, state) as (str, str)
         """
-        bid_assertion = session.get_identity_assertion(tokenserver_url)
+        bid_assertion = session.get_identity_assertion(self.__tokenserver_url)
         return bid_assertion, session.keys[1]
 
     @property
@@ -689,106 +962,89 @@ class MozillaSync(object):
         """
         return self.__client
 
-#######################
-# PRIVATE             #
-#######################
-    def __encrypt_payload(self, record, key_bundle):
-        """
-            Encrypt payload
-            @param record as {}
-            @param key bundle as KeyBundle
-            @return encrypted record payload
-        """
-        plaintext = json.dumps(record).encode("utf-8")
-        # Input strings must be a multiple of 16 in length
-        length = 16 - (len(plaintext) % 16)
-        plaintext += bytes([length]) * length
-        iv = Random.new().read(16)
-        aes = AES.new(key_bundle.encryption_key, AES.MODE_CBC, iv)
-        ciphertext = base64.b64encode(aes.encrypt(plaintext))
-        _hmac = hmac.new(key_bundle.hmac_key,
-                         ciphertext,
-                         sha256).hexdigest()
-        payload = {"ciphertext": ciphertext.decode("utf-8"),
-                   "IV": base64.b64encode(iv).decode("utf-8"), "hmac": _hmac}
-        return json.dumps(payload)
-
-    def __decrypt_payload(self, record, key_bundle):
-        """
-            Descrypt payload
-            @param record as str (json)
-            @param key bundle as KeyBundle
-            @return uncrypted record payload
-        """
-        j = json.loads(record["payload"])
-        # Always check the hmac before decrypting anything.
-        expected_hmac = hmac.new(key_bundle.hmac_key,
-                                 j['ciphertext'].encode("utf-8"),
-                                 sha256).hexdigest()
-        if j['hmac'] != expected_hmac:
-            raise ValueError("HMAC mismatch: %s != %s" % (j['hmac'],
-                                                          expected_hmac))
-        ciphertext = base64.b64decode(j['ciphertext'])
-        iv = base64.b64decode(j['IV'])
-        aes = AES.new(key_bundle.encryption_key, AES.MODE_CBC, iv)
-        plaintext = aes.decrypt(ciphertext).strip().decode("utf-8")
-        # Remove any CBC block padding,
-        # assuming it's a well-formed JSON payload.
-        plaintext = plaintext[:plaintext.rfind("}") + 1]
-        return json.loads(plaintext)
-
-
-class KeyBundle:
-    """
-        RFC-5869
-    """
-    def __init__(self, encryption_key, hmac_key):
-        self.encryption_key = encryption_key
-        self.hmac_key = hmac_key
-
-    @classmethod
-    def fromMasterKey(cls, master_key, info):
-        key_material = KeyBundle.HKDF(master_key, None, info, 2 * 32)
-        return cls(key_material[:32], key_material[32:])
-
-    def HKDF_extract(salt, IKM, hashmod=sha256):
-        """
-            Extract a pseudorandom key suitable for use with HKDF_expand
-            @param salt as str
-            @param IKM as str
-        """
-        if salt is None:
-            salt = b"\x00" * hashmod().digest_size
-        return hmac.new(salt, IKM, hashmod).digest()
-
-    def HKDF_expand(PRK, info, length, hashmod=sha256):
+    @property
+    def expired(self):
         """
-            Expand pseudo random key and info
-            @param PRK as str
-            @param info as str
-            @param length as int
+            True if sync token needs to be renewed
+            @return bool
         """
-        digest_size = hashmod().digest_size
-        N = int(math.ceil(length * 1.0 / digest_size))
-        assert N <= 255
-        T = b""
-        output = []
-        for i in range(1, N + 1):
-            data = T + (info + chr(i)).encode()
-            T = hmac.new(PRK, data, hashmod).digest()
-            output.append(T)
-        return b"".join(output)[:length]
+        return time() > self.__expires
 
-    def HKDF(secret, salt, info, length, hashmod=sha256):
+#######################
+# PRIVATE             #
+#######################
+    def __get_limits(self):
         """
-            HKDF-extract-and-expand as a single function.
-            @param secret as str
-            @param salt as str
-            @param info as str
-            @param length as int
+            Get server upload limits
+            @return {}
         """
-        PRK = KeyBundle.HKDF_extract(salt, secret, hashmod)
-        return KeyBundle.HKDF_expand(PRK, info, length, hashmod)
+        if self.__limits is None:
+            # Defaults from Sync 1.5 server
+            self.__limits = {"max_post_records": 100,
+                             "max_post_bytes": 2097152,
+                             "max_total_records": 10000,
+                             "max_total_bytes": 104857600}
+            try:
+                self.__limits.update(self.__client.info_configuration())
+            except Exception as e:
+                # Older servers do not have this endpoint
+                print("MozillaSync::__get_limits():", e)
+        return self.__limits
+
+    def __add_records(self, collection, records, bulk_keys):
+        """
+            Encrypt and upload records with POST requests
+            Records are uploaded by batches committed at once, in order
+            @param collection as str
+            @param records as [{}]
+            @param bulk keys as KeyBundle
+            @return (collection modified time as float/None,
+                     failed ids as set(str))
+        """
+        failed = set()
+        if not records:
+            return (None, failed)
+        limits = self.__get_limits()
+        # Split records in batches of posts
+        batches = []
+        posts = []
+        post = []
+        post_size = 0
+        batch_records = 0
+        batch_size = 0
+        for record in records:
+            bso = {"id": record["id"],
+                   "payload": encrypt_payload(record, bulk_keys)}
+            size = len(json.dumps(bso))
+            if batch_records >= limits["max_total_records"] or\
+                    batch_size + size > limits["max_total_bytes"]:
+                posts.append(post)
+                batches.append(posts)
+                (posts, post, post_size, batch_records, batch_size) =\
+                    ([], [], 0, 0, 0)
+            elif post and (len(post) >= limits["max_post_records"] or
+                           post_size + size > limits["max_post_bytes"]):
+                posts.append(post)
+                (post, post_size) = ([], 0)
+            post.append(bso)
+            post_size += size
+            batch_records += 1
+            batch_size += size
+        posts.append(post)
+        batches.append(posts)
+        modified = None
+        for posts in batches:
+            batch = "true"
+            for (i, post) in enumerate(posts):
+                result = self.__client.post_records(collection, post, batch,
+                                                    i == len(posts) - 1)
+                if result.get("failed"):
+                    print("MozillaSync::__add_records():", result["failed"])
+                    failed |= set(result["failed"].keys())
+                # Servers without batch support apply each post
+                batch = result.get("batch", batch)
+                modified = result.get("modified", modified)
+        return (modified, failed)
 
 
 class TokenserverClient(object):
@@ -796,16 +1052,20 @@ class TokenserverClient(object):
         Client for the Firefox Sync Token Server.
     """
     def __init__(self, bid_assertion, client_state,
-                 server_url=TOKENSERVER_URL):
+                 server_url=TOKENSERVER_URL, session=None):
         """
             Init client
             @param bid assertion as str
             @param client_state as ???
             @param server_url as str
+            @param session as requests.Session
         """
         self.__bid_assertion = bid_assertion
         self.__client_state = client_state
         self.__server_url = server_url
+        if session is None:
+            session = get_http_session()
+        self.__session = session
 
     def get_hawk_credentials(self, duration=None):
         """
@@ -823,8 +1083,8 @@ class TokenserverClient(object):
             params['duration'] = int(duration)
 
         url = self.__server_url.rstrip('/') + '/1.0/sync/1.5'
-        raw_resp = requests.get(url, headers=headers, params=params,
-                                verify=True)
+        raw_resp = self.__session.get(url, headers=headers, params=params,
+                                      verify=True)
         raw_resp.raise_for_status()
         return raw_resp.json()
 
@@ -834,23 +1094,38 @@ class SyncClient(object):
         Client for the Firefox Sync server.
     """
     def __init__(self, bid_assertion=None, client_state=None,
-                 credentials={}, tokenserver_url=TOKENSERVER_URL):
+                 credentials={}, tokenserver_url=TOKENSERVER_URL,
+                 session=None):
         """
             Init client
             @param bid assertion as str
             @param client_state as ???
             @param credentials as {}
             @param server_url as str
+            @param session as requests.Session
         """
+        if session is None:
+            session = get_http_session()
+        self.__session = session
         if bid_assertion is not None and client_state is not None:
             ts_client = TokenserverClient(bid_assertion, client_state,
-                                          tokenserver_url)
+                                          tokenserver_url, session)
             credentials = ts_client.get_hawk_credentials()
+        # Token lifetime in seconds
+        self.__duration = credentials.get('duration', 300)
         self.__user_id = credentials['uid']
         self.__api_endpoint = credentials['api_endpoint']
-        self.__auth = HawkAuth(algorithm=credentials['hashalg'],
-                               id=credentials['id'],
-                               key=credentials['key'])
+        try:
+            # Newer requests_hawk refuses to sign requests without body,
+            # like GET, unless content hash is optional
+            self.__auth = HawkAuth(algorithm=credentials['hashalg'],
+                                   id=credentials['id'],
+                                   key=credentials['key'],
+                                   always_hash_content=False)
+        except TypeError:
+            self.__auth = HawkAuth(algorithm=credentials['hashalg'],
+                                   id=credentials['id'],
+                                   key=credentials['key'])
 
     def _request(self, method, url, **kwargs):
         """
@@ -860,8 +1135,19 @@ class SyncClient(object):
             @param url as str
             @param kwargs as requests.request named args
         """
+        return self._raw_request(method, url, **kwargs).json()
+
+    def _raw_request(self, method, url, **kwargs):
+        """
+            Same as _request() but returns the response
+            @param method as str
+            @param url as str
+            @param kwargs as requests.request named args
+            @return requests.Response
+        """
         url = self.__api_endpoint.rstrip('/') + '/' + url.lstrip('/')
-        raw_resp = requests.request(method, url, auth=self.__auth, **kwargs)
+        raw_resp = self.__session.request(method, url, auth=self.__auth,
+                                          **kwargs)
         raw_resp.raise_for_status()
 
         if raw_resp.status_code == 304:
@@ -871,7 +1157,15 @@ class SyncClient(object):
                 raw_resp.url)
             raise requests.exceptions.HTTPError(http_error_msg,
                                                 response=raw_resp)
-        return raw_resp.json()
+        return raw_resp
+
+    @property
+    def duration(self):
+        """
+            Token lifetime in seconds
+            @return int
+        """
+        return self.__duration
 
     def info_collections(self, **kwargs):
         """
@@ -884,6 +1178,13 @@ class SyncClient(object):
         """
         return self._request('get', '/info/collections', **kwargs)
 
+    def info_configuration(self, **kwargs):
+        """
+            Returns an object with server limits, like max_post_records or
+            max_total_bytes for batch uploads.
+        """
+        return self._request('get', '/info/configuration', **kwargs)
+
     def info_quota(self, **kwargs):
         """
             Returns a two-item list giving the user's current usage and quota
@@ -973,6 +1274,30 @@ class SyncClient(object):
         return self._request('get', '/storage/%s' % collection.lower(),
                              params=params, **kwargs)
 
+    def get_records_pages(self, collection, newer=None, limit=1000,
+                          **kwargs):
+        """
+            Get full BSOs contained in a collection, by pages of limit
+            records, following X-Weave-Next-Offset header
+            Pages are oldest first, so an interrupted pull can be resumed
+            @param collection as str
+            @param newer as float: only objects modified after
+            @param limit as int
+            @return yield [{}]
+        """
+        params = {"full": True, "limit": limit, "sort": "oldest"}
+        if newer is not None:
+            params["newer"] = newer
+        while True:
+            raw_resp = self._raw_request('get',
+                                         '/storage/%s' % collection.lower(),
+                                         params=params, **kwargs)
+            yield raw_resp.json()
+            offset = raw_resp.headers.get("X-Weave-Next-Offset")
+            if offset is None:
+                break
+            params["offset"] = offset
+
     def get_record(self, collection, record_id, **kwargs):
         """Returns the BSO in the collection corresponding to the requested id.
         """
@@ -988,6 +1313,31 @@ class SyncClient(object):
         except Exception as e:
             print("SyncClient::delete_record()", e)
 
+    def post_records(self, collection, records, batch=None, commit=False,
+                     **kwargs):
+        """
+            Creates or updates BSOs within a collection.
+            Returns an object with modified time, success ids and failed
+            ids with reasons.
+
+            :param batch:
+                "true" to start a batch, then the batch id returned by the
+                server. Records are only applied when batch is committed.
+
+            :param commit:
+                commit the batch with this request.
+        """
+        params = kwargs.pop('params', {})
+        if batch is not None:
+            params['batch'] = batch
+        if commit:
+            params['commit'] = 'true'
+        headers = kwargs.pop('headers', {})
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        return self._request('post', '/storage/%s' % collection.lower(),
+                             params=params, data=json.dumps(records),
+                             headers=headers, **kwargs)
+
     def put_record(self, collection, record, **kwargs):
         """
             Creates or updates a specific BSO within a collection.
@@ -37,6 +37,8 @@ class Item(GObject.GObject):
                                 default=0)
     search = GObject.Property(type=str,
                               default="")
+    snippet = GObject.Property(type=str,
+                               default="")
 
     def __init__(self):
         GObject.GObject.__init__(self)
@@ -99,6 +101,10 @@ class Row(Gtk.ListBoxRow):
         self.__title.connect('query-tooltip', self.__on_query_tooltip)
         self.__title.show()
         uri = Gtk.Label.new(item.get_property("uri"))
+        self.__uri = uri
+        snippet = item.get_property("snippet")
+        if snippet:
+            uri.set_markup(snippet)
         uri.set_ellipsize(Pango.EllipsizeMode.END)
         uri.set_property("halign", Gtk.Align.END)
         uri.get_style_context().add_class("dim-label")
@@ -168,6 +174,13 @@ class Row(Gtk.ListBoxRow):
         self.__item.set_property("title", title)
         self.__title.set_text(title)
 
+    def set_count(self, count):
+        """
+            Set row bookmarks count
+            @param count as int
+        """
+        self.__uri.set_text(str(count) if count else "")
+
     @property
     def item(self):
         """
@@ -327,8 +340,6 @@ class Row(Gtk.ListBoxRow):
                 self.__window.container.add_web_view(uri, True)
                 if event.button == 2:
                     self.__window.toolbar.title.hide_popover()
-            El().bookmarks.set_access_time(uri, round(time(), 2))
-            El().bookmarks.set_more_popular(uri)
         else:
             self.emit("activate")
 
@@ -346,8 +357,9 @@ class Row(Gtk.ListBoxRow):
         """
         history_id = self.__item.get_property("id")
         guid = El().history.get_guid(history_id)
+        El().completion.remove(self.__item.get_property("uri"))
         if El().sync_worker is not None:
-            El().sync_worker.remove_from_history(guid)
+            El().sync_worker.remove_from_history([guid])
         El().history.remove(history_id)
         GLib.idle_add(self.destroy)
 
@@ -363,6 +375,7 @@ class UriPopover(Gtk.Popover):
     """
         Show user bookmarks or search
     """
+    __HISTORY_PAGE_SIZE = 50
 
     def __init__(self, window):
         """
@@ -372,6 +385,12 @@ class UriPopover(Gtk.Popover):
         Gtk.Popover.__init__(self)
         self.__window = window
         self.__input = False
+        self.__history_atime = 0
+        self.__history_offset = None
+        self.__model_signal_ids = []
+        # Tags of bookmarks in bookmarks model
+        self.__shown_tag_ids = None
+        self.__shown_bookmarks = None
         self.set_modal(False)
         builder = Gtk.Builder()
         builder.add_from_resource("/org/gnome/Eolie/PopoverUri.ui")
@@ -382,7 +401,12 @@ class UriPopover(Gtk.Popover):
         self.__infobar_confirm.show()
         self.__infobar_select = Gtk.ComboBoxText()
         self.__infobar_select.show()
+        self.__infobar_progress = Gtk.ProgressBar()
+        self.__infobar_progress.set_hexpand(True)
+        self.__infobar_progress.set_valign(Gtk.Align.CENTER)
         self.__infobar.get_content_area().add(self.__infobar_select)
+        self.__infobar.get_content_area().add(self.__infobar_progress)
+        self.__clear_cancellable = Gio.Cancellable.new()
         self.__infobar.add_action_widget(self.__infobar_confirm, 1)
         self.__infobar.add_button(_("Cancel"), 2)
         self.__history_model = Gio.ListStore()
@@ -564,6 +588,52 @@ class UriPopover(Gtk.Popover):
         dialog = ImportBookmarksDialog(self.__window)
         dialog.run()
 
+    def _on_export_button_clicked(self, button):
+        """
+            Export bookmarks to a file
+            @param button as Gtk.Button
+        """
+        dialog = Gtk.FileChooserDialog(
+                                   _("Export bookmarks"), self.__window,
+                                   Gtk.FileChooserAction.SAVE,
+                                   (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                                    Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name("bookmarks.html")
+        for (name, pattern) in [(_("HTML bookmarks"), "*.html"),
+                                (_("JSON bookmarks"), "*.json"),
+                                (_("Firefox bookmarks backup"), "*.json")]:
+            file_filter = Gtk.FileFilter()
+            file_filter.set_name(name)
+            file_filter.add_pattern(pattern)
+            dialog.add_filter(file_filter)
+        check = Gtk.CheckButton.new_with_label(_("Include history"))
+        check.show()
+        dialog.set_extra_widget(check)
+        if dialog.run() == Gtk.ResponseType.OK:
+            from eolie.exporter import Exporter
+            places = dialog.get_filter() == file_filter
+            exporter = Exporter(check.get_active(), places)
+            cancellable = Gio.Cancellable.new()
+            message = Gtk.MessageDialog(self.__window,
+                                        Gtk.DialogFlags.DESTROY_WITH_PARENT,
+                                        Gtk.MessageType.INFO,
+                                        Gtk.ButtonsType.CANCEL,
+                                        _("Exporting bookmarks…"))
+            progress = Gtk.ProgressBar()
+            progress.show()
+            message.get_message_area().add(progress)
+            message.connect("response", self.__on_export_response,
+                            cancellable)
+            message.show()
+            thread = Thread(target=self.__export,
+                            args=(exporter, dialog.get_filename(),
+                                  cancellable, message, progress))
+            thread.daemon = True
+            thread.start()
+        dialog.destroy()
+        self.__window.toolbar.title.hide_popover()
+
     def _on_remove_button_clicked(self, button):
         """
             Save bookmarks to tag
@@ -572,7 +642,6 @@ class UriPopover(Gtk.Popover):
         for row in self.__bookmarks_box.get_selected_rows():
             item_id = row.item.get_property("id")
             El().bookmarks.delete(item_id)
-            self.__bookmarks_box.remove(row)
             self.__remove_button.hide()
         El().bookmarks.clean_tags()
         if El().sync_worker is not None:
@@ -601,6 +670,13 @@ class UriPopover(Gtk.Popover):
         """
         self.__remove_button.show()
 
+    def _on_selected_tags_changed(self, listbox):
+        """
+            Show bookmarks having all selected tags
+            @param listbox as Gtk.ListBox
+        """
+        self.__set_bookmarks_for_tags(self.__get_selected_tag_ids())
+
     def _on_row_selected(self, listbox, row):
         """
             Scroll to row
@@ -650,10 +726,7 @@ class UriPopover(Gtk.Popover):
             Init bookmarks
             @param widget as Gtk.Widget/None
         """
-        current = None
-        row = self.__tags_box.get_selected_row()
-        if row is not None:
-            current = row.item.get_property("id")
+        selected = self.__get_selected_tag_ids()
         self.__input == Input.TAGS
         for child in self.__tags_box.get_children():
             self.__tags_box.remove(child)
@@ -663,7 +736,8 @@ class UriPopover(Gtk.Popover):
                    _("Recents")),
                   (Type.NONE,
                    _("Unclassified"))]
-        self.__add_tags(static + El().bookmarks.get_all_tags(), current)
+        self.__add_tags(static + El().bookmarks.get_all_tags(), selected,
+                        El().bookmarks.get_tags_count())
 
     def _on_day_selected(self, calendar):
         """
@@ -672,12 +746,23 @@ class UriPopover(Gtk.Popover):
         """
         (year, month, day) = calendar.get_date()
         date = "%02d/%02d/%s" % (day, month + 1, year)
-        atime = mktime(datetime.strptime(date, "%d/%m/%Y").timetuple())
-        result = El().history.get(atime)
+        self.__history_atime = mktime(
+                            datetime.strptime(date, "%d/%m/%Y").timetuple())
+        self.__history_offset = None
         self.__history_model.remove_all()
-        self.__add_history_items(result, (year, month, day))
+        self.__add_history_page()
         self.__infobar.hide()
 
+    def _on_history_edge_reached(self, scrolled, position):
+        """
+            Load next history page
+            @param scrolled as Gtk.ScrolledWindow
+            @param position as Gtk.PositionType
+        """
+        if position == Gtk.PositionType.BOTTOM and\
+                self.__history_offset is not None:
+            self.__add_history_page()
+
     def _on_clear_history_clicked(self, button):
         """
             Ask user for confirmation
@@ -693,6 +778,9 @@ class UriPopover(Gtk.Popover):
         self.__infobar_select.append(TimeSpan.CUSTOM, _("From selected day"))
         self.__infobar_select.append(TimeSpan.FOREVER, _("From the beginning"))
         self.__infobar_select.set_active_id(TimeSpan.HOUR)
+        self.__infobar_select.show()
+        self.__infobar_confirm.show()
+        self.__infobar_progress.hide()
         self.__infobar.show()
         # GTK 3.20 https://bugzilla.gnome.org/show_bug.cgi?id=710888
         self.__infobar.queue_resize()
@@ -704,35 +792,79 @@ class UriPopover(Gtk.Popover):
             @param response_id as int
         """
         if response_id == 1:
+            end = time()
             active_id = self.__infobar_select.get_active_id()
             if active_id == TimeSpan.CUSTOM:
                 (year, month, day) = self.__calendar.get_date()
                 date = "%02d/%02d/%s" % (day, month + 1, year)
-                atime = mktime(
+                start = mktime(
                            datetime.strptime(date, "%d/%m/%Y").timetuple())
+            elif active_id == TimeSpan.FOREVER:
+                start = 0
             else:
-                atime = TimeSpanValues[active_id]
+                start = end - TimeSpanValues[active_id] /\
+                    GLib.TIME_SPAN_SECOND
+            self.__clear_cancellable.reset()
+            self.__infobar_select.hide()
+            self.__infobar_confirm.hide()
+            self.__infobar_progress.set_fraction(0)
+            self.__infobar_progress.show()
             thread = Thread(target=self.__clear_history,
-                            args=(atime,))
+                            args=(start, end))
             thread.daemon = True
             thread.start()
-        infobar.hide()
+        else:
+            self.__clear_cancellable.cancel()
+            infobar.hide()
 
 #######################
 # PRIVATE             #
 #######################
-    def __clear_history(self, atime):
+    def __clear_history(self, start, end):
         """
-            Clear history for wanted atime
+            Clear history between start and end
+            @param start as int
+            @param end as int
             @thread safe
         """
-        history_ids = El().history.clear(atime)
+        for (guids, history_ids, progress) in El().history.clear(
+                                                    start, end,
+                                                    self.__clear_cancellable):
+            GLib.idle_add(self.__infobar_progress.set_fraction, progress)
+            if El().sync_worker is not None:
+                if guids:
+                    El().sync_worker.remove_from_history(guids)
+                if history_ids:
+                    El().sync_worker.push_history(history_ids)
+        GLib.idle_add(El().completion.load)
         GLib.idle_add(self._on_day_selected, self.__calendar)
-        if El().sync_worker is None:
-            for history_id in El().history.get_empties():
-                El().history.remove(history_id)
-        else:
-            El().sync_worker.push_history(history_ids)
+
+    def __export(self, exporter, path, cancellable, message, progress):
+        """
+            Export bookmarks and update progress
+            @param exporter as Exporter
+            @param path as str
+            @param cancellable as Gio.Cancellable
+            @param message as Gtk.MessageDialog
+            @param progress as Gtk.ProgressBar
+            @thread safe
+        """
+        error = None
+        try:
+            fraction = 0
+            for value in exporter.export(path, cancellable):
+                # Do not flood main loop, one update per percent
+                if value - fraction >= 0.01:
+                    fraction = value
+                    GLib.idle_add(progress.set_fraction, fraction)
+            if not exporter.status:
+                error = _("Can't write %s") % path
+        except Exception as e:
+            print("PopoverUri::__export():", e)
+            error = str(e)
+        if not cancellable.is_cancelled():
+            GLib.idle_add(self.__on_export_finished, message, progress,
+                          error)
 
     def __check_sync_timer(self):
         """
@@ -772,10 +904,10 @@ class UriPopover(Gtk.Popover):
     def __add_searches(self, searches, position=0):
         """
             Add searches to model
-            @param [(title, uri)] as [(str, str)]
+            @param [(title, uri, snippet)] as [(str, str, str)]
         """
         if searches:
-            (title, uri) = searches.pop(0)
+            (title, uri, snippet) = searches.pop(0)
             for child in self.__search_box.get_children():
                 if child.item.get_property("uri") == uri:
                     child.item.set_property("search", self.__search)
@@ -786,6 +918,7 @@ class UriPopover(Gtk.Popover):
             item.set_property("type", Type.SEARCH)
             item.set_property("title", title)
             item.set_property("uri", uri)
+            item.set_property("snippet", snippet)
             item.set_property("search", self.__search)
             item.set_property("position", position)
             child = Row(item, self.__window)
@@ -803,6 +936,9 @@ class UriPopover(Gtk.Popover):
             Add bookmarks to model
             @param [(bookmark_id, title, uri)] as [(int, str, str)]
         """
+        # Selected tags changed, another list is loading
+        if bookmarks is not self.__shown_bookmarks:
+            return
         if bookmarks:
             (bookmark_id, title, uri) = bookmarks.pop(0)
             item = Item()
@@ -813,11 +949,12 @@ class UriPopover(Gtk.Popover):
             self.__bookmarks_model.append(item)
             GLib.idle_add(self.__add_bookmarks, bookmarks)
 
-    def __add_tags(self, tags, select, position=0):
+    def __add_tags(self, tags, selected, counts, position=0):
         """
             Add tags to model
             @param [(tag_id, title)] as [(int, str)]
-            @param select as int
+            @param selected as [int]
+            @param counts as {int: int}
         """
         if tags:
             (tag_id, title) = tags.pop(0)
@@ -826,39 +963,54 @@ class UriPopover(Gtk.Popover):
             item.set_property("type", Type.TAG)
             item.set_property("title", title)
             child = Row(item, self.__window)
+            child.set_count(counts.get(tag_id, 0))
             child.connect("activate", self.__on_row_activated)
             child.connect("moved", self.__on_row_moved)
             child.show()
             self.__tags_box.add(child)
-            GLib.idle_add(self.__add_tags, tags, select)
+            GLib.idle_add(self.__add_tags, tags, selected, counts)
+        else:
+            # Search for previous selected rows
+            rows = [row for row in self.__tags_box.get_children()
+                    if row.item.get_property("id") in selected]
+            if not rows:
+                rows = [row for row in self.__tags_box.get_children()
+                        if row.item.get_property("id") == Type.POPULARS]
+            for row in rows:
+                self.__tags_box.select_row(row)
+            self.__set_bookmarks_for_tags(self.__get_selected_tag_ids())
+
+    def __add_history_page(self):
+        """
+            Add next history page for selected day to model
+        """
+        items = El().history.get(self.__history_atime,
+                                 self.__HISTORY_PAGE_SIZE,
+                                 self.__history_offset)
+        # Last page, nothing more to load on scroll
+        if len(items) < self.__HISTORY_PAGE_SIZE:
+            self.__history_offset = None
         else:
-            if select is None:
-                select = Type.POPULARS
-            # Search for previous current row
-            for row in self.__tags_box.get_children():
-                if row.item.get_property("id") == select:
-                    self.__tags_box.select_row(row)
-                    break
-            self.__set_bookmarks(select)
+            (history_id, title, uri, atime) = items[-1]
+            self.__history_offset = (atime, history_id)
+        self.__add_history_items(items)
 
-    def __add_history_items(self, items, date):
+    def __add_history_items(self, items):
         """
             Add history items to model
             @param [(history_id, title, uri, atime)]  as [(int, str, str, int)]
-            @param date (jj, mm, aaaa) as (int, int, int)
         """
-        if items:
-            if date != self.__calendar.get_date():
-                return
-            (history_id, title, uri, atime) = items.pop(0)
+        history_items = []
+        for (history_id, title, uri, atime) in items:
             item = Item()
             item.set_property("id", history_id)
             item.set_property("type", Type.HISTORY)
             item.set_property("title", title)
             item.set_property("uri", uri)
             item.set_property("atime", atime)
-            self.__history_model.append(item)
-            GLib.idle_add(self.__add_history_items, items, date)
+            history_items.append(item)
+        self.__history_model.splice(self.__history_model.get_n_items(),
+                                    0, history_items)
 
     def __get_current_box(self):
         """
@@ -885,6 +1037,12 @@ class UriPopover(Gtk.Popover):
         else:
             result = El().bookmarks.search(search, 10)
             result += El().history.search(search, 10)
+        result = [(title, uri, "") for (title, uri) in result]
+        if search and El().settings.get_value("history-content"):
+            uris = [item[1] for item in result]
+            for item in El().history.search_content(search, 10):
+                if item[1] not in uris:
+                    result.append(item)
         self.__add_searches(result)
 
     def __set_bookmarks(self, tag_id):
@@ -892,27 +1050,188 @@ class UriPopover(Gtk.Popover):
             Set bookmarks for tag id
             @param tag id as int
         """
+        self.__set_bookmarks_for_tags([tag_id])
+
+    def __set_bookmarks_for_tags(self, tag_ids):
+        """
+            Set bookmarks having all tags, nothing to do if already shown
+            @param tag_ids as [int]
+        """
+        if tag_ids == self.__shown_tag_ids:
+            return
+        self.__shown_tag_ids = tag_ids
         self.__bookmarks_model.remove_all()
         self.__remove_button.hide()
-        if tag_id == Type.POPULARS:
+        if not tag_ids:
+            items = []
+        elif len(tag_ids) > 1:
+            items = El().bookmarks.get_bookmarks_for_tags(tag_ids)
+        elif tag_ids[0] == Type.POPULARS:
             items = El().bookmarks.get_populars(50)
-        elif tag_id == Type.RECENTS:
+        elif tag_ids[0] == Type.RECENTS:
             items = El().bookmarks.get_recents()
-        elif tag_id == Type.NONE:
+        elif tag_ids[0] == Type.NONE:
             items = El().bookmarks.get_unclassified()
         else:
-            items = El().bookmarks.get_bookmarks(tag_id)
+            items = El().bookmarks.get_bookmarks(tag_ids[0])
         self.__bookmarks_count.set_text("%s bookmarks" % len(items))
+        self.__shown_bookmarks = items
         self.__add_bookmarks(items)
 
+    def __get_bookmark_position(self, bookmark_id):
+        """
+            Get bookmark position in bookmarks model
+            @param bookmark_id as int
+            @return int/None
+        """
+        for i in range(self.__bookmarks_model.get_n_items()):
+            item = self.__bookmarks_model.get_item(i)
+            if item.get_property("id") == bookmark_id:
+                return i
+        return None
+
+    def __get_bookmark_item(self, bookmark_id):
+        """
+            Get a new bookmark item
+            @param bookmark_id as int
+            @return Item
+        """
+        item = Item()
+        item.set_property("id", bookmark_id)
+        item.set_property("type", Type.BOOKMARK)
+        item.set_property("title", El().bookmarks.get_title(bookmark_id))
+        item.set_property("uri", El().bookmarks.get_uri(bookmark_id))
+        return item
+
+    def __get_selected_tag_ids(self):
+        """
+            Get selected tag ids, static ones if only one is selected
+            @return [int]
+        """
+        rows = self.__tags_box.get_selected_rows()
+        tag_ids = [row.item.get_property("id") for row in rows]
+        if len(tag_ids) > 1:
+            return [tag_id for tag_id in tag_ids if tag_id >= 0]
+        return tag_ids
+
+    def __is_in_selected_tag(self, bookmark_id):
+        """
+            True if bookmark belongs to selected tags
+            @param bookmark_id as int
+            @return bool/None if tag list is not static
+        """
+        selected_ids = self.__get_selected_tag_ids()
+        if not selected_ids:
+            return False
+        tag_ids = El().bookmarks.model.get_tag_ids(bookmark_id)
+        if selected_ids == [Type.NONE]:
+            return not tag_ids
+        elif selected_ids[0] >= 0:
+            return set(selected_ids) <= set(tag_ids)
+        return None
+
+    def __update_tags_count(self):
+        """
+            Update bookmarks count for tags
+        """
+        counts = El().bookmarks.get_tags_count()
+        for row in self.__tags_box.get_children():
+            tag_id = row.item.get_property("id")
+            if tag_id >= 0:
+                row.set_count(counts.get(tag_id, 0))
+
+    def __update_bookmarks_count(self):
+        """
+            Update bookmarks count label
+        """
+        self.__bookmarks_count.set_text(
+                         "%s bookmarks" % self.__bookmarks_model.get_n_items())
+
+    def __on_export_response(self, dialog, response_id, cancellable):
+        """
+            Cancel export if running and close dialog
+            @param dialog as Gtk.MessageDialog
+            @param response_id as int
+            @param cancellable as Gio.Cancellable
+        """
+        cancellable.cancel()
+        dialog.destroy()
+
+    def __on_export_finished(self, message, progress, error):
+        """
+            Show export result
+            @param message as Gtk.MessageDialog
+            @param progress as Gtk.ProgressBar
+            @param error as str/None
+        """
+        progress.hide()
+        if error is None:
+            message.set_property("text", _("Bookmarks exported"))
+        else:
+            message.set_property("message-type", Gtk.MessageType.ERROR)
+            message.set_property("text", _("Bookmarks export failed"))
+            message.set_property("secondary-text", error)
+        button = message.get_widget_for_response(Gtk.ResponseType.CANCEL)
+        button.set_label(_("Close"))
+
+    def __on_bookmark_added(self, model, bookmark_id):
+        """
+            Add bookmark to current view if needed
+            @param model as BookmarksModel
+            @param bookmark_id as int
+        """
+        if self.__is_in_selected_tag(bookmark_id) and\
+                self.__get_bookmark_position(bookmark_id) is None:
+            self.__bookmarks_model.append(
+                                      self.__get_bookmark_item(bookmark_id))
+            self.__update_bookmarks_count()
+
+    def __on_bookmark_changed(self, model, bookmark_id):
+        """
+            Update bookmark in current view
+            @param model as BookmarksModel
+            @param bookmark_id as int
+        """
+        position = self.__get_bookmark_position(bookmark_id)
+        if position is None:
+            self.__on_bookmark_added(model, bookmark_id)
+            return
+        if self.__is_in_selected_tag(bookmark_id) is False:
+            self.__bookmarks_model.remove(position)
+            self.__update_bookmarks_count()
+        else:
+            item = self.__get_bookmark_item(bookmark_id)
+            self.__bookmarks_model.splice(position, 1, [item])
+
+    def __on_bookmark_removed(self, model, bookmark_id):
+        """
+            Remove bookmark from current view
+            @param model as BookmarksModel
+            @param bookmark_id as int
+        """
+        position = self.__get_bookmark_position(bookmark_id)
+        if position is not None:
+            self.__bookmarks_model.remove(position)
+            self.__update_bookmarks_count()
+
+    def __on_tags_changed(self, model):
+        """
+            Update bookmarks count for tags
+            @param model as BookmarksModel
+        """
+        self.__update_tags_count()
+
     def __on_tag_entry_changed(self, entry):
         """
             Update tag title
             @param entry as Gtk.Entry
         """
-        current = self.__tags_box.get_selected_row()
+        tag_ids = self.__get_selected_tag_ids()
+        # Only one tag can be renamed, static tags can't
+        if len(tag_ids) != 1 or tag_ids[0] < 0:
+            return
         value = entry.get_text()
-        current_title = current.item.get_property("title")
+        current_title = El().bookmarks.get_tag_title(tag_ids[0])
         if current_title != value:
             self.__remove_button.show()
         else:
@@ -930,12 +1249,22 @@ class UriPopover(Gtk.Popover):
         size = self.__window.get_size()
         self.set_size_request(size[0]*0.5, size[1]*0.8)
         self.__scrolled_bookmarks.set_size_request(size[1]*0.6*0.5, -1)
+        model = El().bookmarks.model
+        self.__model_signal_ids = [
+            model.connect("bookmark-added", self.__on_bookmark_added),
+            model.connect("bookmark-changed", self.__on_bookmark_changed),
+            model.connect("bookmark-removed", self.__on_bookmark_removed),
+            model.connect("tags-changed", self.__on_tags_changed)]
 
     def __on_unmap(self, widget):
         """
             Switch to bookmarks
             @param widget as Gtk.Widget
         """
+        for signal_id in self.__model_signal_ids:
+            El().bookmarks.model.disconnect(signal_id)
+        self.__model_signal_ids = []
+        self.__shown_tag_ids = None
         self.__stack.set_visible_child_name("bookmarks")
         self.__bookmarks_model.remove_all()
         for child in self.__tags_box.get_children():
@@ -953,18 +1282,18 @@ class UriPopover(Gtk.Popover):
 
     def __on_row_moved(self, row, items):
         """
-            Move bookmark from current selected tag to tag
+            Move bookmark from current selected tags to tag
             @param row as Row
             @param items [(bookmark_id, tag_id)] as [(int, int)]
             @param tag id as int
         """
-        tag_row = self.__tags_box.get_selected_row()
-        current_tag_id = tag_row.item.get_property("id")
+        current_tag_ids = [tag_id for tag_id in self.__get_selected_tag_ids()
+                           if tag_id >= 0]
         for item in items:
-            if current_tag_id >= 0:
-                El().bookmarks.del_tag_from(current_tag_id, item[0])
+            for tag_id in current_tag_ids:
+                if tag_id != item[1]:
+                    El().bookmarks.del_tag_from(tag_id, item[0])
             El().bookmarks.add_tag_to(item[1], item[0])
-        self.__on_row_activated(tag_row)
         El().bookmarks.clean_tags()
         if El().sync_worker is not None:
             El().sync_worker.sync()
@@ -101,6 +101,10 @@ class SettingsDialog:
         remember_session.set_active(
                                 El().settings.get_value("remember-session"))
 
+        history_content = builder.get_object("history_content_check")
+        history_content.set_active(
+                                El().settings.get_value("history-content"))
+
         enable_plugins = builder.get_object("plugins_check")
         enable_plugins.set_active(
                                 El().settings.get_value("enable-plugins"))
@@ -324,6 +328,14 @@ class SettingsDialog:
         El().settings.set_value("remember-passwords",
                                 GLib.Variant("b", button.get_active()))
 
+    def _on_history_content_toggled(self, button):
+        """
+            Save state
+            @param button as Gtk.ToggleButton
+        """
+        El().settings.set_value("history-content",
+                                GLib.Variant("b", button.get_active()))
+
     def _on_remember_sessions_toggled(self, button):
         """
             Save state
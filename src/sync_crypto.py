@@ -0,0 +1,273 @@
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# Fork of https://github.com/mozilla-services/syncclient
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# No gi import here: functions run in worker processes
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock
+from hashlib import sha256
+from time import time
+import os
+import json
+import hmac
+import base64
+import math
+from Crypto.Cipher import AES
+from Crypto import Random
+
+
+# Records decrypted by a worker at once
+CHUNK_SIZE = 250
+
+# Shared by all pulls, see _get_executor()
+_executor = None
+_executor_workers = 0
+_executor_lock = Lock()
+
+
+def encrypt_payload(record, key_bundle):
+    """
+        Encrypt payload
+        @param record as {}
+        @param key bundle as KeyBundle
+        @return encrypted record payload
+    """
+    plaintext = json.dumps(record).encode("utf-8")
+    # Input strings must be a multiple of 16 in length
+    length = 16 - (len(plaintext) % 16)
+    plaintext += bytes([length]) * length
+    iv = Random.new().read(16)
+    aes = AES.new(key_bundle.encryption_key, AES.MODE_CBC, iv)
+    ciphertext = base64.b64encode(aes.encrypt(plaintext))
+    _hmac = hmac.new(key_bundle.hmac_key,
+                     ciphertext,
+                     sha256).hexdigest()
+    payload = {"ciphertext": ciphertext.decode("utf-8"),
+               "IV": base64.b64encode(iv).decode("utf-8"), "hmac": _hmac}
+    return json.dumps(payload)
+
+
+def decrypt_payload(record, key_bundle):
+    """
+        Decrypt payload
+        @param record as {}
+        @param key bundle as KeyBundle
+        @return uncrypted record payload
+    """
+    return decrypt_payloads([record["payload"]],
+                            key_bundle.encryption_key,
+                            key_bundle.hmac_key)[0]
+
+
+def decrypt_payloads(payloads, encryption_key, hmac_key):
+    """
+        Decrypt payloads, one work unit for decrypt_pages()
+        @param payloads as [str] (json)
+        @param encryption_key as bytes
+        @param hmac_key as bytes
+        @return [{}]
+        @raise ValueError on HMAC mismatch
+    """
+    result = []
+    for payload in payloads:
+        j = json.loads(payload)
+        # Always check the hmac before decrypting anything.
+        expected_hmac = hmac.new(hmac_key,
+                                 j['ciphertext'].encode("utf-8"),
+                                 sha256).hexdigest()
+        if not hmac.compare_digest(j['hmac'], expected_hmac):
+            raise ValueError("HMAC mismatch: %s != %s" % (j['hmac'],
+                                                          expected_hmac))
+        ciphertext = base64.b64decode(j['ciphertext'])
+        iv = base64.b64decode(j['IV'])
+        aes = AES.new(encryption_key, AES.MODE_CBC, iv)
+        plaintext = aes.decrypt(ciphertext).strip().decode("utf-8")
+        # Remove any CBC block padding,
+        # assuming it's a well-formed JSON payload.
+        plaintext = plaintext[:plaintext.rfind("}") + 1]
+        result.append(json.loads(plaintext))
+    return result
+
+
+def decrypt_pages(pages, key_bundle, workers=None, chunk_size=CHUNK_SIZE):
+    """
+        Decrypt records payload, page by page
+        Pages are split in chunks decrypted by a process pool. Next page
+        is fetched while workers decrypt current one.
+        Pages are yielded in order, records order is kept
+        @param pages as iterator over [{}]
+        @param key bundle as KeyBundle
+        @param workers as int: None for cpu count, 1 to decrypt inline
+        @param chunk_size as int
+        @return yield [{}]
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    executor = None
+    if workers > 1:
+        executor = _get_executor(workers)
+    pending = None
+    for records in pages:
+        if executor is None:
+            yield _set_payloads(records, None, key_bundle)
+            continue
+        chunks = [[record["payload"]
+                   for record in records[i:i + chunk_size]]
+                  for i in range(0, len(records), chunk_size)]
+        # map() starts all chunks now and gives results in order
+        results = executor.map(decrypt_payloads, chunks,
+                               [key_bundle.encryption_key] * len(chunks),
+                               [key_bundle.hmac_key] * len(chunks))
+        if pending is not None:
+            yield _set_payloads(*pending)
+        pending = (records, results, key_bundle)
+    if pending is not None:
+        yield _set_payloads(*pending)
+
+
+def shutdown_workers():
+    """
+        Stop decrypt worker processes, started again on next pull
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(False)
+            _executor = None
+
+
+def benchmark(count=20000, page_size=1000):
+    """
+        Measure decrypt throughput on synthetic history records
+        @param count as int: records to decrypt
+        @param page_size as int
+        @return [(workers as int, records per second as float)]
+    """
+    key_bundle = KeyBundle(os.urandom(32), os.urandom(32))
+    records = []
+    for i in range(0, count):
+        history = {"id": "%012d" % i,
+                   "histUri": "https://example.com/%s/page.html?q=%s" % (
+                                                                   i, i * 7),
+                   "title": "Synthetic history record %s" % i,
+                   "visits": [{"date": 1500000000000000 + i * 1000 + j,
+                               "type": 1} for j in range(0, 10)]}
+        records.append({"id": history["id"],
+                        "modified": 1500000000.0 + i,
+                        "payload": encrypt_payload(history, key_bundle)})
+    results = []
+    for workers in sorted(set([1, os.cpu_count() or 1])):
+        pages = [[dict(record) for record in records[i:i + page_size]]
+                 for i in range(0, count, page_size)]
+        # Workers live between pulls, do not measure their startup
+        warmup = [dict(record) for record in records[0:CHUNK_SIZE * workers]]
+        for page in decrypt_pages(iter([warmup]), key_bundle, workers):
+            pass
+        start = time()
+        for page in decrypt_pages(iter(pages), key_bundle, workers):
+            pass
+        results.append((workers, count / (time() - start)))
+    return results
+
+
+class KeyBundle:
+    """
+        RFC-5869
+    """
+    def __init__(self, encryption_key, hmac_key):
+        self.encryption_key = encryption_key
+        self.hmac_key = hmac_key
+
+    @classmethod
+    def fromMasterKey(cls, master_key, info):
+        key_material = KeyBundle.HKDF(master_key, None, info, 2 * 32)
+        return cls(key_material[:32], key_material[32:])
+
+    def HKDF_extract(salt, IKM, hashmod=sha256):
+        """
+            Extract a pseudorandom key suitable for use with HKDF_expand
+            @param salt as str
+            @param IKM as str
+        """
+        if salt is None:
+            salt = b"\x00" * hashmod().digest_size
+        return hmac.new(salt, IKM, hashmod).digest()
+
+    def HKDF_expand(PRK, info, length, hashmod=sha256):
+        """
+            Expand pseudo random key and info
+            @param PRK as str
+            @param info as str
+            @param length as int
+        """
+        digest_size = hashmod().digest_size
+        N = int(math.ceil(length * 1.0 / digest_size))
+        assert N <= 255
+        T = b""
+        output = []
+        for i in range(1, N + 1):
+            data = T + (info + chr(i)).encode()
+            T = hmac.new(PRK, data, hashmod).digest()
+            output.append(T)
+        return b"".join(output)[:length]
+
+    def HKDF(secret, salt, info, length, hashmod=sha256):
+        """
+            HKDF-extract-and-expand as a single function.
+            @param secret as str
+            @param salt as str
+            @param info as str
+            @param length as int
+        """
+        PRK = KeyBundle.HKDF_extract(salt, secret, hashmod)
+        return KeyBundle.HKDF_expand(PRK, info, length, hashmod)
+
+
+def _get_executor(workers):
+    """
+        Get process pool, created on first use and kept between pulls
+        Workers are spawned, not forked: forking a process with GTK and
+        WebKit threads may copy locks held by those threads
+        @param workers as int
+        @return ProcessPoolExecutor
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None and _executor_workers != workers:
+            _executor.shutdown(False)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(workers,
+                                            mp_context=get_context("spawn"))
+            _executor_workers = workers
+        return _executor
+
+
+def _set_payloads(records, results, key_bundle):
+    """
+        Replace records payload with decrypted one
+        @param records as [{}]
+        @param results as iterator over [{}]/None: decrypt inline if None
+        @param key bundle as KeyBundle
+        @return records as [{}]
+    """
+    if results is None:
+        results = [decrypt_payloads([record["payload"]
+                                     for record in records],
+                                    key_bundle.encryption_key,
+                                    key_bundle.hmac_key)]
+    payloads = (payload for chunk in results for payload in chunk)
+    for (record, payload) in zip(records, payloads):
+        record["payload"] = payload
+    return records
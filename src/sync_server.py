@@ -0,0 +1,557 @@
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# No gi import here: server runs headless
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+from threading import Thread, Lock
+from time import time
+import os
+import json
+import base64
+
+
+class LocalSyncServer:
+    """
+        Local stand-in for Sync 1.5 token and storage servers
+        Only endpoints used by SyncClient are implemented. Records are kept
+        in memory, BrowserID assertions and Hawk signatures are not checked.
+        Post, batch and record size limits from LIMITS are enforced.
+    """
+    # Same defaults as Sync 1.5 server
+    LIMITS = {"max_post_records": 100,
+              "max_post_bytes": 2097152,
+              "max_total_records": 10000,
+              "max_total_bytes": 104857600,
+              "max_request_bytes": 2101248,
+              "max_record_payload_bytes": 2097152}
+    __UID = 1
+
+    def __init__(self, port=0, limits={}):
+        """
+            Init server, listening on localhost
+            @param port as int: 0 for a free port
+            @param limits as {}: override LIMITS
+        """
+        self.__lock = Lock()
+        self.__collections = {}
+        self.__modified = {}
+        self.__batches = {}
+        self.__batch_id = 0
+        self.__timestamp = 0
+        self.__limits = dict(self.LIMITS)
+        self.__limits.update(limits)
+        self.reset_stats()
+        self.__httpd = _HTTPServer(("127.0.0.1", port), _RequestHandler)
+        self.__httpd.sync_server = self
+
+    def start(self):
+        """
+            Serve requests in a thread
+        """
+        thread = Thread(target=self.__httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """
+            Stop serving requests
+        """
+        self.__httpd.shutdown()
+        self.__httpd.server_close()
+
+    def reset_stats(self):
+        """
+            Reset request and byte counters
+        """
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def add_record(self, collection, bso):
+        """
+            Store a record without a request, to seed server
+            @param collection as str
+            @param bso as {}
+        """
+        with self.__lock:
+            self.__apply(collection, [bso], self.__get_timestamp())
+
+    def handle(self, method, path, query, body):
+        """
+            Handle a request
+            @param method as str
+            @param path as str
+            @param query as {str: [str]}
+            @param body as bytes
+            @return (status as int, headers as {}, content as json object)
+        """
+        with self.__lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+            parts = [part for part in path.split("/") if part]
+            try:
+                if parts == ["1.0", "sync", "1.5"] and method == "GET":
+                    return self.__get_token()
+                if len(parts) < 2 or parts[0] != "1.5" or\
+                        parts[1] != str(self.__UID):
+                    return (404, {}, {"error": "not found"})
+                parts = parts[2:]
+                if not parts and method == "DELETE":
+                    return self.__delete_all()
+                if parts == ["info", "collections"] and method == "GET":
+                    return (200, {}, dict(self.__modified))
+                if parts == ["info", "collection_counts"] and\
+                        method == "GET":
+                    return (200, {}, {name: len(records) for (name, records)
+                                      in self.__collections.items()})
+                if parts == ["info", "configuration"] and method == "GET":
+                    return (200, {}, self.__limits)
+                if len(parts) == 2 and parts[0] == "storage":
+                    if method == "GET":
+                        return self.__get_records(parts[1], query)
+                    elif method == "POST":
+                        return self.__post_records(parts[1], query,
+                                                   json.loads(body.decode(
+                                                                "utf-8")))
+                    elif method == "DELETE":
+                        return self.__delete_records(parts[1], query)
+                if len(parts) == 3 and parts[0] == "storage":
+                    if method == "GET":
+                        return self.__get_record(parts[1], parts[2])
+                    elif method == "PUT":
+                        return self.__put_record(parts[1], parts[2],
+                                                 json.loads(body.decode(
+                                                                "utf-8")))
+                    elif method == "DELETE":
+                        return self.__delete_record(parts[1], parts[2])
+                return (404, {}, {"error": "not found"})
+            except ValueError as e:
+                return (400, {}, {"error": str(e)})
+
+    def count_sent(self, size):
+        """
+            Count response bytes
+            @param size as int
+        """
+        with self.__lock:
+            self.bytes_sent += size
+
+    @property
+    def timestamp(self):
+        """
+            Last server timestamp
+            @return float
+        """
+        return self.__timestamp
+
+    @property
+    def uri(self):
+        """
+            Server uri, usable as tokenserver url
+            @return str
+        """
+        return "http://127.0.0.1:%s" % self.__httpd.server_address[1]
+
+#######################
+# PRIVATE             #
+#######################
+    def __get_timestamp(self):
+        """
+            Get a new server timestamp, greater than previous ones
+            @return float
+        """
+        timestamp = round(time(), 2)
+        if timestamp <= self.__timestamp:
+            timestamp = round(self.__timestamp + 0.01, 2)
+        self.__timestamp = timestamp
+        return timestamp
+
+    def __apply(self, collection, bsos, timestamp):
+        """
+            Store records in collection
+            @param collection as str
+            @param bsos as [{}]
+            @param timestamp as float
+        """
+        records = self.__collections.setdefault(collection, {})
+        for bso in bsos:
+            record = records.get(bso["id"], {"id": bso["id"]})
+            for key in ["payload", "sortindex", "ttl"]:
+                if key in bso:
+                    record[key] = bso[key]
+            record["modified"] = timestamp
+            records[bso["id"]] = record
+        self.__modified[collection] = timestamp
+
+    def __get_token(self):
+        """
+            Issue a token for the only user
+            @return response as (int, {}, {})
+        """
+        return (200, {}, {"id": "local-token-%s" % self.__UID,
+                          "key": "local-key-%s" % self.__UID,
+                          "uid": self.__UID,
+                          "api_endpoint": "%s/1.5/%s" % (self.uri,
+                                                         self.__UID),
+                          "duration": 3600,
+                          "hashalg": "sha256"})
+
+    def __get_records(self, collection, query):
+        """
+            Get collection records, ids or full records
+            @param collection as str
+            @param query as {str: [str]}
+            @return response as (int, {}, [])
+        """
+        records = list(self.__collections.get(collection, {}).values())
+        if "newer" in query:
+            newer = float(query["newer"][0])
+            records = [record for record in records
+                       if record["modified"] > newer]
+        if "ids" in query:
+            ids = set(query["ids"][0].split(","))
+            records = [record for record in records if record["id"] in ids]
+        sort = query.get("sort", ["newest"])[0]
+        if sort == "index":
+            records.sort(key=lambda record: record.get("sortindex", 0),
+                         reverse=True)
+        else:
+            records.sort(key=lambda record: (record["modified"],
+                                             record["id"]),
+                         reverse=sort != "oldest")
+        offset = int(query.get("offset", ["0"])[0])
+        headers = {"X-Last-Modified": self.__modified.get(collection, 0)}
+        if "limit" in query:
+            limit = int(query["limit"][0])
+            if offset + limit < len(records):
+                headers["X-Weave-Next-Offset"] = offset + limit
+            records = records[offset:offset + limit]
+        else:
+            records = records[offset:]
+        if "full" not in query:
+            records = [record["id"] for record in records]
+        return (200, headers, records)
+
+    def __get_record(self, collection, record_id):
+        """
+            Get a record
+            @param collection as str
+            @param record_id as str
+            @return response as (int, {}, {})
+        """
+        record = self.__collections.get(collection, {}).get(record_id)
+        if record is None:
+            return (404, {}, {"error": "not found"})
+        return (200, {"X-Last-Modified": record["modified"]}, record)
+
+    def __post_records(self, collection, query, bsos):
+        """
+            Store records, at once or in a batch committed later
+            @param collection as str
+            @param query as {str: [str]}
+            @param bsos as [{}]
+            @return response as (int, {}, {})
+        """
+        if not isinstance(bsos, list) or\
+                not all(isinstance(bso, dict) for bso in bsos):
+            return (400, {}, {"error": "body must be a list of objects"})
+        size = len(json.dumps(bsos))
+        # Same error code as Sync 1.5 server: size limit exceeded
+        if len(bsos) > self.__limits["max_post_records"] or\
+                size > self.__limits["max_post_bytes"]:
+            return (400, {}, 17)
+        success = []
+        failed = {}
+        valid = []
+        for bso in bsos:
+            payload = bso.get("payload", "")
+            if not isinstance(bso.get("id"), str) or\
+                    not isinstance(payload, str):
+                failed[str(bso.get("id"))] = ["invalid record"]
+            elif len(payload) > self.__limits["max_record_payload_bytes"]:
+                failed[bso["id"]] = ["payload too large"]
+            else:
+                success.append(bso["id"])
+                valid.append(bso)
+        batch = query.get("batch", [None])[0]
+        commit = query.get("commit", ["false"])[0] == "true"
+        if batch is None:
+            timestamp = self.__get_timestamp()
+            self.__apply(collection, valid, timestamp)
+            return (200, {}, {"modified": timestamp,
+                              "success": success, "failed": failed})
+        if batch == "true":
+            self.__batch_id += 1
+            batch = str(self.__batch_id)
+            self.__batches[batch] = [collection, [], 0]
+        elif self.__batches.get(batch, (None,))[0] != collection:
+            return (400, {}, {"error": "invalid batch %s" % batch})
+        pending = self.__batches[batch]
+        if len(pending[1]) + len(valid) > self.__limits["max_total_records"]\
+                or pending[2] + size > self.__limits["max_total_bytes"]:
+            del self.__batches[batch]
+            return (400, {}, 17)
+        pending[1].extend(valid)
+        pending[2] += size
+        if not commit:
+            return (202, {}, {"batch": batch,
+                              "success": success, "failed": failed})
+        timestamp = self.__get_timestamp()
+        self.__apply(collection, self.__batches.pop(batch)[1], timestamp)
+        return (200, {}, {"modified": timestamp,
+                          "success": success, "failed": failed})
+
+    def __put_record(self, collection, record_id, bso):
+        """
+            Store a record
+            @param collection as str
+            @param record_id as str
+            @param bso as {}
+            @return response as (int, {}, float)
+        """
+        if not isinstance(bso, dict) or\
+                not isinstance(bso.get("payload", ""), str):
+            return (400, {}, {"error": "body must be an object"})
+        bso["id"] = record_id
+        timestamp = self.__get_timestamp()
+        self.__apply(collection, [bso], timestamp)
+        return (200, {}, timestamp)
+
+    def __delete_record(self, collection, record_id):
+        """
+            Delete a record
+            @param collection as str
+            @param record_id as str
+            @return response as (int, {}, {})
+        """
+        records = self.__collections.get(collection, {})
+        if record_id not in records:
+            return (404, {}, {"error": "not found"})
+        del records[record_id]
+        timestamp = self.__get_timestamp()
+        self.__modified[collection] = timestamp
+        return (200, {}, {"modified": timestamp})
+
+    def __delete_records(self, collection, query):
+        """
+            Delete records in ids or whole collection
+            @param collection as str
+            @param query as {str: [str]}
+            @return response as (int, {}, {})
+        """
+        timestamp = self.__get_timestamp()
+        if "ids" in query:
+            records = self.__collections.get(collection, {})
+            for record_id in query["ids"][0].split(","):
+                records.pop(record_id, None)
+            self.__modified[collection] = timestamp
+        else:
+            self.__collections.pop(collection, None)
+            self.__modified.pop(collection, None)
+        return (200, {}, {"modified": timestamp})
+
+    def __delete_all(self):
+        """
+            Delete all user records
+            @return response as (int, {}, {})
+        """
+        self.__collections = {}
+        self.__modified = {}
+        self.__batches = {}
+        return (200, {}, {"modified": self.__get_timestamp()})
+
+
+def benchmark(history_count=10000, bookmarks_count=1000, changes=100):
+    """
+        Measure sync transfer against a local server with a synthetic profile
+        A first client uploads whole profile, a second one downloads it.
+        Then first client uploads changes and second one downloads them back.
+        Only transfer and crypto are measured, downloaded records are not
+        applied to databases as SyncWorker does
+        @param history_count as int
+        @param bookmarks_count as int
+        @param changes as int: records changed for incremental sync
+        @return [(step as str, records as int, seconds as float,
+                  requests as int, bytes as int)]
+    """
+    # Needs the full sync stack
+    from eolie.mozilla_sync import MozillaSync
+    from eolie.sync_crypto import KeyBundle, encrypt_payload
+    server = LocalSyncServer()
+    server.start()
+    try:
+        # Crypto keys are created by the first client connecting
+        key = os.urandom(32)
+        sync_keys = KeyBundle.fromMasterKey(
+                                        key,
+                                        "identity.mozilla.com/picl/v1/oldsync")
+        default = [base64.b64encode(os.urandom(32)).decode("utf-8"),
+                   base64.b64encode(os.urandom(32)).decode("utf-8")]
+        server.add_record("crypto", {
+            "id": "keys",
+            "payload": encrypt_payload({"id": "keys",
+                                        "collection": "crypto",
+                                        "default": default,
+                                        "collections": {}}, sync_keys)})
+        history = [_get_history_record(i) for i in range(0, history_count)]
+        bookmarks = [_get_bookmark_record(i)
+                     for i in range(0, bookmarks_count)]
+        results = []
+
+        def measure(step, function):
+            server.reset_stats()
+            start = time()
+            count = function()
+            results.append((step, count, time() - start, server.requests,
+                            server.bytes_received + server.bytes_sent))
+
+        def upload(client, bulk_keys, history, bookmarks):
+            client.add_history(history, bulk_keys)
+            client.add_bookmarks(bookmarks, bulk_keys)
+            return len(history) + len(bookmarks)
+
+        def download(client, bulk_keys, mtimes):
+            # Fetch and decrypt changed collections, nothing is applied
+            count = 0
+            new_mtimes = client.client.info_collections()
+            for (collection, get) in [("history", client.get_history),
+                                      ("bookmarks", client.get_bookmarks)]:
+                if new_mtimes.get(collection) == mtimes.get(collection):
+                    continue
+                for records in get(bulk_keys, mtimes.get(collection)):
+                    count += len(records)
+            mtimes.update(new_mtimes)
+            return count
+
+        def connect(clients, keys):
+            for client in clients:
+                keys[client] = client.connect("local", key)
+            return 0
+
+        first = MozillaSync(tokenserver_url=server.uri)
+        second = MozillaSync(tokenserver_url=server.uri)
+        keys = {}
+        mtimes = {}
+        measure("connect", lambda: connect([first, second], keys))
+        measure("full upload", lambda: upload(first, keys[first],
+                                              history, bookmarks))
+        measure("full download", lambda: download(second, keys[second],
+                                                  mtimes))
+        for record in history[0:changes]:
+            record["title"] += " (changed)"
+            record["visits"].insert(0, {"date": int(time() * 1000000),
+                                        "type": 1})
+        for record in bookmarks[0:changes]:
+            record["title"] += " (changed)"
+        measure("incremental upload", lambda: upload(first, keys[first],
+                                                     history[0:changes],
+                                                     bookmarks[0:changes]))
+        measure("incremental download", lambda: download(second,
+                                                         keys[second],
+                                                         mtimes))
+        measure("idle download", lambda: download(second, keys[second],
+                                                  mtimes))
+        return results
+    finally:
+        server.stop()
+
+
+def _get_history_record(i):
+    """
+        Get a synthetic history record
+        @param i as int
+        @return {}
+    """
+    return {"id": "h%011d" % i,
+            "histUri": "https://example.com/%s/page.html?q=%s" % (i, i * 7),
+            "title": "Synthetic history record %s" % i,
+            "visits": [{"date": 1500000000000000 + i * 1000 + j, "type": 1}
+                       for j in range(0, 10)]}
+
+
+def _get_bookmark_record(i):
+    """
+        Get a synthetic bookmark record
+        @param i as int
+        @return {}
+    """
+    return {"id": "b%011d" % i,
+            "type": "bookmark",
+            "title": "Synthetic bookmark %s" % i,
+            "bmkUri": "https://example.org/%s/" % i,
+            "tags": ["tag%s" % (i % 10)],
+            "parentid": "unfiled",
+            "parentName": ""}
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    """
+        One thread per connection
+    """
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+        Forward requests to LocalSyncServer
+    """
+    # Keep connections alive like real servers
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written apart, do not wait for ACK between them
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.__handle("GET")
+
+    def do_POST(self):
+        self.__handle("POST")
+
+    def do_PUT(self):
+        self.__handle("PUT")
+
+    def do_DELETE(self):
+        self.__handle("DELETE")
+
+    def log_message(self, format, *args):
+        """
+            Do not log requests
+        """
+        pass
+
+#######################
+# PRIVATE             #
+#######################
+    def __handle(self, method):
+        """
+            Handle request and send JSON response
+            @param method as str
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        url = urlsplit(self.path)
+        sync_server = self.server.sync_server
+        (status, headers, content) = sync_server.handle(method, url.path,
+                                                        parse_qs(url.query),
+                                                        body)
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Weave-Timestamp", str(sync_server.timestamp))
+        for (name, value) in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+        sync_server.count_sent(len(data))
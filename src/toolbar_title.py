@@ -39,6 +39,7 @@ class ToolbarTitle(Gtk.Bin):
         self.__signal_id = None
         self.__secure_content = True
         self.__keywords_timeout = None
+        self.__completion = None
         self.__icon_grid_width = None
         self.__uri = ""
         self.__keywords_cancellable = Gio.Cancellable.new()
@@ -498,6 +499,9 @@ class ToolbarTitle(Gtk.Bin):
             @param entry as Gtk.Entry
         """
         uri = entry.get_text()
+        # Inline completion, load matching history uri
+        if self.__completion is not None and self.__completion[0] == uri:
+            uri = self.__completion[1]
         parsed = urlparse(uri)
         is_uri = parsed.scheme in ["about", "http",
                                    "https", "file", "populars"]
@@ -563,6 +567,17 @@ class ToolbarTitle(Gtk.Bin):
         elif parsed.scheme == "http":
             self.set_insecure_content()
 
+    def __complete_entry(self, value, completion):
+        """
+            Set completion in entry, select completed part
+            @param value as str
+            @param completion as str
+        """
+        if self.__entry.get_text() != value:
+            return
+        self.set_text_entry(completion)
+        self.__entry.select_region(len(value), -1)
+
     def __search_keywords_thread(self, value):
         """
             Run __search_keywords() in a thread
@@ -610,6 +625,10 @@ class ToolbarTitle(Gtk.Bin):
         """
         value = entry.get_text()
         webview = self.__window.container.current.webview
+        if webview in self.__text_entry_history.keys():
+            previous = self.__text_entry_history[webview]
+        else:
+            previous = ""
         self.__text_entry_history[webview] = self.__entry.get_text()
         self.__keywords_cancellable.cancel()
         parsed = urlparse(value)
@@ -620,6 +639,16 @@ class ToolbarTitle(Gtk.Bin):
         else:
             self.__popover.set_search_text(value)
 
+        # Complete inline only if user is typing, not deleting
+        self.__completion = None
+        if not is_uri and value.find(" ") == -1 and\
+                len(value) > len(previous) and value.startswith(previous) and\
+                self.__entry.has_focus():
+            self.__completion = El().completion.get(value)
+            if self.__completion is not None:
+                GLib.idle_add(self.__complete_entry,
+                              value, self.__completion[0])
+
         parsed = urlparse(self.__uri)
         if value:
             self.__placeholder.set_opacity(0)
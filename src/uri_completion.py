@@ -0,0 +1,266 @@
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib
+
+from bisect import bisect_left, insort
+from urllib.parse import urlparse
+from threading import Thread
+from time import time
+
+from eolie.define import El
+from eolie.sqlcursor import SqlCursor
+
+
+class UriCompletion:
+    """
+        In memory prefix index over visited hosts and uris
+        Hosts are completed first, then paths for typed host
+    """
+    # (max age in days, weight), like Firefox frecency buckets
+    __BUCKETS = [(4, 100), (14, 70), (31, 50), (90, 30)]
+    __DEFAULT_WEIGHT = 10
+
+    def __init__(self):
+        """
+            Init index
+        """
+        # Changes done while an index is built, one list per build
+        self.__pendings = []
+        self.__set_index(({}, {}, {}, {}))
+
+    def load(self):
+        """
+            Rebuild index from history in background
+        """
+        pending = []
+        self.__pendings.append(pending)
+        thread = Thread(target=self.__load, args=(pending,))
+        thread.daemon = True
+        thread.start()
+
+    def add(self, uri):
+        """
+            Add a visit for uri
+            @param uri as str
+        """
+        self.__apply(self.__index, True, uri)
+        for pending in self.__pendings:
+            pending.append((True, uri))
+
+    def remove(self, uri):
+        """
+            Remove uri from index
+            @param uri as str
+        """
+        self.__apply(self.__index, False, uri)
+        for pending in self.__pendings:
+            pending.append((False, uri))
+
+    def get(self, value):
+        """
+            Get best completion for value
+            @param value as str
+            @return (completed value, uri) as (str, str)/None
+        """
+        lower = value.lower()
+        if lower.startswith("www."):
+            value_stripped = value[4:]
+            lower = lower[4:]
+        else:
+            value_stripped = value
+        if not lower:
+            return None
+        (hosts, uris, paths, prefixes) = self.__index
+        split = lower.find("/")
+        # Complete host
+        if split == -1:
+            host = prefixes.get(lower)
+            if host is None:
+                return None
+            completion = host + "/"
+            uri = hosts[host][1] + "/"
+        # Complete path for host
+        else:
+            host = lower[:split]
+            prefix = value_stripped[split:]
+            host_paths = paths.get(host)
+            if host_paths is None:
+                return None
+            best = None
+            best_score = -1
+            i = bisect_left(host_paths, prefix)
+            while i < len(host_paths) and\
+                    host_paths[i].startswith(prefix):
+                score = uris[host + host_paths[i]][1]
+                if score > best_score:
+                    best = host_paths[i]
+                    best_score = score
+                i += 1
+            if best is None:
+                return None
+            completion = host + best
+            uri = uris[completion][0]
+        return (value + completion[len(lower):], uri)
+
+#######################
+# PRIVATE             #
+#######################
+    def __load(self, pending):
+        """
+            Build a new index from history
+            @param pending as [(bool, str)]: changes done while building
+            @thread safe
+        """
+        index = ({}, {}, {}, {})
+        now = time()
+        try:
+            with SqlCursor(El().history) as sql:
+                result = sql.execute("SELECT uri, popularity, mtime\
+                                      FROM history")
+                for (uri, popularity, mtime) in result:
+                    parsed = self.__parse(uri)
+                    if parsed is None:
+                        continue
+                    (host, path) = parsed
+                    score = (popularity + 1) *\
+                        self.__get_weight(now - mtime)
+                    self.__add(index, host, path, uri, score)
+            GLib.idle_add(self.__set_index, index, pending)
+        except Exception as e:
+            print("UriCompletion::__load():", e)
+            # Keep current index, stop recording changes for this one
+            GLib.idle_add(self.__pendings.remove, pending)
+
+    def __set_index(self, index, pending=None):
+        """
+            Set current index, replay changes done while building it
+            @param index as ({host: [score, origin]}, {key: [uri, score]},
+                             {host: [path]}, {prefix: host})
+            @param pending as [(bool, str)]/None: see __apply()
+        """
+        if pending is not None:
+            self.__pendings.remove(pending)
+            for (add, uri) in pending:
+                self.__apply(index, add, uri)
+        self.__index = index
+
+    def __apply(self, index, add, uri):
+        """
+            Add a visit for uri or remove it from index
+            @param index as tuple, see __set_index()
+            @param add as bool
+            @param uri as str
+        """
+        parsed = self.__parse(uri)
+        if parsed is None:
+            return
+        (host, path) = parsed
+        if add:
+            self.__add(index, host, path, uri, self.__BUCKETS[0][1])
+        else:
+            self.__remove(index, host, path)
+
+    def __add(self, index, host, path, uri, score):
+        """
+            Add score for uri to index
+            @param index as tuple, see __set_index()
+            @param host as str
+            @param path as str
+            @param uri as str
+            @param score as int
+        """
+        (hosts, uris, paths, prefixes) = index
+        key = host + path
+        if key in uris:
+            uris[key][0] = uri
+            uris[key][1] += score
+        else:
+            uris[key] = [uri, score]
+            if host in paths:
+                insort(paths[host], path)
+            else:
+                paths[host] = [path]
+        parsed = urlparse(uri)
+        origin = "%s://%s" % (parsed.scheme, parsed.netloc)
+        if host in hosts:
+            hosts[host][0] += score
+            hosts[host][1] = origin
+        else:
+            hosts[host] = [score, origin]
+        # Scores only grow here, so just check against current best
+        score = hosts[host][0]
+        for i in range(1, len(host) + 1):
+            prefix = host[:i]
+            best = prefixes.get(prefix)
+            if best is None or best == host or hosts[best][0] < score:
+                prefixes[prefix] = host
+
+    def __remove(self, index, host, path):
+        """
+            Remove uri from index
+            @param index as tuple, see __set_index()
+            @param host as str
+            @param path as str
+        """
+        (hosts, uris, paths, prefixes) = index
+        key = host + path
+        if key not in uris:
+            return
+        (uri, score) = uris.pop(key)
+        host_paths = paths[host]
+        del host_paths[bisect_left(host_paths, path)]
+        hosts[host][0] -= score
+        if not host_paths:
+            del paths[host]
+            del hosts[host]
+        # Host score dropped or host is gone, find new best hosts for its
+        # prefixes
+        for i in range(1, len(host) + 1):
+            prefix = host[:i]
+            if prefixes.get(prefix) != host:
+                continue
+            best = None
+            for candidate in hosts.keys():
+                if candidate.startswith(prefix) and (
+                        best is None or hosts[candidate][0] > hosts[best][0]):
+                    best = candidate
+            if best is None:
+                del prefixes[prefix]
+            else:
+                prefixes[prefix] = best
+
+    def __parse(self, uri):
+        """
+            Get index host and path for uri
+            @param uri as str
+            @return (str, str)/None
+        """
+        parsed = urlparse(uri)
+        if parsed.scheme not in ["http", "https"] or not parsed.netloc:
+            return None
+        host = parsed.netloc.lower()
+        if host.startswith("www."):
+            host = host[4:]
+        return (host, parsed.path.rstrip("/"))
+
+    def __get_weight(self, age):
+        """
+            Get frecency weight for age
+            @param age in seconds as float
+            @return int
+        """
+        days = age / 86400
+        for (max_days, weight) in self.__BUCKETS:
+            if days <= max_days:
+                return weight
+        return self.__DEFAULT_WEIGHT
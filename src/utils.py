@@ -13,7 +13,9 @@
 from gi.repository import Gdk, GLib
 
 import unicodedata
-from urllib.parse import urlparse
+import re
+from html import unescape
+from urllib.parse import urlparse, parse_qsl, urlencode
 import string
 import sqlite3
 import cairo
@@ -22,6 +24,14 @@ from base64 import b64encode
 
 from eolie.define import El, ArtSize
 
+# Ordered as ASCII, so keys can be compared as strings by SQLite
+POSITION_KEY_DIGITS = string.digits + string.ascii_uppercase +\
+    string.ascii_lowercase
+POSITION_KEY_SIZE = 4
+# Query parameters only used for tracking, ignored by get_canonical_uri()
+TRACKING_PARAMS = ["fbclid", "gclid", "dclid", "msclkid", "mc_cid",
+                   "mc_eid", "igshid", "yclid", "_hsenc", "_hsmi"]
+
 
 def get_favicon_best_uri(uri):
     """
@@ -100,6 +110,65 @@ def noaccents(string):
         return u"".join([c for c in nfkd_form if not unicodedata.combining(c)])
 
 
+def get_normalized(string):
+    """
+        Return string normalized for search (no accents, casefolded)
+        @param string as str
+        @return str
+    """
+    return noaccents(string).casefold()
+
+
+def get_text_from_html(html):
+    """
+        Get plain text from html markup
+        @param html as str
+        @return str
+    """
+    text = re.sub(r"<[^>]*>", " ", html)
+    return " ".join(unescape(text).split())
+
+
+def get_position_key(position):
+    """
+        Get a sortable key for an integer position
+        First digit is not used, so there is always room before a key
+        @param position as int
+        @return str
+    """
+    key = ""
+    for i in range(POSITION_KEY_SIZE):
+        key = POSITION_KEY_DIGITS[1 + position % 61] + key
+        position //= 61
+    return key
+
+
+def get_position_key_between(before, after):
+    """
+        Get a key sorting between before and after keys
+        Keys never end with first digit, so there is always room before
+        @param before as str, "" for first position
+        @param after as str, "" for last position
+        @return str
+    """
+    key = ""
+    i = 0
+    bounded = after != ""
+    while True:
+        low = POSITION_KEY_DIGITS.index(before[i]) if i < len(before) else 0
+        if bounded and i < len(after):
+            high = POSITION_KEY_DIGITS.index(after[i])
+        else:
+            high = 62
+        if high - low > 1:
+            return key + POSITION_KEY_DIGITS[(low + high) // 2]
+        key += POSITION_KEY_DIGITS[low]
+        # Key is now lower than after, whatever comes next
+        if low < high:
+            bounded = False
+        i += 1
+
+
 def get_ftp_cmd():
     """
         Try to guess best ftp app
@@ -138,3 +207,37 @@ def strip_uri(uri, prefix=True, suffix=True):
     else:
         new_uri = parsed.netloc
     return new_uri.rstrip('/')
+
+
+def get_canonical_uri(uri):
+    """
+        Get uri used to detect duplicates: http/https, www., default
+        ports, fragment, tracking parameters and trailing / are ignored
+        @param uri as str
+        @return str
+    """
+    uri = uri.strip()
+    try:
+        parsed = urlparse(uri)
+    except ValueError:
+        return uri.rstrip('/')
+    scheme = parsed.scheme.lower()
+    if scheme not in ["http", "https"] or not parsed.netloc:
+        return uri.split("#")[0].rstrip('/')
+    netloc = parsed.netloc.lower()
+    if "@" in netloc:
+        netloc = netloc.split("@")[-1]
+    if netloc.endswith(":80") or netloc.endswith(":443"):
+        netloc = netloc.rsplit(":", 1)[0]
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    params = [(key, value)
+              for (key, value) in parse_qsl(parsed.query,
+                                            keep_blank_values=True)
+              if not key.startswith("utm_") and key not in TRACKING_PARAMS]
+    canonical = netloc + parsed.path.rstrip('/')
+    if parsed.params:
+        canonical += ";" + parsed.params
+    if params:
+        canonical += "?" + urlencode(params)
+    return canonical
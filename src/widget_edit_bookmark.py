@@ -13,7 +13,6 @@
 from gi.repository import Gtk, GLib
 
 from locale import strcoll
-from time import time
 from gettext import gettext as _
 
 from eolie.define import El
@@ -68,19 +67,7 @@ class TagWidget(Gtk.FlowBoxChild):
         tag_id = El().bookmarks.get_tag_id(title)
         if tag_id is not None:
             return
-        # Update mtime for all tagged bookmarks
-        if El().sync_worker is not None:
-            mtimes = El().sync_worker.mtimes
-            if mtimes["bookmarks"] == 0:
-                mtime = round(time(), 2)
-            else:
-                mtime = mtimes["bookmarks"]
-            tag_id = El().bookmarks.get_tag_id(previous)
-            if tag_id is None:
-                return
-            for (bookmark_id, bookmark_title, uri) in\
-                    El().bookmarks.get_bookmarks(tag_id):
-                El().bookmarks.set_mtime(bookmark_id, mtime + 1)
+        # Tagged bookmarks are added to sync change log
         El().bookmarks.rename_tag(previous, title)
         self.__label.set_text(title)
 
@@ -251,17 +238,9 @@ class EditBookmarkWidget(Gtk.Bin):
         El().bookmarks.set_uri(self.__bookmark_id,
                                self.__uri_entry.get_text())
         self.get_parent().set_visible_child_name("bookmarks")
+        El().bookmarks.clean_tags()
         if El().sync_worker is not None:
-            mtimes = El().sync_worker.mtimes
-            if mtimes["bookmarks"] == 0:
-                El().bookmarks.set_mtime(self.__bookmark_id,
-                                         round(time(), 2) + 1)
-            else:
-                El().bookmarks.set_mtime(self.__bookmark_id,
-                                         mtimes["bookmarks"] + 1)
-            El().bookmarks.clean_tags()
-            if El().sync_worker is not None:
-                El().sync_worker.sync()
+            El().sync_worker.sync()
         GLib.timeout_add(1000, self.destroy)
 
     def _on_del_clicked(self, button):
@@ -373,17 +352,9 @@ class EditBookmarkWidget(Gtk.Bin):
                                  self.__title_entry.get_text())
         El().bookmarks.set_uri(self.__bookmark_id,
                                self.__uri_entry.get_text())
+        El().bookmarks.clean_tags()
         if El().sync_worker is not None:
-            mtimes = El().sync_worker.mtimes
-            if mtimes["bookmarks"] == 0:
-                El().bookmarks.set_mtime(self.__bookmark_id,
-                                         round(time(), 2) + 1)
-            else:
-                El().bookmarks.set_mtime(self.__bookmark_id,
-                                         mtimes["bookmarks"] + 1)
-            El().bookmarks.clean_tags()
-            if El().sync_worker is not None:
-                El().sync_worker.sync()
+            El().sync_worker.sync()
 
     def __on_tag_activated(self, flowbox, child):
         """
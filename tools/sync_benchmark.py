@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 Cedric Bellegarde <cedric.bellegarde@adishatz.org>
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Developer benchmarks for sync, not installed
+# Run with PYTHONPATH pointing to the directory containing installed eolie
+# module, ex: PYTHONPATH=/usr/lib/python3/site-packages
+#
+# Usage: sync_benchmark.py decrypt
+#        sync_benchmark.py server [HISTORY_COUNT [BOOKMARKS_COUNT]]
+
+import sys
+
+
+def decrypt():
+    """
+        Measure sync records decrypt throughput
+    """
+    from eolie.sync_crypto import benchmark
+    for (workers, speed) in benchmark():
+        print("%s worker(s): %d records/s" % (workers, speed))
+
+
+def server(args):
+    """
+        Measure sync transfer against a local server, records are not
+        applied to databases
+        @param args as [str]: optional history and bookmarks counts
+    """
+    sizes = []
+    for arg in args[:2]:
+        if not arg.isdigit():
+            break
+        sizes.append(int(arg))
+    from eolie.sync_server import benchmark
+    for (step, records, seconds, requests, size) in benchmark(*sizes):
+        print("%s: %d records, %.2fs, %d requests, %d bytes" % (
+              step, records, seconds, requests, size))
+
+
+# Decrypt workers are spawned and import this script again
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "decrypt":
+        decrypt()
+    elif len(sys.argv) > 1 and sys.argv[1] == "server":
+        server(sys.argv[2:])
+    else:
+        sys.exit("Usage: sync_benchmark.py decrypt\n"
+                 "       sync_benchmark.py server"
+                 " [HISTORY_COUNT [BOOKMARKS_COUNT]]")